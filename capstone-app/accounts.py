@@ -0,0 +1,68 @@
+"""Account deletion, in the background.
+
+Deleting an account in the request would mean deleting every dive of a
+heavy user in one long transaction. Instead, delete_account marks the
+user deleted (users.deleted_at) and queues purge_user. From then on they
+can't log in, their pages and search results are hidden, and their
+leaderboard places are given up at the next ranking.
+
+purge_user deletes ACCOUNT_PURGE_BATCH_SIZE of the user's dives per job
+with one set-based DELETE, then queues itself again for the next batch.
+Each batch is its own short transaction, and other jobs get to run in
+between. That covers the dives they logged and the dives they were the
+buddy on, as before. ON DELETE CASCADE removes each dive's divetypes and
+profile in the database, so none of it is loaded. The last job deletes
+the user row, and the cascade takes their buddies, stats and leaderboard
+places with it. Every batch queues a refresh of the stats of the divers
+and divesites it touched, and expires those divers' cached fragments and
+analytics.
+"""
+
+from flask import current_app
+from sqlalchemy import or_, select
+
+from fragment_cache import fragment_cache
+import generations
+from jobs import enqueue, task
+from leaderboards import rank_users, rerank_soon
+from models import db, utcnow, Dive, User
+
+def init_app(app):
+    app.config.setdefault('ACCOUNT_PURGE_BATCH_SIZE', 500)
+
+def delete_account(user):
+    """Marks `user` deleted and queues the purge of their data. The caller
+    commits."""
+
+    user.deleted_at = utcnow()
+    enqueue('purge_user', user.id)
+    rerank_soon(user.id)
+
+@task
+def purge_user(user_id):
+    """Deletes the next batch of a deleted user's dives, or the user once
+    none are left."""
+
+    batch = db.session.execute(
+        select(Dive.id, Dive.user_id, Dive.divesite_id)
+        .where(or_(Dive.user_id == user_id, Dive.buddy_id == user_id))
+        .limit(current_app.config['ACCOUNT_PURGE_BATCH_SIZE'])
+    ).all()
+
+    if batch:
+        db.session.execute(Dive.__table__.delete().where(Dive.id.in_([row.id for row in batch])))
+        generations.bump(generations.DIVES, generations.DIVES_REMOVED)
+
+        divers = sorted({row.user_id for row in batch} - {user_id})
+        if divers:
+            enqueue('refresh_user_stats', *divers)
+            fragment_cache.bump(*divers)
+        enqueue('refresh_divesite_stats', *sorted({row.divesite_id for row in batch}))
+        enqueue('purge_user', user_id)
+        return
+
+    # Gives up their places first; the cascade would leave gaps behind them
+    rank_users([user_id])
+    db.session.execute(User.__table__.delete().where(User.id == user_id, User.deleted_at.is_not(None)))
+    # Drops whatever is left of their stats and re-ranks the leaderboards
+    enqueue('refresh_user_stats', user_id)
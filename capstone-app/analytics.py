@@ -0,0 +1,128 @@
+"""A diver's analytics: dives over time, depth and bottom time spreads,
+rating trend, where they dive, with whom and what kind of dives.
+
+Everything comes from one query. It pulls the user's dive columns into
+NumPy arrays, and the grouping for every chart is done on those arrays
+(bincount, unique, histogram) rather than with a SQL aggregate per
+chart. The result is small (one number per bar) and is cached per user
+under their fragment_cache version, which the dive routes already bump,
+as does deleting a divesite for everyone who dived it. So the work is
+redone only after the diver's dives change.
+"""
+
+from datetime import date
+
+import numpy as np
+from sqlalchemy import select
+
+from fragment_cache import fragment_cache
+from heatmap import DIVE_TYPES
+from models import db, Dive, Divesite, Divetype
+
+DEPTH_BIN = 10
+BOTTOM_TIME_BIN = 10
+TOP_BUDDIES = 10
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def dive_columns(user_id):
+    """The statement selecting the columns the charts need, one row per dive."""
+
+    return (
+        select(
+            Dive.date, Dive.max_depth, Dive.bottom_time, Dive.rating, Dive.buddy_id,
+            Divesite.country, Divesite.continent,
+            *(getattr(Divetype, name) for name in DIVE_TYPES)
+        )
+        .join(Divesite, Divesite.id == Dive.divesite_id)
+        .outerjoin(Divetype, Divetype.dive_id == Dive.id)
+        .where(Dive.user_id == user_id)
+    )
+
+def user_analytics(user_id):
+    """The analytics of a user, from the cache when their dives haven't
+    changed since."""
+
+    key = f"analytics:{user_id}.{fragment_cache.version(user_id)}"
+    result = fragment_cache.backend.get(key)
+
+    if result is None:
+        result = compute(db.session.execute(dive_columns(user_id)).all())
+        fragment_cache.backend.set(key, result, fragment_cache.timeout)
+
+    return result
+
+def compute(rows):
+    """Every chart's numbers from dive_columns rows, as plain lists that
+    pickle small."""
+
+    if not rows:
+        return None
+
+    columns = list(zip(*rows))
+    # Much quicker than letting NumPy convert the date objects itself
+    dates = (np.fromiter((day.toordinal() for day in columns[0]), dtype=np.int64, count=len(rows))
+             - EPOCH_ORDINAL).astype('datetime64[D]')
+    depths = np.array(columns[1], dtype=float)
+    bottom_times = np.array(columns[2], dtype=float)
+    ratings = np.array(columns[3], dtype=float)
+    # Dives without a divetypes row have None for every type
+    types = np.array(columns[7:], dtype=bool).T
+
+    months, per_month, rating_by_month = by_period(dates, ratings, 'M')
+    years, per_year, _ = by_period(dates, ratings, 'Y')
+
+    return {
+        'num_dives': len(rows),
+        'first_month': months[0],
+        'last_month': months[-1],
+        'dives_per_month': list(zip(months, per_month)),
+        'rating_by_month': [(month, rating) for month, rating in zip(months, rating_by_month) if rating is not None],
+        'dives_per_year': list(zip(years, per_year)),
+        'depths': binned(depths, DEPTH_BIN),
+        'bottom_times': binned(bottom_times, BOTTOM_TIME_BIN),
+        'countries': counted(columns[5]),
+        'continents': counted(columns[6]),
+        'buddies': counted(columns[4])[:TOP_BUDDIES],
+        'dive_types': sorted(
+            ((name, int(count)) for name, count in zip(DIVE_TYPES, types.sum(axis=0)) if count),
+            key=lambda item: -item[1]
+        ),
+    }
+
+def by_period(dates, ratings, unit):
+    """Labels, dive counts and average ratings of every month ('M') or year
+    ('Y') from the first dive to the last, gaps included."""
+
+    periods = dates.astype(f'datetime64[{unit}]')
+    first = periods.min()
+    offsets = (periods - first).astype(np.int64)
+    size = int(offsets.max()) + 1
+
+    counts = np.bincount(offsets, minlength=size)
+    rating_sums = np.bincount(offsets, weights=ratings, minlength=size)
+    averages = np.divide(rating_sums, counts, out=np.full(size, np.nan), where=counts > 0)
+
+    labels = np.arange(first, first + size).astype(str).tolist()
+    return labels, counts.tolist(), [None if np.isnan(value) else round(float(value), 1) for value in averages]
+
+def binned(values, width):
+    """("low-high", count) of each `width` wide bin from 0 to the largest value."""
+
+    top = max(float(values.max()), 0.0)
+    edges = np.arange(0, top + width, width)
+    counts, edges = np.histogram(values, bins=edges if len(edges) > 1 else [0, width])
+    edges = edges.astype(int).tolist()
+    return [(f"{low}-{high}", count) for low, high, count in zip(edges, edges[1:], counts.tolist())]
+
+def counted(values):
+    """(value, count) pairs, most frequent first. Missing values are left out."""
+
+    values = np.array(values, dtype=object)
+    values = values[np.not_equal(values, None)]
+    if values.size == 0:
+        return []
+
+    # np.unique sorts, so ties stay in order of value
+    unique, counts = np.unique(values, return_counts=True)
+    order = np.argsort(-counts, kind='stable')
+    return [(unique[i], int(counts[i])) for i in order]
@@ -0,0 +1,211 @@
+"""Async JSON API for the map and search, served over ASGI.
+
+The map's divesite lookups and search autocomplete are many small, cheap
+reads. On the Flask workers one slow query holds up every request queued
+behind it; here a single process keeps many of them in flight on an
+async connection pool. Run it next to the Flask app and route /api/ to
+it, e.g.:
+
+    uvicorn api:api --workers 2 --port 5001
+
+Queries use the tables from models.py, so the schema is shared with the
+Flask app. Everything here is read-only, so it reads from
+DATABASE_REPLICA_URL when that's set, otherwise DATABASE_URL, and uses
+the same DATABASE_POOL_SIZE and DATABASE_MAX_OVERFLOW settings.
+
+Identical requests that arrive while the first is still being answered
+share its result instead of querying again (see Coalescer).
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from models import Divesite, User
+
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+class Coalescer:
+    """Runs one coroutine per key at a time, sharing its result.
+
+    While a call for a key is running, later calls with the same key wait
+    for it rather than starting their own. Results aren't kept once the
+    call finishes.
+    """
+
+    def __init__(self):
+        self._running = {}
+
+    async def run(self, key, make_coroutine):
+        task = self._running.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(make_coroutine())
+            self._running[key] = task
+            task.add_done_callback(lambda _: self._running.pop(key, None))
+
+        # shield, so one client disconnecting doesn't cancel the query for the rest
+        return await asyncio.shield(task)
+
+def async_database_url(url):
+    """The same database as `url`, through an async driver."""
+
+    url = make_url(url)
+    backend = url.get_backend_name()
+
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend} databases")
+
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+def make_engine(url):
+    options = {}
+    if not url.startswith('sqlite'):
+        options = {
+            'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW', 10)),
+            'pool_recycle': int(os.environ.get('DATABASE_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': True,
+        }
+
+    return create_async_engine(async_database_url(url), **options)
+
+def database_url():
+    return (os.environ.get('DATABASE_REPLICA_URL')
+            or os.environ.get('DATABASE_URL', 'postgresql:///social-scuba-app'))
+
+##############################################################################
+# Endpoints
+
+def float_arg(request, name):
+    try:
+        return float(request.query_params[name])
+    except (KeyError, ValueError):
+        return None
+
+def limit_arg(request):
+    try:
+        limit = int(request.query_params.get('limit', SEARCH_LIMIT))
+    except ValueError:
+        return SEARCH_LIMIT
+    return max(1, min(limit, MAX_SEARCH_LIMIT))
+
+def contains(text):
+    """An ILIKE pattern matching `text` anywhere, with its own wildcards
+    escaped; use with escape='\\'."""
+
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+async def fetch_all(request, statement):
+    """Runs `statement` once for all identical concurrent requests."""
+
+    engine = request.app.state.engine
+    key = str(statement.compile(engine, compile_kwargs={'literal_binds': True}))
+
+    async def query():
+        async with engine.connect() as conn:
+            result = await conn.execute(statement)
+            return [dict(row) for row in result.mappings()]
+
+    return await request.app.state.coalescer.run(key, query)
+
+BOUNDS = ('ne_lat', 'ne_lng', 'sw_lat', 'sw_lng')
+
+async def divesites_in_bounds(request):
+    """Divesites within the map's bounds; the same JSON as /get_dive_sites,
+    including the {"added", "removed"} change when the previous bounds are
+    passed."""
+
+    bounds = [float_arg(request, name) for name in BOUNDS]
+    if None in bounds:
+        return JSONResponse({'error': "ne_lat, ne_lng, sw_lat and sw_lng are required numbers"}, 400)
+    in_view = Divesite.within(*bounds)
+
+    columns = select(
+        Divesite.id,
+        Divesite.name,
+        Divesite.lat.label('latitude'),
+        Divesite.lng.label('longitude')
+    ).order_by(Divesite.id)
+
+    previous = [float_arg(request, f"prev_{name}") for name in BOUNDS]
+    if None in previous:
+        return JSONResponse(await fetch_all(request, columns.where(in_view)))
+
+    in_previous_view = Divesite.within(*previous)
+    added, removed = await asyncio.gather(
+        fetch_all(request, columns.where(in_view, ~in_previous_view)),
+        fetch_all(request, select(Divesite.id).where(in_previous_view, ~in_view))
+    )
+
+    return JSONResponse({'added': added, 'removed': [site['id'] for site in removed]})
+
+async def search_divesites(request):
+    """Divesites whose name contains `q`, for autocomplete."""
+
+    q = request.query_params.get('q', '').strip()
+    if not q:
+        return JSONResponse([])
+
+    statement = (
+        select(Divesite.id, Divesite.name, Divesite.location)
+        .where(Divesite.name.ilike(contains(q), escape='\\'))
+        .order_by(Divesite.name, Divesite.id)
+        .limit(limit_arg(request))
+    )
+
+    return JSONResponse(await fetch_all(request, statement))
+
+async def search_users(request):
+    """Users whose username contains `q`, for autocomplete."""
+
+    q = request.query_params.get('q', '').strip()
+    if not q:
+        return JSONResponse([])
+
+    statement = (
+        select(User.id, User.username, User.image_url)
+        .where(User.username.ilike(contains(q), escape='\\'), User.deleted_at.is_(None))
+        .order_by(User.username)
+        .limit(limit_arg(request))
+    )
+
+    return JSONResponse(await fetch_all(request, statement))
+
+##############################################################################
+# App
+
+def create_api(url=None):
+    """Build the ASGI app. The engine is made at startup, in each worker."""
+
+    @asynccontextmanager
+    async def lifespan(app):
+        app.state.engine = make_engine(url or database_url())
+        app.state.coalescer = Coalescer()
+        yield
+        await app.state.engine.dispose()
+
+    return Starlette(
+        routes=[
+            Route('/api/divesites', divesites_in_bounds),
+            Route('/api/search/divesites', search_divesites),
+            Route('/api/search/users', search_users),
+        ],
+        lifespan=lifespan
+    )
+
+api = create_api()
@@ -1,39 +1,112 @@
 import os
-from flask import Flask, render_template, request, flash, redirect, session, g, jsonify
+from datetime import date
+from flask import Flask, Blueprint, render_template, request, flash, redirect, session, g, jsonify, abort
 from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
 
-from models import db, connect_db, User, Dive, Divesite, Buddy, Divetype
+import generations
+from models import db, connect_db, hasher, User, Dive, Divesite, Buddy, Divetype
 from forms import UserAddForm, UserEditForm, LoginForm, DiveForm, DiveEditForm, DivesiteForm
+from countries import CONTINENTS, country_names
+from hashing import HashingBusy
+from static_maps import static_map_url, init_app as init_static_maps
+from images import init_app as init_images
+from fragment_cache import fragment_cache, invalidate_user_fragments
+from search_cache import DIVESITES, USERS, normalise, search_cache
+from instrumentation import init_app as init_instrumentation
+from profiler import init_app as init_profiler
+from http_cache import cache_policy, REVALIDATE_PRIVATE, REVALIDATE_PUBLIC, init_app as init_http_cache
+from compression import init_app as init_compression
+from replicas import read_only
+from catalogue import init_app as init_catalogue
+from jobs import enqueue, init_app as init_jobs
+from accounts import delete_account, init_app as init_accounts
+from stats import init_app as init_stats
+from heatmap import DIVE_TYPES, heatmap
+from logbook import FORMATS as LOGBOOK_FORMATS, logbook_response, init_app as init_logbook
+from profiles import chart as profile_chart, summary as profile_summary
+from leaderboards import BOARDS, REGIONAL_BOARDS, WORLD, place, scope_for, top, init_app as init_leaderboards
+from analytics import user_analytics
+from buddy_graph import add_buddies, buddy_ids, remove_buddies, suggestions
 from secret import SECRET_KEY, GOOGLE_API_KEY
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'postgresql:///social-scuba-app')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
+main = Blueprint('main', __name__)
 
-connect_db(app)
+def create_app(config=None):
+    """Build the app. Settings come from the environment; `config` overrides them.
 
-with app.app_context():
-    db.create_all()
+    Nothing here touches the database: connections are opened on first
+    use (in each worker, after forking) and the schema is created and
+    upgraded with flask db upgrade, not at startup.
+    """
 
-app.config['SECRET_KEY'] = SECRET_KEY
+    app = Flask(__name__)
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+
+    app.config['STATIC_MAPS_API_KEY'] = GOOGLE_API_KEY
+    app.config['SLOW_REQUEST_QUERIES'] = int(os.environ.get('SLOW_REQUEST_QUERIES', 30))
+    app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', 500))
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    app.config['LEADERBOARD_RANK_DELAY'] = int(os.environ.get('LEADERBOARD_RANK_DELAY', 30))
+    app.config['PROFILER_TOKEN'] = os.environ.get('PROFILER_TOKEN')
+    app.config['PROFILER_SAMPLE_RATE'] = float(os.environ.get('PROFILER_SAMPLE_RATE', 0))
+    # Where the map fetches divesites: this app's /get_dive_sites, or the
+    # async API (/api/divesites, see api.py) when that's deployed
+    app.config['MAP_DIVESITES_URL'] = os.environ.get('MAP_DIVESITES_URL', '/get_dive_sites')
+
+    app.config['SECRET_KEY'] = SECRET_KEY
+    app.config.update(config or {})
+
+    connect_db(app)
+    init_instrumentation(app)
+    init_profiler(app)
+    hasher.init_app(app)
+    init_static_maps(app)
+    init_images(app)
+    init_http_cache(app)
+    init_compression(app)
+    init_catalogue(app)
+    init_jobs(app)
+    init_accounts(app)
+    init_stats(app)
+    init_leaderboards(app)
+    init_logbook(app)
+    fragment_cache.init_app(app)
+    search_cache.init_app(app)
+
+    app.register_blueprint(main)
+    return app
 
 ##############################################################################
 # User signup/login/logout
 
-@app.before_request
+@main.before_app_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
         g.user = User.query.get(session[CURR_USER_KEY])
 
+        if g.user is not None and g.user.deleted_at is not None:
+            do_logout()
+            g.user = None
+
     else:
         g.user = None
 
+def get_user_or_404(user_id):
+    """The user with this id, or a 404 if there isn't one or they've deleted
+    their account."""
+
+    user = User.query.get_or_404(user_id)
+    if user.deleted_at is not None:
+        abort(404)
+    return user
+
 def do_login(user):
     """Log in user."""
     session[CURR_USER_KEY] = user.id
@@ -43,7 +116,7 @@ def do_logout():
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
 
-@app.route('/signup', methods=["GET", "POST"])
+@main.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -66,11 +139,17 @@ def signup():
                 last_name=form.last_name.data
             )
             db.session.commit()
+            search_cache.bump(USERS)
 
         except IntegrityError:
             flash("Username already in use", 'danger')
             return render_template('users/signup.html', form=form)
 
+        except HashingBusy:
+            db.session.rollback()
+            flash("Too many people signing up right now, please try again.", 'warning')
+            return render_template('users/signup.html', form=form), 503
+
         do_login(user)
 
         return redirect("/")
@@ -78,17 +157,23 @@ def signup():
     else:
         return render_template('users/signup.html', form=form)
     
-@app.route('/login', methods=["GET", "POST"])
+@main.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
     form = LoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data,
-                                 form.password.data)
+        try:
+            user = User.authenticate(form.username.data,
+                                     form.password.data)
+        except HashingBusy:
+            flash("Too many people logging in right now, please try again.", 'warning')
+            return render_template('users/login.html', form=form), 503
 
         if user:
+            # saves the new hash if authenticate upgraded it
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -97,7 +182,7 @@ def login():
 
     return render_template('users/login.html', form=form)
 
-@app.route('/logout')
+@main.route('/logout')
 def logout():
     """Handle logout of user."""
 
@@ -107,75 +192,116 @@ def logout():
 ##############################################################################
 # API routes and routes for Google Maps integration:
 
-def generate_static_map_url(lat, lng):
-    # Gets static map for individual dive
-    map_size = '800x400'
-    zoom_level = 11
-
-    static_map_url = f'https://maps.googleapis.com/maps/api/staticmap?center={lat},{lng}&zoom={zoom_level}&size={map_size}&markers={lat},{lng}&key={GOOGLE_API_KEY}'
-
-    return static_map_url
-
-@app.route("/get_dive_sites")
+@main.route("/get_dive_sites")
+@read_only
+@cache_policy(REVALIDATE_PUBLIC)
 def get_divesites():
-    """Returns JSON of divesites in specified map bounds"""
+    """Returns JSON of divesites in specified map bounds.
+
+    If the map's previous bounds are passed too (prev_ne_lat, prev_ne_lng,
+    prev_sw_lat, prev_sw_lng), only the change is sent back:
+    {"added": [sites now in view that weren't], "removed": [ids of sites
+    that were in view and aren't any more]}.
+    """
 
     # Get NE and SW latitude and longitude values from query parameters
     ne_lat = float(request.args.get('ne_lat'))
     ne_lng = float(request.args.get('ne_lng'))
     sw_lat = float(request.args.get('sw_lat'))
     sw_lng = float(request.args.get('sw_lng'))
+    in_view = Divesite.within(ne_lat, ne_lng, sw_lat, sw_lng)
+
+    previous = [request.args.get(f"prev_{name}", type=float) for name in ('ne_lat', 'ne_lng', 'sw_lat', 'sw_lng')]
+    if None in previous:
+        # Fetch divesites within the specified bounds from the database
+        return jsonify([divesite_json(site) for site in Divesite.query.filter(in_view)])
+
+    in_previous_view = Divesite.within(*previous)
+    added = Divesite.query.filter(in_view, ~in_previous_view)
+    removed = db.session.scalars(db.select(Divesite.id).where(in_previous_view, ~in_view))
+
+    return jsonify({
+        "added": [divesite_json(site) for site in added],
+        "removed": list(removed)
+    })
+
+def divesite_json(site):
+    """What the map needs to show a divesite's marker."""
+
+    return {
+        "id":site.id,
+        "name":site.name,
+        "latitude":site.lat,
+        "longitude":site.lng
+    }
+
+@main.route("/heatmap")
+@read_only
+@cache_policy(REVALIDATE_PRIVATE)
+def dive_heatmap():
+    """Returns JSON of dive counts on a lat/lng grid, for the map's heatmap.
+
+    Takes the map's `zoom` and optionally its bounds (ne_lat, ne_lng,
+    sw_lat, sw_lng). Dives can be filtered by date (`start`, `end`, as
+    YYYY-MM-DD), dive `type`, and `buddies_of` a user (logged in only).
+    See heatmap.heatmap for the format.
+    """
+
+    bounds = [request.args.get(name, type=float) for name in ('ne_lat', 'ne_lng', 'sw_lat', 'sw_lng')]
+    dive_type = request.args.get('type')
+
+    if dive_type is not None and dive_type not in DIVE_TYPES:
+        return jsonify({"error": f"type must be one of {', '.join(DIVE_TYPES)}"}), 400
 
-   # Fetch divesites within the specified bounds from the database
-    divesites = Divesite.query.filter(
-        Divesite.lat.between(sw_lat, ne_lat),
-        Divesite.lng.between(sw_lng, ne_lng)
-    ).all()
-
-    json_to_return = []
-    for site in divesites:
-        json_to_return.append({
-            "id":site.id,
-            "name":site.name,
-            "latitude":site.lat,
-            "longitude":site.lng
-        })
-    return jsonify(json_to_return)
+    buddies_of = request.args.get('buddies_of', type=int) if g.user else None
+
+    return jsonify(heatmap(
+        request.args.get('zoom', 0, type=int),
+        bounds=None if None in bounds else bounds,
+        start=request.args.get('start', type=date.fromisoformat),
+        end=request.args.get('end', type=date.fromisoformat),
+        dive_type=dive_type,
+        buddies_of=buddies_of
+    ))
 
 ##############################################################################
 # General user routes:
 
-@app.route('/search')
+@main.route('/search')
+@read_only
 def search():
     """Page with listing of either users or divesites.
     Takes a 'category' param to determine which database to search, users or divesites.
     Takes a 'q' param in querystring to search by that divesite/username.
     Takes a 'pagination' param for pagination.
+    Results are cached, see search_cache.py.
     """
     search = request.args.get('q')
     category = request.args.get('category')
+    query = normalise(search)
 
     # Set the page number from the query parameter, default to 1
     page = request.args.get('page', 1, type=int)
     per_page = 12
 
     if category == "users":
-        if not search:
-            pagination = User.query.paginate(page=page, per_page=per_page, error_out=False)
-        else:
-            pagination = User.query.filter(User.username.ilike(f"%{search}%")).paginate(page=page, per_page=per_page, error_out=False)
+        users = User.query.options(joinedload(User.stats)).filter(User.deleted_at.is_(None)).order_by(User.id)
+        if query:
+            users = users.filter(User.username.ilike(f"%{query}%"))
 
+        pagination = search_cache.paginate(USERS, query, users, User, page, per_page)
         return render_template('users/index.html', users=pagination.items, pages=pagination, search=search, category=category)
     
     else:
-        if not search:
-            pagination = Divesite.query.paginate(page=page, per_page=per_page, error_out=False)
-        else:
-            pagination = Divesite.query.filter(Divesite.name.ilike(f"%{search}%")).paginate(page=page, per_page=per_page, error_out=False)
+        divesites = Divesite.query.options(joinedload(Divesite.stats)).order_by(Divesite.id)
+        if query:
+            divesites = divesites.filter(Divesite.name.ilike(f"%{query}%"))
 
+        pagination = search_cache.paginate(DIVESITES, query, divesites, Divesite, page, per_page)
         return render_template('divesites/index.html', divesites=pagination.items, pages=pagination, search=search, category=category)
 
-@app.route('/users/<int:user_id>')
+@main.route('/users/<int:user_id>')
+@read_only
 def users_show(user_id):
     """Show user profile."""
 
@@ -183,20 +309,16 @@ def users_show(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = get_user_or_404(user_id)
 
     if not user:
         flash("No user found.", "danger")
 
-    max_depth = user.get_max_depth()
-    max_bottom_time = user.get_max_bottom_time()
-    countries = user.get_unique_country_count()
-    continents = user.get_unique_continent_count()
-
     # TODO remove messages and get dives
     # user.messages won't be in order by default
     dives = (Dive
                 .query
+                .options(joinedload(Dive.divesite), joinedload(Dive.buddy), joinedload(Dive.divetypes))
                 .filter(Dive.user_id == user_id)
                 .order_by(Dive.date.desc())
                 .limit(100)
@@ -206,16 +328,28 @@ def users_show(user_id):
     return render_template(
                 'users/show.html',
                 user=user, 
-                dives=dives, 
-                max_depth=max_depth, 
-                max_bottom_time=max_bottom_time,
-                countries=countries,
-                continents=continents
+                dives=dives
             )
 
-@app.route('/users/delete', methods=["POST"])
+@main.route('/users/<int:user_id>/logbook.<fmt>')
+@read_only
+def users_logbook(user_id, fmt):
+    """Download a user's whole logbook as CSV, JSON or UDDF, streamed."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    if fmt not in LOGBOOK_FORMATS:
+        abort(404)
+
+    user = get_user_or_404(user_id)
+    return logbook_response(user, fmt)
+
+@main.route('/users/delete', methods=["POST"])
 def delete_user():
-    """Delete user."""
+    """Delete user. They're logged out and hidden straight away; their
+    data is removed by background jobs (see accounts.py)."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
@@ -223,12 +357,39 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    invalidate_user_fragments(g.user.id)
+    fragment_cache.bump(*buddy_ids(g.user.id))
+
+    delete_account(g.user)
     db.session.commit()
+    search_cache.bump(USERS)
 
     return redirect("/signup")
 
-@app.route('/users/<int:user_id>/buddies')
+@main.route('/users/<int:user_id>/analytics')
+@read_only
+def users_analytics(user_id):
+    """Show charts of a user's dives: over time, by depth and bottom time,
+    by place, buddy and dive type."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user = get_user_or_404(user_id)
+    analytics = user_analytics(user.id)
+
+    if analytics and analytics['buddies']:
+        # Names are looked up each time, so renamed buddies show up at once
+        ids = [buddy_id for buddy_id, _ in analytics['buddies']]
+        names = dict(db.session.execute(db.select(User.id, User.username).where(User.id.in_(ids))).all())
+        analytics = dict(analytics, buddies=[(names.get(buddy_id, "(deleted)"), count)
+                                             for buddy_id, count in analytics['buddies']])
+
+    return render_template('users/analytics.html', user=user, analytics=analytics)
+
+@main.route('/users/<int:user_id>/buddies')
+@read_only
 def show_buddies(user_id):
     """Show list of people this user has added as buddies."""
 
@@ -236,10 +397,12 @@ def show_buddies(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/buddies.html', user=user)
+    user = get_user_or_404(user_id)
+    suggested = suggestions(g.user.id) if user.id == g.user.id else []
+    return render_template('users/buddies.html', user=user, suggestions=suggested)
 
-@app.route('/users/<int:user_id>/buddies-to')
+@main.route('/users/<int:user_id>/buddies-to')
+@read_only
 def show_buddies_to(user_id):
     """Show list of users who have added this user as a buddy."""
 
@@ -247,10 +410,10 @@ def show_buddies_to(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = get_user_or_404(user_id)
     return render_template('users/buddies_to.html', user=user)
 
-@app.route('/users/add-buddy/<int:buddy_id>', methods=["POST"])
+@main.route('/users/add-buddy/<int:buddy_id>', methods=["POST"])
 def add_buddy(buddy_id):
     """Adds a user as a buddy."""
 
@@ -258,13 +421,15 @@ def add_buddy(buddy_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(buddy_id)
-    g.user.buddies.append(followed_user)
+    get_user_or_404(buddy_id)
+    add_buddies(g.user.id, [buddy_id])
     db.session.commit()
 
+    fragment_cache.bump(g.user.id, buddy_id)
+
     return redirect(f"/users/{g.user.id}/buddies")
 
-@app.route('/users/remove-buddy/<int:buddy_id>', methods=['POST'])
+@main.route('/users/remove-buddy/<int:buddy_id>', methods=['POST'])
 def remove_buddy(buddy_id):
     """Have currently-logged-in-user remove other user from their buddy list."""
 
@@ -272,13 +437,14 @@ def remove_buddy(buddy_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    buddy_to_remove = User.query.get(buddy_id)
-    g.user.buddies.remove(buddy_to_remove)
+    remove_buddies(g.user.id, [buddy_id])
     db.session.commit()
 
+    fragment_cache.bump(g.user.id, buddy_id)
+
     return redirect(f"/users/{g.user.id}/buddies")
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@main.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
 
@@ -291,9 +457,13 @@ def profile():
     if form.validate_on_submit():
 
         # checks password field is correct
-        current_user = User.authenticate(g.user.username, form.password.data)
+        try:
+            password_ok = g.user.check_password(form.password.data)
+        except HashingBusy:
+            flash("Server busy, please try again.", "warning")
+            return render_template("/users/edit.html", form=form), 503
 
-        if not current_user:
+        if not password_ok:
             flash("Incorrect Password", "danger")
             return redirect("/")
         
@@ -304,12 +474,16 @@ def profile():
                 flash('Username is already taken', 'warning')
                 return redirect("/users/profile")
 
+        renamed = form.username.data != g.user.username
         g.user.username = form.username.data
         g.user.image_url = form.image_url.data
         g.user.header_image_url = form.header_image_url.data
         g.user.bio = form.bio.data
 
         db.session.commit()
+        invalidate_user_fragments(g.user.id)
+        if renamed:
+            search_cache.bump(USERS)
         flash('Profile successfully updated', 'success')
         return redirect(f"/users/{g.user.id}")
 
@@ -318,24 +492,21 @@ def profile():
 ##############################################################################
 # General divesite routes:
 
-@app.route("/divesites/map")
+@main.route("/divesites/map")
 def view_map():
     """Shows map of all divesites"""
     return render_template("divesites/map.html", GOOGLE_API_KEY=GOOGLE_API_KEY)
 
-@app.route('/divesites/new', methods=['GET', 'POST'])
+@main.route('/divesites/new', methods=['GET', 'POST'])
 def add_divesite():
     "Add a divesite through POST request, or show form for adding divesite"
 
-    from pycountry import countries
-    countries = [country.name for country in countries]
-
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
     form = DivesiteForm()
-    form.country.choices = countries
+    form.country.choices = list(country_names())
 
     if form.validate_on_submit():
         divesite = Divesite(
@@ -349,13 +520,18 @@ def add_divesite():
             api_id = str(g.user.id)
         )
         db.session.add(divesite)
+        generations.bump(generations.DIVESITES)
+        enqueue('rebuild_catalogue')
         db.session.commit()
+        search_cache.bump(DIVESITES)
 
         return redirect(f"/divesites/{divesite.id}")
     
     return render_template("divesites/new.html", form=form)
 
-@app.route("/divesites/<int:divesite_id>")
+@main.route("/divesites/<int:divesite_id>")
+@read_only
+@cache_policy(REVALIDATE_PRIVATE)
 def show_divesite(divesite_id):
     """Shows info on a single divesite"""
 
@@ -364,11 +540,18 @@ def show_divesite(divesite_id):
         return redirect("/")
 
     divesite = Divesite.query.get_or_404(divesite_id)
-    static_map = generate_static_map_url(divesite.lat, divesite.lng)
+    static_map = static_map_url(divesite.id, size='800x400')
+    dives = (Dive
+                .query
+                .options(joinedload(Dive.diver), joinedload(Dive.buddy), joinedload(Dive.divetypes))
+                .filter(Dive.divesite_id == divesite_id)
+                .order_by(Dive.date.desc())
+                .limit(100)
+                .all())
 
-    return render_template("divesites/show.html", user=g.user, divesite=divesite, static_map=static_map)
+    return render_template("divesites/show.html", user=g.user, divesite=divesite, dives=dives, static_map=static_map)
 
-@app.route("/divesites/<int:divesite_id>/delete", methods=["POST"])
+@main.route("/divesites/<int:divesite_id>/delete", methods=["POST"])
 def delete_divesite(divesite_id):
     """Deletes a divesite. Only works if user originally created the divesite"""
 
@@ -378,8 +561,20 @@ def delete_divesite(divesite_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
+    divers = db.session.query(Dive.user_id).filter(Dive.divesite_id == divesite.id).distinct()
+    diver_ids = sorted(row.user_id for row in divers)
+    if diver_ids:
+        enqueue('refresh_user_stats', *diver_ids)
+    enqueue('refresh_divesite_stats', divesite.id)
+    enqueue('rebuild_catalogue')
+    generations.bump(generations.DIVESITES, generations.DIVES, generations.DIVES_REMOVED)
+
     db.session.delete(divesite)
     db.session.commit()
+    search_cache.bump(DIVESITES)
+    # Their dives here went with the divesite
+    if diver_ids:
+        invalidate_user_fragments(*diver_ids)
 
     flash("Divesite deleted.", "warning")
     return redirect("/")
@@ -402,7 +597,7 @@ def _create_divetype_dict(data):
 
     return returned_dict
 
-@app.route('/divesites/<int:divesite_id>/new', methods=['GET', 'POST'])
+@main.route('/divesites/<int:divesite_id>/new', methods=['GET', 'POST'])
 def add_dive(divesite_id):
     "Add a dive, after already choosing divesite"
 
@@ -420,19 +615,25 @@ def add_dive(divesite_id):
 
         # convert meters to feet
         max_depth = form.max_depth.data
-        if form.depth_units.data == 'meters':
+        bottom_time = form.bottom_time.data
+        profile = form.profile
+
+        if profile is not None:
+            max_depth, bottom_time = profile_summary(profile)
+        elif form.depth_units.data == 'meters':
             max_depth = max_depth * 3.28084
 
         dive = Dive(
             user_id = g.user.id,
-            dive_no=len(g.user.dives)+1,
+            dive_no=db.session.query(func.count(Dive.id)).filter(Dive.user_id == g.user.id).scalar() + 1,
             divesite_id = divesite_id,
             date = form.date.data,
             rating = form.rating.data,
-            bottom_time = form.bottom_time.data,
+            bottom_time = bottom_time,
             max_depth = max_depth,
             buddy_id = form.buddy_id.data,
-            comments = form.comments.data
+            comments = form.comments.data,
+            profile = profile
         )
         
         # Make sure "no buddy" gets entered in as null
@@ -460,13 +661,18 @@ def add_dive(divesite_id):
         )
 
         db.session.add(divetype)
+        generations.bump(generations.DIVES)
+        enqueue('refresh_user_stats', g.user.id)
+        enqueue('refresh_divesite_stats', divesite_id)
         db.session.commit()
 
+        invalidate_user_fragments(g.user.id)
         return redirect(f'/users/{g.user.id}')
     
     return render_template('dives/new.html', form=form)
 
-@app.route('/dives/<int:dive_id>', methods=["GET"])
+@main.route('/dives/<int:dive_id>', methods=["GET"])
+@read_only
 def dives_show(dive_id):
     """Show a dive."""
 
@@ -474,11 +680,12 @@ def dives_show(dive_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    dive = Dive.query.get_or_404(dive_id)
-    static_map = generate_static_map_url(dive.divesite.lat, dive.divesite.lng)
-    return render_template('dives/show.html', dive=dive, static_map=static_map)
+    dive = Dive.query.options(joinedload(Dive.profile)).get_or_404(dive_id)
+    static_map = static_map_url(dive.divesite_id, size='800x400')
+    chart = profile_chart(dive.profile) if dive.profile else None
+    return render_template('dives/show.html', dive=dive, static_map=static_map, chart=chart)
 
-@app.route('/dives/<int:dive_id>/edit', methods=['GET', 'POST'])
+@main.route('/dives/<int:dive_id>/edit', methods=['GET', 'POST'])
 def dives_edit(dive_id):
     """Edits a user's dive"""
 
@@ -498,13 +705,18 @@ def dives_edit(dive_id):
 
         # convert meters to feet
         max_depth = form.max_depth.data
-        if form.depth_units.data == 'meters':
+        bottom_time = form.bottom_time.data
+
+        if form.profile is not None:
+            dive.profile = form.profile
+            max_depth, bottom_time = profile_summary(dive.profile)
+        elif form.depth_units.data == 'meters':
             max_depth = max_depth * 3.28084
 
         dive.date = form.date.data
         dive.dive_no = form.dive_no.data
         dive.rating = form.rating.data
-        dive.bottom_time = form.bottom_time.data
+        dive.bottom_time = bottom_time
         dive.max_depth = max_depth
         dive.buddy_id = form.buddy_id.data
         dive.comments = form.comments.data
@@ -533,14 +745,17 @@ def dives_edit(dive_id):
         divetype.muck = dive_types_dict["muck"]
 
         db.session.add(divetype)
+        enqueue('refresh_user_stats', g.user.id)
+        enqueue('refresh_divesite_stats', dive.divesite_id)
         db.session.commit()
 
+        invalidate_user_fragments(g.user.id)
         flash('Dive successfully updated', 'success')
         return redirect(f"/dives/{dive.id}")
 
     return render_template("/dives/edit.html", form=form)
 
-@app.route('/dives/<int:dive_id>/delete', methods=['POST'])
+@main.route('/dives/<int:dive_id>/delete', methods=['POST'])
 def dives_delete(dive_id):
     """Deletes a dive"""
 
@@ -554,17 +769,59 @@ def dives_delete(dive_id):
     
     db.session.delete(divetype)
     db.session.delete(dive)
+    generations.bump(generations.DIVES, generations.DIVES_REMOVED)
+    enqueue('refresh_user_stats', g.user.id)
+    enqueue('refresh_divesite_stats', dive.divesite_id)
 
     db.session.commit()
+    invalidate_user_fragments(g.user.id)
 
     flash("Dive deleted.", "warning")
     return redirect("/")
 
 
+##############################################################################
+# Leaderboards
+
+@main.route('/leaderboards')
+@read_only
+def leaderboards():
+    """Shows the top divers on a board, worldwide or in one country or
+    continent, and where the current user places on it."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    board = request.args.get('board')
+    country = request.args.get('country')
+    continent = request.args.get('continent')
+
+    if board not in BOARDS:
+        board = 'num_dives'
+    if board not in REGIONAL_BOARDS:
+        country = continent = None
+
+    scope = scope_for(country, continent)
+
+    return render_template(
+        'leaderboards.html',
+        board=board,
+        boards=BOARDS,
+        regional=board in REGIONAL_BOARDS,
+        country=country if scope != WORLD else None,
+        continent=continent if not country else None,
+        countries=country_names(),
+        continents=CONTINENTS,
+        places=top(board, scope, limit=50),
+        mine=place(board, g.user.id, scope)
+    )
+
 ##############################################################################
 # Homepage and error pages
 
-@app.route('/')
+@main.route('/')
+@read_only
 def homepage():
     """Show homepage:
 
@@ -578,6 +835,7 @@ def homepage():
         self_and_following_ids.append(g.user.id)
         dives = (Dive
                     .query
+                    .options(joinedload(Dive.diver), joinedload(Dive.divesite))
                     .filter(Dive.user_id.in_(self_and_following_ids))
                     .order_by(Dive.date.desc())
                     .limit(100)
@@ -588,23 +846,6 @@ def homepage():
     else:
         return render_template('home-anon.html')
 
-@app.errorhandler(404)
+@main.app_errorhandler(404)
 def page_not_found(e):
     return render_template('404.html'), 404
-
-##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
\ No newline at end of file
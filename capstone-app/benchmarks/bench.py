@@ -0,0 +1,499 @@
+"""Benchmark harness for the main routes.
+
+Seed a synthetic dataset, drive the routes, and keep the numbers as JSON so
+later changes can be compared against a baseline.
+
+    cd capstone-app
+    python benchmarks/bench.py seed --database sqlite:///bench.sqlite --scale small
+    python benchmarks/bench.py run --database sqlite:///bench.sqlite -o baseline.json
+    python benchmarks/bench.py run --database sqlite:///bench.sqlite -o after.json
+    python benchmarks/bench.py compare baseline.json after.json
+
+`run` drives the app in-process through the Flask test client, which also
+counts SQL statements per request. Pass --url to instead load-test a
+running server over HTTP with several concurrent clients (no query counts).
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+BENCH_PASSWORD = "benchmark"
+
+SCALES = {
+    # divesites, users, dives, average buddies per user
+    'tiny': (1_000, 100, 5_000, 5),
+    'small': (10_000, 1_000, 100_000, 10),
+    'medium': (50_000, 5_000, 500_000, 15),
+    'large': (100_000, 10_000, 1_000_000, 20),
+}
+
+ROUTES = ('homepage', 'users_show', 'users_analytics', 'search_divesites', 'search_users', 'get_dive_sites', 'add_dive')
+
+WORDS = ("reef", "wreck", "wall", "point", "garden", "bay", "cave", "rock", "shoal", "canyon",
+         "blue", "coral", "manta", "shark", "turtle", "north", "south", "hole", "arch", "pinnacle")
+
+DIVETYPES = ("drysuit", "night", "cave", "wreck", "drift", "ice", "deep", "technical", "altitude", "muck")
+
+REGIONS = (
+    ("Maldives", "Asia"), ("Indonesia", "Asia"), ("Philippines", "Asia"), ("Egypt", "Africa"),
+    ("Mexico", "North America"), ("Belize", "North America"), ("Australia", "Oceania"),
+    ("Fiji", "Oceania"), ("Spain", "Europe"), ("Croatia", "Europe"), ("Brazil", "South America"),
+    ("Mozambique", "Africa"),
+)
+
+def load_app(database_url):
+    """Builds the Flask app pointed at database_url."""
+
+    from app import create_app
+
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': database_url,
+        'WTF_CSRF_ENABLED': False,
+        'SLOW_REQUEST_QUERIES': 10 ** 9,
+        'SLOW_REQUEST_MS': 10 ** 9,
+    })
+
+def power_law(rng, mean, cap):
+    """A Pareto-distributed int with roughly the given mean, at most cap."""
+
+    alpha = 1.5
+    scale = mean * (alpha - 1) / alpha
+    return min(cap, int(scale * rng.paretovariate(alpha)))
+
+##############################################################################
+# Seeding
+
+def seed(args):
+    """Fill the database with synthetic divesites, users, buddies and dives."""
+
+    from sqlalchemy import insert
+    import generations
+    from models import db, hasher, Buddy, Dive, Divesite, Divetype, Generation, User
+
+    n_sites, n_users, n_dives, avg_buddies = SCALES[args.scale]
+    n_sites = args.divesites or n_sites
+    n_users = args.users or n_users
+    n_dives = args.dives or n_dives
+    avg_buddies = args.buddies or avg_buddies
+
+    rng = random.Random(args.seed)
+    app = load_app(args.database)
+    batch = args.batch_size
+
+    def insert_rows(model, rows):
+        for start in range(0, len(rows), batch):
+            db.session.execute(insert(model), rows[start:start + batch])
+        db.session.commit()
+
+    with app.app_context():
+        # Keeps the generation counters, so the bump at the end moves them
+        # past anything built from the old data
+        db.metadata.drop_all(db.engine, tables=[
+            table for table in db.metadata.sorted_tables if table is not Generation.__table__
+        ])
+        db.create_all()
+
+        started = time.perf_counter()
+
+        sites = []
+        for i in range(n_sites):
+            country, continent = rng.choice(REGIONS)
+            sites.append({
+                'id': i + 1,
+                'name': f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {i}",
+                'lat': rng.uniform(-60, 60),
+                'lng': rng.uniform(-180, 180),
+                'ocean': "Pacific",
+                'location': f"{country}, {continent}",
+                'country': country,
+                'continent': continent,
+                'api_id': f"bench-{i}",
+            })
+        insert_rows(Divesite, sites)
+        print(f"{n_sites} divesites")
+
+        # every synthetic user shares one hash, so seeding doesn't run bcrypt 10k times
+        hasher.rounds = 4
+        password = hasher.hash(BENCH_PASSWORD)
+        users = [{
+            'id': i + 1,
+            'username': f"diver{i}",
+            'password': password,
+            'first_name': "Bench",
+            'last_name': f"Diver{i}",
+            'bio': "Synthetic benchmark user",
+            'image_url': User.image_url.default.arg,
+            'header_image_url': User.header_image_url.default.arg,
+        } for i in range(n_users)]
+        insert_rows(User, users)
+        print(f"{n_users} users")
+
+        # preferential attachment: popular divers collect most buddy links
+        weights = [1 / (rank + 1) for rank in range(n_users)]
+        links = set()
+        for user_id in range(1, n_users + 1):
+            degree = power_law(rng, avg_buddies, n_users - 1)
+            for other in rng.choices(range(1, n_users + 1), weights=weights, k=degree):
+                if other != user_id:
+                    links.add((user_id, other))
+        insert_rows(Buddy, [{'buddy_user_id': a, 'main_user_id': b} for a, b in links])
+        print(f"{len(links)} buddy links")
+
+        # dives per user and per site both follow a power law too
+        user_weights = [1 / (rank + 1) ** 0.8 for rank in range(n_users)]
+        site_weights = [1 / (rank + 1) ** 0.8 for rank in range(n_sites)]
+        divers = rng.choices(range(1, n_users + 1), weights=user_weights, k=n_dives)
+        divesites = rng.choices(range(1, n_sites + 1), weights=site_weights, k=n_dives)
+        dive_counts = {}
+        first_day = date.today() - timedelta(days=3650)
+
+        dives = []
+        divetypes = []
+        for i in range(n_dives):
+            dive_id = i + 1
+            user_id = divers[i]
+            dive_counts[user_id] = dive_counts.get(user_id, 0) + 1
+            dives.append({
+                'id': dive_id,
+                'user_id': user_id,
+                'dive_no': dive_counts[user_id],
+                'date': first_day + timedelta(days=rng.randrange(3650)),
+                'divesite_id': divesites[i],
+                'rating': rng.randint(1, 10),
+                'bottom_time': round(rng.uniform(15, 80), 1),
+                'max_depth': round(rng.uniform(15, 130), 1),
+                'comments': "Synthetic dive",
+                'buddy_id': None,
+            })
+            divetypes.append({
+                'dive_id': dive_id,
+                **{name: rng.random() < 0.15 for name in DIVETYPES},
+            })
+
+            if len(dives) >= batch * 10:
+                insert_rows(Dive, dives)
+                insert_rows(Divetype, divetypes)
+                dives, divetypes = [], []
+
+        insert_rows(Dive, dives)
+        insert_rows(Divetype, divetypes)
+        print(f"{n_dives} dives")
+
+        _reset_sequences(db)
+
+        from stats import rebuild_all
+        rebuild_all()
+        generations.bump(generations.DIVESITES, generations.DIVES, generations.DIVES_REMOVED)
+        db.session.commit()
+        print("stats and leaderboards rebuilt")
+
+        print(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+def _reset_sequences(db):
+    """Moves PostgreSQL id sequences past the explicitly inserted ids."""
+
+    if db.engine.dialect.name != 'postgresql':
+        return
+
+    for table in ('divesites', 'users', 'dives', 'divetypes'):
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table}), 1))"
+        ))
+    db.session.commit()
+
+##############################################################################
+# Running
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def summarize(latencies, queries, wall_time):
+    """Turns raw per-request samples into the numbers we report."""
+
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies),
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else None,
+        'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+        'p95_ms': percentile(latencies, 95) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+        'throughput_rps': len(latencies) / wall_time if wall_time else None,
+    }
+    if queries:
+        summary['queries_per_request'] = statistics.fmean(queries)
+        summary['max_queries'] = max(queries)
+    return summary
+
+def route_request(route, rng, ids):
+    """Returns (method, url, form data) for one request to `route`."""
+
+    if route == 'homepage':
+        return 'GET', '/', None
+    if route == 'users_show':
+        return 'GET', f"/users/{rng.randint(1, ids['users'])}", None
+    if route == 'users_analytics':
+        # Dives are skewed towards low user ids, so this hits the biggest logbooks
+        return 'GET', f"/users/{rng.randint(1, 10)}/analytics", None
+    if route == 'search_divesites':
+        query = rng.choice(WORDS + ("",))
+        return 'GET', f"/search?category=divesites&q={query}&page={rng.randint(1, 3)}", None
+    if route == 'search_users':
+        return 'GET', f"/search?category=users&q=diver{rng.randint(1, 99)}", None
+    if route == 'get_dive_sites':
+        lat = rng.uniform(-50, 40)
+        lng = rng.uniform(-170, 150)
+        span = rng.choice((2, 5, 10))
+        return 'GET', f"/get_dive_sites?ne_lat={lat + span}&ne_lng={lng + span}&sw_lat={lat}&sw_lng={lng}", None
+    if route == 'add_dive':
+        data = {
+            'date': date.today().isoformat(),
+            'rating': str(rng.randint(1, 10)),
+            'bottom_time': "45",
+            'max_depth': "60",
+            'depth_units': "feet",
+            'buddy_id': "-1",
+            'comments': "Benchmark dive",
+        }
+        return 'POST', f"/divesites/{rng.randint(1, ids['divesites'])}/new", data
+    raise ValueError(f"Unknown route {route}")
+
+def _dataset_size(app):
+    from models import db, Divesite, User
+
+    with app.app_context():
+        return {
+            'users': db.session.query(db.func.max(User.id)).scalar() or 1,
+            'divesites': db.session.query(db.func.max(Divesite.id)).scalar() or 1,
+        }
+
+def run_in_process(args, routes):
+    """Drives each route through the Flask test client."""
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    app = load_app(args.database)
+    rng = random.Random(args.seed)
+    ids = _dataset_size(app)
+
+    query_count = [0]
+
+    def count_query(*_):
+        query_count[0] += 1
+
+    event.listen(Engine, 'before_cursor_execute', count_query)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['curr_user'] = rng.randint(1, ids['users'])
+
+    results = {}
+    for route in routes:
+        for _ in range(args.warmup):
+            method, url, data = route_request(route, rng, ids)
+            client.open(url, method=method, data=data).close()
+
+        latencies, queries = [], []
+        wall_start = time.perf_counter()
+        for _ in range(args.requests):
+            method, url, data = route_request(route, rng, ids)
+            query_count[0] = 0
+            start = time.perf_counter()
+            response = client.open(url, method=method, data=data)
+            latencies.append(time.perf_counter() - start)
+            queries.append(query_count[0])
+
+            if response.status_code >= 400:
+                raise SystemExit(f"{route}: {method} {url} answered {response.status_code}")
+            response.close()
+
+        results[route] = summarize(latencies, queries, time.perf_counter() - wall_start)
+        print(_format_line(route, results[route]))
+
+    event.remove(Engine, 'before_cursor_execute', count_query)
+    return results
+
+def _http_login(base_url, username):
+    import requests
+
+    session = requests.Session()
+    page = session.get(f"{base_url}/login").text
+    token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page)
+    data = {'username': username, 'password': BENCH_PASSWORD}
+    if token:
+        data['csrf_token'] = token.group(1)
+    session.post(f"{base_url}/login", data=data)
+    return session
+
+def run_http(args, routes):
+    """Load-tests a running server with args.concurrency parallel clients."""
+
+    base_url = args.url.rstrip('/')
+    ids = {'users': args.users, 'divesites': args.divesites}
+    results = {}
+
+    for route in routes:
+        if route == 'add_dive':
+            print("add_dive skipped over HTTP (needs CSRF tokens per form)")
+            continue
+
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        per_client = max(1, args.requests // args.concurrency)
+
+        def client_loop(client_no):
+            rng = random.Random(args.seed + client_no)
+            session = _http_login(base_url, f"diver{rng.randrange(ids['users'])}")
+            mine = []
+            for _ in range(per_client):
+                method, url, data = route_request(route, rng, ids)
+                start = time.perf_counter()
+                response = session.request(method, base_url + url, data=data)
+                mine.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+            with lock:
+                latencies.extend(mine)
+
+        threads = [threading.Thread(target=client_loop, args=(n,)) for n in range(args.concurrency)]
+        wall_start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        results[route] = summarize(latencies, [], time.perf_counter() - wall_start)
+        results[route]['errors'] = len(errors)
+        print(_format_line(route, results[route]))
+
+    return results
+
+def _format_line(route, summary):
+    line = (f"{route:<18} p50 {summary['p50_ms']:8.2f}ms  p95 {summary['p95_ms']:8.2f}ms  "
+            f"p99 {summary['p99_ms']:8.2f}ms  {summary['throughput_rps']:8.1f} req/s")
+    if 'queries_per_request' in summary:
+        line += f"  {summary['queries_per_request']:6.1f} queries"
+    return line
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=APP_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    """Benchmark the routes and write the results as JSON."""
+
+    routes = args.routes.split(",") if args.routes else list(ROUTES)
+
+    if args.url:
+        results = run_http(args, routes)
+    else:
+        results = run_in_process(args, routes)
+
+    report = {
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'mode': 'http' if args.url else 'test_client',
+        'database': args.database.split("@")[-1] if args.database else None,
+        'requests_per_route': args.requests,
+        'concurrency': args.concurrency if args.url else 1,
+        'routes': results,
+    }
+
+    output = args.output or os.path.join(APP_DIR, "benchmarks", "results", f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+def compare(args):
+    """Print how each route changed between two result files."""
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)['routes']
+    with open(args.current) as f:
+        current = json.load(f)['routes']
+
+    regressed = []
+    for route in sorted(set(baseline) & set(current)):
+        before, after = baseline[route], current[route]
+        change = (after['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+        line = f"{route:<18} p95 {before['p95_ms']:8.2f} -> {after['p95_ms']:8.2f}ms ({change:+.1f}%)"
+
+        if 'queries_per_request' in before and 'queries_per_request' in after:
+            line += f"  queries {before['queries_per_request']:.1f} -> {after['queries_per_request']:.1f}"
+            if after['queries_per_request'] > before['queries_per_request']:
+                regressed.append(route)
+
+        if change > args.threshold:
+            regressed.append(route)
+        print(line)
+
+    if regressed:
+        print(f"Regressed: {', '.join(sorted(set(regressed)))}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help="Seed a synthetic dataset (drops existing tables!)")
+    seed_parser.add_argument('--database', default=os.environ.get('DATABASE_URL'), required='DATABASE_URL' not in os.environ)
+    seed_parser.add_argument('--scale', choices=SCALES, default='tiny')
+    seed_parser.add_argument('--divesites', type=int)
+    seed_parser.add_argument('--users', type=int)
+    seed_parser.add_argument('--dives', type=int)
+    seed_parser.add_argument('--buddies', type=int, help="average buddies per user")
+    seed_parser.add_argument('--batch-size', type=int, default=5000)
+    seed_parser.add_argument('--seed', type=int, default=42)
+    seed_parser.set_defaults(func=seed)
+
+    run_parser = commands.add_parser('run', help="Benchmark the routes")
+    run_parser.add_argument('--database', default=os.environ.get('DATABASE_URL'))
+    run_parser.add_argument('--url', help="load-test this running server instead of the test client")
+    run_parser.add_argument('--routes', help=f"comma separated subset of: {','.join(ROUTES)}")
+    run_parser.add_argument('--requests', type=int, default=200, help="requests per route")
+    run_parser.add_argument('--warmup', type=int, default=10)
+    run_parser.add_argument('--concurrency', type=int, default=8, help="parallel clients with --url")
+    run_parser.add_argument('--users', type=int, default=SCALES['tiny'][1], help="user count of the server's dataset (--url)")
+    run_parser.add_argument('--divesites', type=int, default=SCALES['tiny'][0], help="divesite count of the server's dataset (--url)")
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('-o', '--output')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help="Compare two result files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=10, help="allowed p95 increase in percent")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    if args.command == 'run' and not args.url and not args.database:
+        parser.error("run needs --database (or DATABASE_URL) unless --url is given")
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Buddy links and "divers you may know" suggestions.
+
+A row in `buddies` with buddy_user_id=A and main_user_id=B means A added
+B as a buddy. Everything here works on ids with set-based SQL, so adding,
+removing or checking a link never loads a user's whole buddy list, which
+matters once people have thousands of them.
+"""
+
+from flask import g, has_request_context
+from sqlalchemy import func, literal, select, union_all
+
+from models import db, Buddy, Dive, User
+
+def buddy_ids(user_id):
+    """Ids of the users `user_id` has added as buddies.
+
+    Kept for the rest of the request, since templates check membership
+    once per user shown.
+    """
+
+    cache = g.setdefault('buddy_ids', {}) if has_request_context() else {}
+    if user_id not in cache:
+        cache[user_id] = set(db.session.scalars(
+            select(Buddy.main_user_id).where(Buddy.buddy_user_id == user_id)
+        ))
+    return cache[user_id]
+
+def buddy_to_ids(user_id):
+    """Ids of the users who have added `user_id` as a buddy."""
+
+    return set(db.session.scalars(select(Buddy.buddy_user_id).where(Buddy.main_user_id == user_id)))
+
+def add_buddies(user_id, other_ids):
+    """Adds every user in `other_ids` as a buddy of `user_id`.
+
+    Unknown or deleted users, the user themself and existing buddies are
+    skipped.
+    Returns the number of links added. The caller commits.
+    """
+
+    new_buddies = (
+        select(User.id, literal(user_id))
+        .where(
+            User.id.in_(set(other_ids)),
+            User.id != user_id,
+            User.deleted_at.is_(None),
+            ~select(Buddy.main_user_id).where(
+                Buddy.buddy_user_id == user_id,
+                Buddy.main_user_id == User.id
+            ).exists()
+        )
+    )
+
+    result = db.session.execute(
+        Buddy.__table__.insert().from_select(['main_user_id', 'buddy_user_id'], new_buddies)
+    )
+    _forget(user_id)
+    return result.rowcount
+
+def remove_buddies(user_id, other_ids):
+    """Removes every user in `other_ids` from the buddies of `user_id`.
+
+    Returns the number of links removed. The caller commits.
+    """
+
+    result = db.session.execute(
+        Buddy.__table__.delete().where(
+            Buddy.buddy_user_id == user_id,
+            Buddy.main_user_id.in_(set(other_ids))
+        )
+    )
+    _forget(user_id)
+    return result.rowcount
+
+def suggestions(user_id, limit=6):
+    """Divers `user_id` may know, best first, as [(user, mutual buddies, shared divesites)].
+
+    Candidates are people the user's buddies have added, and people who
+    have dived the same divesites. Existing buddies, deleted users and the
+    user are left out.
+    """
+
+    mine = select(Buddy.main_user_id.label('id')).where(Buddy.buddy_user_id == user_id).cte('mine')
+    my_sites = select(Dive.divesite_id).where(Dive.user_id == user_id).distinct().cte('my_sites')
+
+    friends_of_friends = (
+        select(
+            Buddy.main_user_id.label('candidate'),
+            func.count().label('mutual'),
+            literal(0).label('shared_sites')
+        )
+        .where(Buddy.buddy_user_id.in_(select(mine.c.id)))
+        .group_by(Buddy.main_user_id)
+    )
+
+    same_sites = (
+        select(
+            Dive.user_id.label('candidate'),
+            literal(0).label('mutual'),
+            func.count(func.distinct(Dive.divesite_id)).label('shared_sites')
+        )
+        .where(Dive.divesite_id.in_(select(my_sites.c.divesite_id)))
+        .group_by(Dive.user_id)
+    )
+
+    candidates = union_all(friends_of_friends, same_sites).cte('candidates')
+    mutual = func.sum(candidates.c.mutual).label('mutual')
+    shared_sites = func.sum(candidates.c.shared_sites).label('shared_sites')
+
+    ranked = db.session.execute(
+        select(User, mutual, shared_sites)
+        .join(candidates, candidates.c.candidate == User.id)
+        .where(
+            User.id != user_id,
+            User.id.not_in(select(mine.c.id)),
+            User.deleted_at.is_(None)
+        )
+        .group_by(User.id)
+        .order_by(mutual.desc(), shared_sites.desc(), User.id)
+        .limit(limit)
+    ).all()
+
+    return [(row.User, row.mutual, row.shared_sites) for row in ranked]
+
+def _forget(user_id):
+    if has_request_context():
+        g.get('buddy_ids', {}).pop(user_id, None)
@@ -0,0 +1,121 @@
+"""Key/value cache backends shared by the caching features.
+
+Every backend has the same small interface:
+
+- get(key) -> value or None
+- set(key, value, timeout=None)
+- delete(key)
+- incr(key) -> new int value
+- get_counter(key) -> current int value (0 if never incremented)
+
+Counters never expire and are never evicted.
+
+LRUBackend lives in this process, which is fine for one worker. With
+several workers, use RedisBackend (or anything with the same methods)
+so that invalidations reach every process.
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+class LRUBackend:
+    """In-process cache holding at most max_entries values."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._values = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._values[key]
+                return None
+
+            self._values.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        expires = time.monotonic() + timeout if timeout else None
+
+        with self._lock:
+            self._values[key] = (value, expires)
+            self._values.move_to_end(key)
+
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+            self._counters.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def get_counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._counters.clear()
+
+class RedisBackend:
+    """Cache stored in Redis, shared by every worker process.
+
+    `client` is a redis.Redis (or a compatible stand-in); `url` builds one.
+    """
+
+    def __init__(self, client=None, url=None, prefix="social-scuba:"):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout=None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=timeout)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def get_counter(self, key):
+        value = self.client.get(self.prefix + key)
+        return int(value) if value is not None else 0
+
+def make_backend(setting, max_entries=1024):
+    """Builds a backend from a config value.
+
+    `setting` can be None (in-process LRU), a redis:// URL, or a ready-made
+    backend object, which is returned as is.
+    """
+
+    if setting is None:
+        return LRUBackend(max_entries)
+
+    if isinstance(setting, str):
+        return RedisBackend(url=setting)
+
+    return setting
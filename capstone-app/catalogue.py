@@ -0,0 +1,185 @@
+"""A downloadable snapshot of every divesite, for filtering in the browser.
+
+The divesite catalogue rarely changes, so instead of asking the server on
+every map move, the map and the search box download it once and filter it
+locally. The snapshot is gzipped JSON named after a hash of its contents
+(/catalogue/divesites.<hash>.json), so it is cached by browsers for a year
+and a new file appears whenever the divesites change. /catalogue/manifest.json
+says which snapshot is current.
+
+Snapshots are built on demand: the manifest compares the DIVESITES
+generation (see generations.py) with the one the current snapshot was
+built at and rebuilds it if they differ. Routes that add or delete
+divesites bump it and also queue a rebuild_catalogue job, so the worker
+usually has the new snapshot ready before anyone asks. `flask catalogue
+build` bumps it and rebuilds by hand, e.g. after bulk-loading divesites.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import click
+from flask import Blueprint, Response, abort, current_app, jsonify, request, url_for
+from flask.cli import AppGroup
+
+import generations
+from http_cache import cache_policy, REVALIDATE_PUBLIC
+from jobs import task
+from models import db, Divesite
+
+catalogue = Blueprint('catalogue', __name__)
+catalogue_cli = AppGroup('catalogue', help="Build the divesite catalogue snapshot.")
+
+FIELDS = ('id', 'name', 'lat', 'lng', 'country', 'continent')
+ONE_YEAR = 60 * 60 * 24 * 365
+MANIFEST = 'manifest.json'
+
+_build_lock = threading.Lock()
+
+def init_app(app):
+    """Set up the snapshot directory, routes and CLI."""
+
+    app.config.setdefault('CATALOGUE_DIR', os.path.join(app.instance_path, 'catalogue'))
+    # Older snapshots are kept for clients still holding an old manifest
+    app.config.setdefault('CATALOGUE_KEEP', 3)
+
+    app.register_blueprint(catalogue)
+    app.cli.add_command(catalogue_cli)
+
+def fingerprint():
+    """Changes whenever the divesites do."""
+
+    return list(generations.current(generations.DIVESITES))
+
+def snapshot_name(digest):
+    return f"divesites.{digest}.json"
+
+def build_snapshot():
+    """Writes a snapshot of the divesites and a manifest pointing at it.
+
+    Returns the manifest.
+    """
+
+    directory = current_app.config['CATALOGUE_DIR']
+    os.makedirs(directory, exist_ok=True)
+
+    # Read the fingerprint first: a divesite added while building shows up
+    # as a changed fingerprint and triggers another build.
+    current = fingerprint()
+    rows = db.session.execute(
+        db.select(*[getattr(Divesite, field) for field in FIELDS]).order_by(Divesite.id)
+    ).all()
+
+    body = json.dumps({'fields': FIELDS, 'rows': [list(row) for row in rows]}, separators=(',', ':'))
+    digest = hashlib.sha256(body.encode()).hexdigest()[:16]
+    name = snapshot_name(digest)
+
+    path = os.path.join(directory, name + '.gz')
+    if os.path.exists(path):
+        # back to an earlier catalogue: mark it newest so it isn't pruned
+        os.utime(path)
+    else:
+        _write(directory, name + '.gz', gzip.compress(body.encode(), mtime=0))
+
+    manifest = {'fingerprint': current, 'divesites': name, 'count': len(rows)}
+    _write(directory, MANIFEST, json.dumps(manifest).encode())
+    _prune(directory, current_app.config['CATALOGUE_KEEP'])
+
+    return manifest
+
+def current_manifest():
+    """The manifest of an up-to-date snapshot, building one if needed."""
+
+    path = os.path.join(current_app.config['CATALOGUE_DIR'], MANIFEST)
+    manifest = _read_manifest(path)
+
+    if manifest is None or manifest['fingerprint'] != fingerprint():
+        with _build_lock:
+            manifest = _read_manifest(path)
+            if manifest is None or manifest['fingerprint'] != fingerprint():
+                manifest = build_snapshot()
+
+    return manifest
+
+@task
+def rebuild_catalogue():
+    """Brings the snapshot up to date, if the divesites have changed."""
+
+    current_manifest()
+
+def _read_manifest(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _write(directory, name, data):
+    """Writes a file atomically, so readers never see half of it."""
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'wb') as file:
+        file.write(data)
+    os.replace(tmp_path, os.path.join(directory, name))
+
+def _prune(directory, keep):
+    snapshots = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.startswith('divesites.')),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True
+    )
+    for entry in snapshots[keep:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+@catalogue.route('/catalogue/manifest.json')
+@cache_policy(REVALIDATE_PUBLIC)
+def manifest():
+    """Where to download the current divesite snapshot."""
+
+    current = current_manifest()
+    return jsonify({
+        'divesites': url_for('catalogue.snapshot', name=current['divesites']),
+        'count': current['count']
+    })
+
+@catalogue.route('/catalogue/<name>')
+def snapshot(name):
+    """A divesite snapshot, gzipped if the browser accepts it (they all do)."""
+
+    if not (name.startswith('divesites.') and name.endswith('.json')):
+        abort(404)
+
+    try:
+        with open(os.path.join(current_app.config['CATALOGUE_DIR'], name + '.gz'), 'rb') as file:
+            data = file.read()
+    except FileNotFoundError:
+        abort(404)
+
+    response = Response(mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = f'public, max-age={ONE_YEAR}, immutable'
+
+    if 'gzip' in request.accept_encodings:
+        response.set_data(data)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response.set_data(gzip.decompress(data))
+
+    return response
+
+@catalogue_cli.command('build')
+def build():
+    """Rebuild the divesite snapshot now."""
+
+    # So snapshots in other hosts' CATALOGUE_DIRs are rebuilt too
+    generations.bump(generations.DIVESITES)
+    db.session.commit()
+    manifest = build_snapshot()
+    click.echo(f"{manifest['divesites']}: {manifest['count']} divesites")
@@ -0,0 +1,202 @@
+"""Compressed responses: Brotli or gzip, whichever the browser prefers.
+
+- Dynamic responses (HTML, JSON, CSS, JS, CSV, XML) of at least
+  COMPRESS_MIN_SIZE bytes are compressed as they leave the app, at
+  COMPRESS_BROTLI_LEVEL or COMPRESS_GZIP_LEVEL. Streamed responses, like
+  the logbook export, are compressed chunk by chunk and flushed after
+  each one, so they still arrive progressively.
+- Static files are served from .br/.gz siblings written by
+  `flask static compress`, so they cost no CPU per request. Files without
+  an up-to-date sibling go out uncompressed.
+
+Brotli is optional: without the brotli package only gzip is offered and
+built.
+"""
+
+import gzip
+import mimetypes
+import os
+import zlib
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import AppGroup
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+static_cli = AppGroup('static', help="Prepare static files for serving.")
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'application/xml', 'image/svg+xml',
+}
+STATIC_EXTENSIONS = ('.css', '.js', '.json', '.svg', '.html', '.txt', '.map', '.ico')
+# Sibling suffix of each encoding, best first
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+def init_app(app):
+    """Compress responses and serve precompressed static files.
+
+    Call after http_cache.init_app, so ETags are worked out from the
+    compressed body.
+    """
+
+    app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+    app.config.setdefault('COMPRESS_GZIP_LEVEL', 6)
+    app.config.setdefault('COMPRESS_BROTLI_LEVEL', 5)
+    app.config.setdefault('COMPRESS_STREAMS', True)
+
+    app.after_request(compress_response)
+    app.view_functions['static'] = send_static
+    app.cli.add_command(static_cli)
+
+def encodings():
+    """The encodings this app can produce, best first."""
+
+    return [encoding for encoding in SUFFIXES if encoding != 'br' or brotli is not None]
+
+def negotiate():
+    """The encoding to answer this request with, or None."""
+
+    return request.accept_encodings.best_match(encodings())
+
+def compress_response(response):
+    if (request.endpoint == 'static' or response.direct_passthrough
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers or request.method == 'HEAD'):
+        return response
+
+    encoding = negotiate()
+    if encoding is None:
+        return response
+
+    config = current_app.config
+
+    if response.is_streamed:
+        if config['COMPRESS_STREAMS']:
+            response.response = _compress_stream(response.response, _compressor(encoding))
+            response.headers.pop('Content-Length', None)
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    data = response.get_data()
+    if len(data) < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def compress(data, encoding, best=False):
+    """`data` compressed for a response, or at the highest level if `best`."""
+
+    config = current_app.config
+
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else config['COMPRESS_BROTLI_LEVEL'])
+
+    # mtime=0 keeps the output, and so the ETag, the same for the same data
+    return gzip.compress(data, compresslevel=9 if best else config['COMPRESS_GZIP_LEVEL'], mtime=0)
+
+def _compressor(encoding):
+    """(compress, flush, finish) functions of a streaming compressor."""
+
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=current_app.config['COMPRESS_BROTLI_LEVEL'])
+        return compressor.process, compressor.flush, compressor.finish
+
+    # wbits=31 writes a gzip header and trailer
+    compressor = zlib.compressobj(current_app.config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 31)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+def _compress_stream(chunks, compressor):
+    """Compresses each chunk as it comes, flushing so none is held back.
+    Runs after the request has ended."""
+
+    process, flush, finish = compressor
+
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            yield process(chunk) + flush()
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def send_static(filename):
+    """The static view, serving a precompressed sibling when there's a fresh one."""
+
+    folder = current_app.static_folder
+    path = safe_join(folder, filename)
+    max_age = current_app.get_send_file_max_age(filename)
+
+    if path is not None and filename.endswith(STATIC_EXTENSIONS) and os.path.isfile(path):
+        available = [
+            encoding for encoding in encodings()
+            if _is_fresh(path + SUFFIXES[encoding], path)
+        ]
+        encoding = request.accept_encodings.best_match(available) if available else None
+
+        if encoding is not None:
+            response = send_from_directory(folder, filename + SUFFIXES[encoding], max_age=max_age,
+                                           mimetype=_mimetype(filename))
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            return response
+
+    response = send_from_directory(folder, filename, max_age=max_age)
+    if filename.endswith(STATIC_EXTENSIONS):
+        response.vary.add('Accept-Encoding')
+    return response
+
+def _is_fresh(sibling, path):
+    try:
+        return os.stat(sibling).st_mtime >= os.stat(path).st_mtime
+    except OSError:
+        return False
+
+def _mimetype(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+@static_cli.command('compress')
+@click.option('--force', is_flag=True, help="Rewrite siblings that are already up to date.")
+def compress_static(force):
+    """Write .br and .gz siblings of the static text files."""
+
+    saved = 0
+    for root, _, files in os.walk(current_app.static_folder):
+        for name in sorted(files):
+            if not name.endswith(STATIC_EXTENSIONS):
+                continue
+
+            path = os.path.join(root, name)
+            with open(path, 'rb') as file:
+                data = file.read()
+
+            if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+                continue
+
+            for encoding in encodings():
+                sibling = path + SUFFIXES[encoding]
+                if not force and _is_fresh(sibling, path):
+                    continue
+
+                compressed = compress(data, encoding, best=True)
+                with open(sibling, 'wb') as file:
+                    file.write(compressed)
+                saved += len(data) - len(compressed)
+                click.echo(f"{os.path.relpath(sibling, current_app.static_folder)}: "
+                           f"{len(data):,} -> {len(compressed):,} bytes")
+
+    click.echo(f"Saved {saved:,} bytes.")
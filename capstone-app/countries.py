@@ -0,0 +1,45 @@
+"""Country and continent names. Countries are read from pycountry the
+first time they're needed.
+
+pycountry loads a few megabytes of ISO data when imported, so it's kept
+out of app startup and every request after the first reuses the lists.
+"""
+
+from functools import lru_cache
+
+CONTINENTS = ("Asia", "Africa", "Europe", "South America", "North America", "Oceania")
+
+# How the divesite API spells some countries, where that differs from
+# pycountry's official names ("Korea, Republic of", "Viet Nam", ...)
+API_COUNTRY_NAMES = (
+    'usa',
+    'bolivia',
+    'bonaire',
+    'bosnia',
+    'cocos islands',
+    'cook island',
+    'falkland islands',
+    'iran',
+    'korea',
+    'micronesia',
+    'moldova',
+    'palestine',
+    'saint martin',
+    'sint maarten',
+    'taiwan',
+    'tanzania',
+    'vietnam'
+)
+
+@lru_cache(maxsize=None)
+def country_names():
+    """Every country's name, in pycountry's order, for the divesite form."""
+
+    import pycountry
+    return tuple(country.name for country in pycountry.countries)
+
+@lru_cache(maxsize=None)
+def lowercase_country_names():
+    """Lowercased country names, plus the API's spellings, for matching locations."""
+
+    return frozenset(name.lower() for name in country_names()) | frozenset(API_COUNTRY_NAMES)
@@ -0,0 +1,154 @@
+"""A small content-addressed file cache with size-bounded LRU eviction."""
+
+import hashlib
+import os
+import tempfile
+import threading
+
+class DiskCache:
+    """Stores blobs on disk under the sha256 of their contents.
+
+    Lookups go through a key file (named after the sha256 of the key) that
+    holds the content digest, so identical blobs fetched under different
+    keys are stored once. Reading a blob bumps its mtime, and its key's;
+    when the cache grows past max_bytes the least recently read blobs are
+    removed first, along with keys that point at removed blobs or haven't
+    been read since before the oldest blob kept.
+    Writes go through a temp file and os.replace, so several worker
+    processes can share one directory.
+    """
+
+    def __init__(self, directory, max_bytes, suffix=""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._objects = os.path.join(directory, "objects")
+        self._keys = os.path.join(directory, "keys")
+        self._size = None
+        self._lock = threading.Lock()
+
+        os.makedirs(self._objects, exist_ok=True)
+        os.makedirs(self._keys, exist_ok=True)
+
+    def _key_path(self, key):
+        name = hashlib.sha256(key.encode('UTF-8')).hexdigest()
+        return os.path.join(self._keys, name)
+
+    def _object_path(self, digest):
+        return os.path.join(self._objects, digest[:2], digest + self.suffix)
+
+    def get(self, key):
+        """Returns the file path stored for key, or None if not cached."""
+
+        key_path = self._key_path(key)
+        try:
+            with open(key_path) as f:
+                digest = f.read().strip()
+        except FileNotFoundError:
+            return None
+
+        path = self._object_path(digest)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # the blob was evicted, so the key is stale
+            self._remove(key_path)
+            return None
+
+        try:
+            os.utime(key_path)
+        except FileNotFoundError:
+            pass
+
+        return path
+
+    def put(self, key, data):
+        """Stores data under key and returns its file path."""
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write(path, data)
+            self._grow(len(data))
+
+        self._write(self._key_path(key), digest.encode('UTF-8'))
+        return path
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+
+    def _grow(self, nbytes):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            else:
+                self._size += nbytes
+
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        """Yields (mtime, size, path) for every stored blob."""
+
+        for root, _, files in os.walk(self._objects):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _evict(self):
+        """Removes least recently used blobs until under 90% of max_bytes."""
+
+        # rescan: other processes may have added or removed blobs too
+        blobs = sorted(self._scan())
+        self._size = sum(size for _, size, _ in blobs)
+        target = self.max_bytes * 0.9
+
+        kept = len(blobs)
+        for i, (_, size, path) in enumerate(blobs):
+            if self._size <= target:
+                kept = i
+                break
+            self._remove(path)
+            self._size -= size
+
+        oldest = blobs[kept][0] if kept < len(blobs) else float('inf')
+        self._evict_keys(oldest)
+
+    def _evict_keys(self, oldest):
+        """Removes keys last read before `oldest` or whose blob is gone."""
+
+        for name in os.listdir(self._keys):
+            path = os.path.join(self._keys, name)
+            try:
+                if os.stat(path).st_mtime < oldest:
+                    self._remove(path)
+                    continue
+                with open(path) as f:
+                    digest = f.read().strip()
+            except FileNotFoundError:
+                continue
+
+            if not os.path.exists(self._object_path(digest)):
+                self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
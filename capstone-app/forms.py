@@ -1,6 +1,10 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed, FileField
 from wtforms import StringField, PasswordField, DateField, FloatField, SelectMultipleField, SelectField, RadioField, widgets, TextAreaField, IntegerField
-from wtforms.validators import DataRequired, Length, NumberRange
+from wtforms.validators import DataRequired, Length, NumberRange, Optional, ValidationError
+
+from countries import CONTINENTS
+from profiles import make_profile, read_samples
 
 class DivesiteForm(FlaskForm):
     """Form for adding/editing divesites."""
@@ -10,7 +14,7 @@ class DivesiteForm(FlaskForm):
     lng = FloatField('Longitude', validators=[DataRequired()])
     ocean = StringField('Ocean', validators=[DataRequired()])
     country = SelectField('Country', validators=[DataRequired()])
-    continent = SelectField(choices=["Asia", "Africa", "Europe", "South America", "North America", "Oceania"], validators=[DataRequired()])
+    continent = SelectField(choices=list(CONTINENTS), validators=[DataRequired()])
     location = StringField('Location')
 
 class MultiCheckboxField(SelectMultipleField):
@@ -23,7 +27,33 @@ class MultiCheckboxField(SelectMultipleField):
     widget = widgets.ListWidget(prefix_label=False)
     option_widget = widgets.CheckboxInput()
 
-class DiveForm(FlaskForm):
+class DiveProfileUpload:
+    """Lets a dive computer profile stand in for max depth and bottom time,
+    which are then worked out from it. The resampled DiveProfile is left in
+    `profile`."""
+
+    profile = None
+
+    def validate_profile_upload(self, field):
+        if field.data:
+            try:
+                samples = read_samples(field.data.read().decode('utf-8', errors='replace'))
+                self.profile = make_profile(*samples)
+            except ValueError as error:
+                raise ValidationError(str(error))
+
+    def validate(self, extra_validators=None):
+        valid = super().validate(extra_validators)
+
+        if self.profile is None:
+            for field in (self.bottom_time, self.max_depth):
+                if field.data is None and not field.errors:
+                    field.errors.append("Enter this or upload a dive computer profile.")
+                    valid = False
+
+        return valid
+
+class DiveForm(DiveProfileUpload, FlaskForm):
     """Form for adding dives."""
 
     dive_type_choices = [
@@ -42,15 +72,17 @@ class DiveForm(FlaskForm):
     date = DateField('Date', validators=[DataRequired()])
     dive_type = MultiCheckboxField('Dive Type (select all that apply)', choices=dive_type_choices)
     rating = SelectField('Rating (1 worst, 10 best)', choices=[str(i) for i in range(1, 11)], validators=[DataRequired()])
-    bottom_time = FloatField('Bottom Time (min.)', validators=[DataRequired(),
+    bottom_time = FloatField('Bottom Time (min.)', validators=[Optional(),
                                                                NumberRange(min=0, max=600, message='Value must be between 0 and 600')])
-    max_depth = FloatField('Max depth', validators=[DataRequired(),
+    max_depth = FloatField('Max depth', validators=[Optional(),
                                                     NumberRange(min=0, max=350, message='Value must be between 0 and 350')])
     depth_units = RadioField('Depth units', choices=['meters', 'feet'], validators=[DataRequired()])
+    profile_upload = FileField('Dive computer profile (CSV of seconds, depth in meters, temperature)',
+                        validators=[FileAllowed(['csv', 'txt'], 'Profiles must be .csv files')])
     buddy_id = SelectField('Buddy', coerce=int, validators=[DataRequired()])
     comments = TextAreaField('Comments')
 
-class DiveEditForm(FlaskForm):
+class DiveEditForm(DiveProfileUpload, FlaskForm):
     """Form for editing dives"""
 
     dive_type_choices = [
@@ -70,11 +102,13 @@ class DiveEditForm(FlaskForm):
     dive_no = IntegerField('Dive Num:')
     dive_type = MultiCheckboxField('Dive Type (select all that apply)', choices=dive_type_choices)
     rating = SelectField('Rating (1 worst, 10 best)', choices=[str(i) for i in range(1, 11)], validators=[DataRequired()])
-    bottom_time = FloatField('Bottom Time (min.)', validators=[DataRequired(),
+    bottom_time = FloatField('Bottom Time (min.)', validators=[Optional(),
                                                                NumberRange(min=0, max=600, message='Value must be between 0 and 600')])
-    max_depth = FloatField('Max depth', validators=[DataRequired(),
+    max_depth = FloatField('Max depth', validators=[Optional(),
                                                     NumberRange(min=0, max=350, message='Value must be between 0 and 350')])
     depth_units = RadioField('Depth units', choices=['meters', 'feet'], validators=[DataRequired()])
+    profile_upload = FileField('Dive computer profile (CSV of seconds, depth in meters, temperature)',
+                        validators=[FileAllowed(['csv', 'txt'], 'Profiles must be .csv files')])
     buddy_id = SelectField('Buddy', coerce=int, validators=[DataRequired()])
     comments = TextAreaField('Comments')
 
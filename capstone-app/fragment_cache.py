@@ -0,0 +1,103 @@
+"""Caching of rendered template fragments, keyed by user and version.
+
+In a template:
+
+    {% cache 'leaderboard', g.user.id %}
+      ...
+    {% endcache %}
+
+The cached HTML is reused until the version counter of any listed user is
+bumped. Routes that change what those fragments show (dives, buddies,
+profile edits) call fragment_cache.bump(...) for the affected users, and
+so does the job that refreshes their stats (see stats.py).
+"""
+
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from cache import make_backend
+from models import db, Buddy
+
+class FragmentCache:
+    """Holds the fragment backend and the per-user version counters."""
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.timeout = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_BACKEND', None)
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', 2048)
+        app.config.setdefault('FRAGMENT_CACHE_TIMEOUT', 60 * 60 * 24)
+
+        self.backend = make_backend(
+            app.config['FRAGMENT_CACHE_BACKEND'],
+            app.config['FRAGMENT_CACHE_SIZE']
+        )
+        self.timeout = app.config['FRAGMENT_CACHE_TIMEOUT']
+
+        app.extensions['fragment_cache'] = self
+        app.jinja_env.add_extension(FragmentCacheExtension)
+
+    def version(self, user_id):
+        """Returns the current version counter of a user."""
+
+        return self.backend.get_counter(f"version:{user_id}")
+
+    def bump(self, *user_ids):
+        """Invalidates every fragment that depends on these users."""
+
+        for user_id in set(user_ids):
+            if user_id is not None:
+                self.backend.incr(f"version:{user_id}")
+
+    def key(self, name, user_ids):
+        versions = ",".join(f"{user_id}.{self.version(user_id)}" for user_id in user_ids)
+        return f"fragment:{name}:{versions}"
+
+fragment_cache = FragmentCache()
+
+def invalidate_user_fragments(*user_ids):
+    """Expire cached fragments showing these users' dives or profiles.
+
+    That's the users' own pages plus the leaderboards of everyone who has
+    them as a buddy.
+    """
+
+    buddy_of = db.session.query(Buddy.buddy_user_id).filter(Buddy.main_user_id.in_(user_ids))
+    fragment_cache.bump(*user_ids, *[row.buddy_user_id for row in buddy_of])
+
+class FragmentCacheExtension(Extension):
+    """Adds the {% cache name, user_id, ... %}...{% endcache %} tag."""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+
+        return nodes.CallBlock(
+            self.call_method('_render_cached', [nodes.List(args)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_cached(self, args, caller):
+        cache = current_app.extensions['fragment_cache']
+        name, *user_ids = args
+        key = cache.key(name, user_ids)
+
+        html = cache.backend.get(key)
+        if html is None:
+            html = str(caller())
+            cache.backend.set(key, html, cache.timeout)
+
+        return Markup(html)
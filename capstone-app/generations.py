@@ -0,0 +1,43 @@
+"""Generation counters: cheap "has this changed?" checks for derived data.
+
+Things built from whole tables, like the divesite catalogue snapshot and
+the heatmap rasters, need to know when to rebuild. Counting the rows and
+taking the highest id costs a scan on every check and misses changes that
+keep both the same, such as reseeding with as many rows. Instead, code
+that writes divesites or dives bumps a named counter in the generations
+table, in the same transaction, and readers compare the counters they
+built from with the current ones: one primary key lookup.
+
+Writes that go around the app (bulk seeding, manual SQL) should bump the
+counters too; `flask catalogue build` bumps DIVESITES itself.
+"""
+
+from sqlalchemy import select
+
+from jobs import INSERTS
+from models import db, Generation
+
+DIVESITES = 'divesites'
+DIVES = 'dives'
+# Bumped along with DIVES when dives are deleted, which can't be applied
+# incrementally
+DIVES_REMOVED = 'dives_removed'
+
+def bump(*names):
+    """Moves these counters on. Part of the current transaction; the caller
+    commits."""
+
+    insert = INSERTS[db.session.get_bind(mapper=Generation).dialect.name]
+    db.session.execute(
+        insert(Generation)
+        .values([{'name': name, 'value': 1} for name in sorted(set(names))])
+        .on_conflict_do_update(index_elements=[Generation.name], set_={'value': Generation.value + 1})
+    )
+
+def current(*names):
+    """The counters' values, in order. Never-bumped counters are 0."""
+
+    values = dict(db.session.execute(
+        select(Generation.name, Generation.value).where(Generation.name.in_(names))
+    ).all())
+    return tuple(values.get(name, 0) for name in names)
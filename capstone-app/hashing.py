@@ -0,0 +1,122 @@
+"""Password hashing, run on a small bounded pool instead of the request thread."""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_bcrypt import Bcrypt
+
+bcrypt = Bcrypt()
+
+class HashingBusy(Exception):
+    """Raised when too many hashes are already waiting for a worker."""
+
+class PasswordHasher:
+    """Hashes and checks passwords on a bounded worker pool.
+
+    bcrypt releases the GIL while it works, so a couple of threads keep the
+    cost off the request thread while capping how many cores a signup or
+    login burst can take. Requests beyond the queue limit fail fast with
+    HashingBusy rather than piling up behind each other.
+    """
+
+    def __init__(self, app=None):
+        self.rounds = 12
+        self.timeout = 5
+        self._workers = 2
+        self._slots = None
+        self._pool = None
+        self._pool_pid = None
+        self._dummy_hash = None
+        self._dummy_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read hashing settings from app config."""
+
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+        app.config.setdefault('PASSWORD_HASH_QUEUE', 16)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 5)
+
+        bcrypt.init_app(app)
+
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self._workers = app.config['PASSWORD_HASH_WORKERS']
+        self._slots = threading.BoundedSemaphore(
+            self._workers + app.config['PASSWORD_HASH_QUEUE']
+        )
+        # Made by the first unknown-user login, at this cost
+        self._dummy_hash = None
+
+    def _get_pool(self):
+        """Returns this process's pool, making a new one after a fork."""
+
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self._workers,
+                    thread_name_prefix="password-hash"
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _run(self, fn, *args):
+        """Runs fn on the pool and waits for the result."""
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HashingBusy()
+
+        try:
+            future = self._get_pool().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda f: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        """Returns a bcrypt hash of password at the configured cost."""
+
+        hashed = self._run(bcrypt.generate_password_hash, password, self.rounds)
+        return hashed.decode('UTF-8')
+
+    def check(self, hashed, password):
+        """Returns True if password matches hashed.
+
+        Pass hashed=None for an unknown user: the password is still checked
+        against a throwaway hash so the response takes as long as a real
+        failed login. The first such check also makes that hash.
+        """
+
+        if hashed is None:
+            self._run(self._check_dummy, password)
+            return False
+
+        return self._run(bcrypt.check_password_hash, hashed, password)
+
+    def _check_dummy(self, password):
+        """Checks password against the throwaway hash, making it first if
+        there isn't one at the configured cost yet. Runs on the pool, so
+        building an app never waits for a full-cost hash."""
+
+        with self._dummy_lock:
+            if self._dummy_hash is None or self.needs_rehash(self._dummy_hash):
+                self._dummy_hash = bcrypt.generate_password_hash(os.urandom(16).hex(), self.rounds).decode('UTF-8')
+            dummy_hash = self._dummy_hash
+
+        bcrypt.check_password_hash(dummy_hash, password)
+
+    def needs_rehash(self, hashed):
+        """Is hashed using a different cost factor than the configured one?"""
+
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
@@ -0,0 +1,173 @@
+"""Where dives happen: dive counts on a lat/lng grid, for the map's heatmap.
+
+The world is cut into square cells, coarser or finer depending on how far
+the map is zoomed in (LEVELS). Counting is done in NumPy: the divesite
+coordinates of the matching dives are pulled out as two columns and
+binned with np.bincount, so no Python loop runs per dive and no dive is
+sent to the browser.
+
+Unfiltered counts are kept per app, one raster per level, and brought
+up to date from the DIVES and DIVES_REMOVED generations (see
+generations.py), like the catalogue: when dives have only been added
+since, just those past the highest id binned so far are added to the
+rasters, otherwise they are rebuilt. Filtered counts (by date, dive type
+or a user's buddies) are binned per request.
+"""
+
+import threading
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import select
+
+import generations
+from models import db, Buddy, Dive, Divesite, Divetype
+
+# Cell size in degrees for each level, coarse to fine, and the highest
+# Google Maps zoom each one is used up to
+LEVELS = (5.0, 1.0, 0.25)
+MAX_ZOOM = (4, 7)
+
+DIVE_TYPES = ("drysuit", "night", "cave", "wreck", "drift", "ice", "deep", "technical", "altitude", "muck")
+
+def level_for_zoom(zoom):
+    """The grid level to draw at a Google Maps zoom level."""
+
+    for level, max_zoom in enumerate(MAX_ZOOM):
+        if zoom <= max_zoom:
+            return level
+    return len(LEVELS) - 1
+
+def grid_shape(level):
+    cell = LEVELS[level]
+    return int(180 / cell), int(360 / cell)
+
+def cell_indexes(lats, lngs, level):
+    """Flat raster indexes of the cells these coordinates fall in."""
+
+    cell = LEVELS[level]
+    rows, cols = grid_shape(level)
+    row = np.clip(((lats + 90) // cell).astype(np.int64), 0, rows - 1)
+    col = np.clip(((lngs + 180) // cell).astype(np.int64), 0, cols - 1)
+    return row * cols + col
+
+def histogram(lats, lngs, level):
+    """A raster of how many of these coordinates fall in each cell."""
+
+    rows, cols = grid_shape(level)
+    counts = np.bincount(cell_indexes(lats, lngs, level), minlength=rows * cols)
+    return counts.astype(np.int32).reshape(rows, cols)
+
+def coordinates(rows):
+    """Rows starting with (lat, lng) as two float arrays, leaving out
+    divesites without coordinates."""
+
+    if not rows:
+        return np.empty(0), np.empty(0)
+
+    lats, lngs = np.array(rows, dtype=float)[:, :2].T
+    known = ~(np.isnan(lats) | np.isnan(lngs))
+    return lats[known], lngs[known]
+
+def dive_coordinates(start=None, end=None, dive_type=None, buddies_of=None, after_id=None):
+    """The statement selecting the divesite (lat, lng) of every matching dive."""
+
+    statement = select(Divesite.lat, Divesite.lng).join(Dive, Dive.divesite_id == Divesite.id)
+
+    if start:
+        statement = statement.where(Dive.date >= start)
+    if end:
+        statement = statement.where(Dive.date <= end)
+    if dive_type:
+        statement = statement.join(Divetype, Divetype.dive_id == Dive.id).where(getattr(Divetype, dive_type))
+    if buddies_of is not None:
+        statement = statement.where(Dive.user_id.in_(
+            select(Buddy.main_user_id).where(Buddy.buddy_user_id == buddies_of)
+        ))
+    if after_id is not None:
+        statement = statement.where(Dive.id > after_id)
+
+    return statement
+
+class Rasters:
+    """Unfiltered counts at every level, kept up to date incrementally."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generations = None
+        self._max_id = None
+        self._rasters = None
+
+    def get(self, level):
+        current = generations.current(generations.DIVES, generations.DIVES_REMOVED)
+
+        with self._lock:
+            if self._generations != current:
+                self._update(current)
+            return self._rasters[level]
+
+    def _update(self, current):
+        if self._generations is not None and self._generations[1] == current[1]:
+            rows = db.session.execute(dive_coordinates(after_id=self._max_id or 0).add_columns(Dive.id)).all()
+
+            # Each dive added bumps DIVES once. Any other difference means
+            # a bulk load, or a dive that got an id below one already seen
+            if len(rows) == current[0] - self._generations[0]:
+                lats, lngs = coordinates(rows)
+                # Update copies, so responses being built keep consistent counts
+                rasters = [raster.copy() for raster in self._rasters]
+                for level, raster in enumerate(rasters):
+                    np.add.at(raster.reshape(-1), cell_indexes(lats, lngs, level), 1)
+                self._rasters = rasters
+                self._max_id = max((row.id for row in rows), default=self._max_id)
+                self._generations = current
+                return
+
+        rows = db.session.execute(dive_coordinates().add_columns(Dive.id)).all()
+        lats, lngs = coordinates(rows)
+        self._rasters = [histogram(lats, lngs, level) for level in range(len(LEVELS))]
+        self._max_id = max((row.id for row in rows), default=None)
+        self._generations = current
+
+def sparse_cells(raster, level, bounds=None):
+    """The non-empty cells of a raster as a flat [row, col, count, ...] list,
+    optionally only those overlapping (ne_lat, ne_lng, sw_lat, sw_lng)."""
+
+    bottom = left = 0
+    if bounds is not None:
+        ne_lat, ne_lng, sw_lat, sw_lng = bounds
+        cell = LEVELS[level]
+        rows, cols = grid_shape(level)
+        bottom = max(int((sw_lat + 90) // cell), 0)
+        top = min(int((ne_lat + 90) // cell), rows - 1) + 1
+
+        # A view across the antimeridian keeps every longitude
+        if sw_lng <= ne_lng:
+            left = max(int((sw_lng + 180) // cell), 0)
+            right = min(int((ne_lng + 180) // cell), cols - 1) + 1
+        else:
+            right = cols
+
+        raster = raster[bottom:top, left:right]
+
+    row, col = np.nonzero(raster)
+    return np.column_stack((row + bottom, col + left, raster[row, col])).reshape(-1).tolist()
+
+def heatmap(zoom, bounds=None, **filters):
+    """What the map draws: the grid's origin and cell size and the dive
+    count of every non-empty cell, as flat [row, col, count, ...] triples."""
+
+    level = level_for_zoom(zoom)
+
+    if any(value is not None for value in filters.values()):
+        lats, lngs = coordinates(db.session.execute(dive_coordinates(**filters)).all())
+        raster = histogram(lats, lngs, level)
+    else:
+        raster = current_app.extensions.setdefault('heatmap', Rasters()).get(level)
+
+    return {
+        'level': level,
+        'cell': LEVELS[level],
+        'origin': [-90, -180],
+        'cells': sparse_cells(raster, level, bounds),
+    }
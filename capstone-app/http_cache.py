@@ -0,0 +1,113 @@
+"""Route-aware HTTP caching.
+
+- Static files linked with url_for('static', ...) get a content fingerprint
+  (?v=...) in their URL and are cached by browsers for a year.
+- Views marked with @cache_policy(REVALIDATE_*) get an ETag and answer
+  conditional GETs with 304 Not Modified.
+- Everything else is treated as a user-specific page: private, no-store.
+
+A view that sets its own Cache-Control header is left alone.
+"""
+
+import hashlib
+import os
+
+from flask import current_app, request
+
+ONE_YEAR = 60 * 60 * 24 * 365
+
+class CachePolicy:
+    """A Cache-Control value, plus whether to answer conditional GETs."""
+
+    def __init__(self, cache_control, conditional=False):
+        self.cache_control = cache_control
+        self.conditional = conditional
+
+# Pages that depend on who is logged in
+PRIVATE = CachePolicy('private, no-store')
+
+# Pages that depend on who is logged in but are cheap to revalidate
+REVALIDATE_PRIVATE = CachePolicy('private, no-cache', conditional=True)
+
+# Responses that are the same for everyone, like the map JSON
+REVALIDATE_PUBLIC = CachePolicy('public, no-cache', conditional=True)
+
+def cache_policy(policy):
+    """Decorator setting the caching policy of a view."""
+
+    def decorator(view):
+        view.cache_policy = policy
+        return view
+
+    return decorator
+
+_fingerprints = {}
+
+def fingerprint(app, filename):
+    """Returns a short hash of a static file's contents ('' if missing)."""
+
+    path = os.path.join(app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return ''
+
+    cached = _fingerprints.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, 'rb') as f:
+        digest = hashlib.md5(f.read()).hexdigest()[:12]
+
+    _fingerprints[path] = (mtime, digest)
+    return digest
+
+def init_app(app):
+    """Add static fingerprints to URLs and caching headers to responses."""
+
+    app.config.setdefault('STATIC_UNVERSIONED_MAX_AGE', 60 * 60)
+
+    @app.url_defaults
+    def add_static_fingerprint(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            version = fingerprint(app, values['filename'])
+            if version:
+                values['v'] = version
+
+    app.after_request(apply_cache_policy)
+
+def apply_cache_policy(response):
+    """Sets Cache-Control (and ETag handling) based on the matched route."""
+
+    if 'Cache-Control' in response.headers and request.endpoint != 'static':
+        return response
+
+    if request.endpoint == 'static':
+        return _cache_static(response)
+
+    view = current_app.view_functions.get(request.endpoint)
+    policy = getattr(view, 'cache_policy', PRIVATE)
+
+    response.headers['Cache-Control'] = policy.cache_control
+
+    if policy.conditional and response.status_code == 200 and not response.is_streamed:
+        response.add_etag()
+        response.make_conditional(request)
+
+    return response
+
+def _cache_static(response):
+    if response.status_code >= 400:
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    filename = request.view_args.get('filename', '')
+    version = request.args.get('v')
+
+    if version and version == fingerprint(current_app, filename):
+        response.headers['Cache-Control'] = f'public, max-age={ONE_YEAR}, immutable'
+    else:
+        max_age = current_app.config['STATIC_UNVERSIONED_MAX_AGE']
+        response.headers['Cache-Control'] = f'public, max-age={max_age}'
+
+    return response
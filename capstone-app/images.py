@@ -0,0 +1,307 @@
+"""Resized, re-encoded images for the templates.
+
+Images are served through /images/resize?src=...&w=..., which shrinks the
+source to one of WIDTHS and encodes it as AVIF or WebP when the browser
+accepts them (JPEG/PNG otherwise). Sources can be files under /static or
+remote http(s) URLs, such as the image_url users paste into their profile.
+Results are kept in a DiskCache.
+
+The route only takes URLs made by the template helpers, which sign `src`
+with the app's secret key, so it can't be used as an open image proxy.
+Remote sources must resolve to public addresses only, and the download
+connects to the address that was checked rather than resolving the name
+again.
+
+`flask images build` pre-generates AVIF/WebP variants of the bundled
+static images into static/images/variants, which the route serves directly.
+
+Pillow is optional: without it the template helpers return the original
+URL and the route just serves local files unchanged.
+"""
+
+import hashlib
+import io
+import ipaddress
+import os
+import socket
+from urllib.parse import urlparse
+
+import click
+import urllib3
+from flask import Blueprint, abort, current_app, request, send_file, send_from_directory, url_for
+from flask.cli import AppGroup
+from itsdangerous import Signer
+from requests.certs import where as ca_bundle
+from werkzeug.security import safe_join
+
+from disk_cache import DiskCache
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+images = Blueprint('images', __name__)
+images_cli = AppGroup('images', help="Build resized image variants.")
+
+WIDTHS = (64, 128, 256, 480, 960, 1440, 1920)
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+SOURCE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+VARIANTS_DIR = os.path.join('images', 'variants')
+
+def init_app(app):
+    """Set up the image cache, route, template helpers and CLI."""
+
+    app.config.setdefault('IMAGE_CACHE_DIR', os.path.join(app.instance_path, 'images'))
+    app.config.setdefault('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+    app.config.setdefault('IMAGE_QUALITY', 75)
+    app.config.setdefault('IMAGE_MAX_AGE', 60 * 60 * 24)
+    app.config.setdefault('IMAGE_PROXY_TIMEOUT', 10)
+    app.config.setdefault('IMAGE_PROXY_MAX_BYTES', 10 * 1024 * 1024)
+    app.config.setdefault('IMAGE_PROXY_ALLOW_PRIVATE', False)
+
+    app.extensions['images'] = DiskCache(
+        app.config['IMAGE_CACHE_DIR'],
+        app.config['IMAGE_CACHE_MAX_BYTES']
+    )
+    app.register_blueprint(images)
+    app.cli.add_command(images_cli)
+    app.jinja_env.globals.update(resized_image=resized_image, image_srcset=image_srcset)
+
+def modern_formats():
+    """Returns the modern formats this Pillow build can write, best first."""
+
+    if Image is None:
+        return []
+
+    return [fmt for fmt in ('avif', 'webp') if features.check(fmt)]
+
+def _snap_width(width):
+    """Returns the smallest allowed width that is at least `width`."""
+
+    for allowed in WIDTHS:
+        if allowed >= width:
+            return allowed
+    return WIDTHS[-1]
+
+def resized_image(src, width):
+    """Template helper: URL of `src` resized to about `width` pixels wide."""
+
+    if not src or Image is None:
+        return src
+
+    return url_for('images.resize', src=src, w=_snap_width(width), s=_signer().get_signature(src).decode())
+
+def image_srcset(src, widths=WIDTHS):
+    """Template helper: a srcset attribute value offering `src` at several widths."""
+
+    if not src or Image is None:
+        return ""
+
+    return ", ".join(f"{resized_image(src, width)} {width}w" for width in widths)
+
+def _signer():
+    return Signer(current_app.secret_key, salt='images.resize')
+
+def resize_image(data, width, fmt):
+    """Shrinks image bytes to at most `width` pixels wide and encodes them as fmt."""
+
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+
+        if img.width > width:
+            height = max(1, round(img.height * width / img.width))
+            img = img.resize((width, height), Image.LANCZOS)
+
+        if fmt == 'jpeg' and img.mode != 'RGB':
+            img = img.convert('RGB')
+        elif img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA')
+
+        out = io.BytesIO()
+        img.save(out, fmt.upper(), quality=current_app.config['IMAGE_QUALITY'])
+        return out.getvalue()
+
+def _choose_format(src):
+    """Picks the best output format the browser accepts."""
+
+    accept = request.headers.get('Accept', '')
+    for fmt in modern_formats():
+        if MIME_TYPES[fmt] in accept:
+            return fmt
+
+    # keep transparency for PNG sources
+    if src.lower().endswith('.png'):
+        return 'png'
+    return 'jpeg'
+
+def _static_path(src):
+    """Returns the file path for a /static URL, or None."""
+
+    prefix = current_app.static_url_path + '/'
+    if not src.startswith(prefix):
+        return None
+
+    path = safe_join(current_app.static_folder, src[len(prefix):].split('?')[0])
+    if path and os.path.isfile(path):
+        return path
+    return None
+
+def _variant_name(src_path, width, fmt):
+    """The variant's path under static/, keyed on the source's whole path
+    so that files with the same name in different folders don't collide."""
+
+    relative = os.path.relpath(src_path, current_app.static_folder).replace(os.sep, '/')
+    stem = os.path.splitext(os.path.basename(src_path))[0]
+    digest = hashlib.sha256(relative.encode('UTF-8')).hexdigest()[:12]
+    return os.path.join(VARIANTS_DIR, f"{stem}-{digest}-{width}.{fmt}")
+
+def _resolve(hostname, port):
+    """Returns an address hostname resolves to, or None if it can't be
+    resolved or (unless IMAGE_PROXY_ALLOW_PRIVATE) any address isn't public."""
+
+    try:
+        infos = socket.getaddrinfo(hostname, port, type=socket.SOCK_STREAM)
+        addresses = [ipaddress.ip_address(info[4][0]) for info in infos]
+    except (socket.gaierror, UnicodeError, ValueError):
+        return None
+
+    if not addresses:
+        return None
+    if not current_app.config['IMAGE_PROXY_ALLOW_PRIVATE'] and not all(a.is_global for a in addresses):
+        return None
+    return str(addresses[0])
+
+def _fetch_remote(src):
+    """Downloads a remote image, or returns None if not allowed or failed."""
+
+    url = urlparse(src)
+    try:
+        port = url.port or (443 if url.scheme == 'https' else 80)
+    except ValueError:
+        return None
+    if url.scheme not in ('http', 'https') or not url.hostname:
+        return None
+
+    address = _resolve(url.hostname, port)
+    if address is None:
+        return None
+
+    # Connect to the address just checked: resolving the name again could
+    # give a different (private) one
+    timeout = urllib3.Timeout(total=current_app.config['IMAGE_PROXY_TIMEOUT'])
+    if url.scheme == 'https':
+        pool = urllib3.HTTPSConnectionPool(
+            address, port, timeout=timeout, retries=False, server_hostname=url.hostname,
+            assert_hostname=url.hostname, cert_reqs='CERT_REQUIRED', ca_certs=ca_bundle()
+        )
+    else:
+        pool = urllib3.HTTPConnectionPool(address, port, timeout=timeout, retries=False)
+
+    path = (url.path or '/') + (f'?{url.query}' if url.query else '')
+    host = url.netloc.rpartition('@')[2]
+    max_bytes = current_app.config['IMAGE_PROXY_MAX_BYTES']
+
+    try:
+        with pool:
+            response = pool.urlopen('GET', path, headers={'Host': host}, redirect=False, preload_content=False)
+            try:
+                if response.status != 200:
+                    return None
+                data = response.read(max_bytes + 1, decode_content=True)
+            finally:
+                response.release_conn()
+    except urllib3.exceptions.HTTPError:
+        return None
+
+    if len(data) > max_bytes:
+        return None
+    return data
+
+@images.route('/images/resize')
+def resize():
+    """Returns `src` resized to width `w` in the best format the browser takes."""
+
+    src = request.args.get('src', '')
+    width = request.args.get('w', type=int)
+
+    if width not in WIDTHS or not _signer().verify_signature(src, request.args.get('s', '')):
+        abort(404)
+
+    local_path = _static_path(src)
+
+    if Image is None:
+        if local_path is None:
+            abort(404)
+        return send_from_directory(os.path.dirname(local_path), os.path.basename(local_path))
+
+    fmt = _choose_format(src)
+    path = None
+
+    if local_path:
+        variant = os.path.join(current_app.static_folder, _variant_name(local_path, width, fmt))
+        if os.path.isfile(variant):
+            path = variant
+
+    if path is None:
+        cache = current_app.extensions['images']
+        key = f"{src}|{width}|{fmt}"
+        path = cache.get(key)
+
+        if path is None:
+            if local_path:
+                with open(local_path, 'rb') as f:
+                    data = f.read()
+            else:
+                data = _fetch_remote(src)
+
+            if data is None:
+                abort(404)
+
+            try:
+                resized = resize_image(data, width, fmt)
+            except (OSError, Image.DecompressionBombError):
+                abort(415)
+
+            path = cache.put(key, resized)
+
+    response = send_file(path, mimetype=MIME_TYPES[fmt], max_age=current_app.config['IMAGE_MAX_AGE'])
+    response.cache_control.public = True
+    response.vary.add('Accept')
+    return response
+
+@images_cli.command('build')
+@click.option('--force', is_flag=True, help="Rebuild variants that already exist.")
+def build_variants(force):
+    """Write AVIF/WebP variants of static/images at every width."""
+
+    if Image is None:
+        raise click.ClickException("Pillow is not installed.")
+
+    static_folder = current_app.static_folder
+    source_dir = os.path.join(static_folder, 'images')
+    os.makedirs(os.path.join(static_folder, VARIANTS_DIR), exist_ok=True)
+    formats = modern_formats()
+
+    for name in sorted(os.listdir(source_dir)):
+        src_path = os.path.join(source_dir, name)
+        if not name.lower().endswith(SOURCE_EXTENSIONS) or not os.path.isfile(src_path):
+            continue
+
+        with open(src_path, 'rb') as f:
+            data = f.read()
+
+        with Image.open(io.BytesIO(data)) as img:
+            source_width = img.width
+
+        # wider variants would just be copies of the largest one
+        for width in [w for w in WIDTHS if w <= source_width] or WIDTHS[:1]:
+            for fmt in formats:
+                out_path = os.path.join(static_folder, _variant_name(src_path, width, fmt))
+                if os.path.exists(out_path) and not force:
+                    continue
+
+                with open(out_path, 'wb') as f:
+                    f.write(resize_image(data, width, fmt))
+
+        click.echo(f"Built variants of {name}")
@@ -0,0 +1,225 @@
+"""Per-request query counting and slow request logging.
+
+For every request this records the number of SQL statements, time spent
+in the database, time spent rendering templates, total latency and
+response size. Totals per endpoint are exposed in Prometheus text format
+at /metrics. Requests over SLOW_REQUEST_QUERIES statements or
+SLOW_REQUEST_MS milliseconds are logged with their most expensive
+statements.
+
+/metrics is only served with METRICS_TOKEN set, to scrapers that send it
+as a bearer token; otherwise it is a 404.
+
+Numbers are kept per worker process; Prometheus should scrape each worker
+(or sum them) when running several.
+"""
+
+import hmac
+import threading
+import time
+from collections import defaultdict
+
+from flask import Blueprint, Response, abort, current_app, g, has_request_context, request
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+instrumentation = Blueprint('instrumentation', __name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class RequestStats:
+    """What one request did."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = []
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self._template_start = None
+
+    def add_query(self, statement, duration):
+        self.queries.append((statement, duration))
+        self.db_time += duration
+
+    def top_statements(self, limit=5):
+        """Returns [(statement, count, total seconds)], most expensive first."""
+
+        grouped = defaultdict(lambda: [0, 0.0])
+        for statement, duration in self.queries:
+            grouped[statement][0] += 1
+            grouped[statement][1] += duration
+
+        ranked = sorted(grouped.items(), key=lambda item: item[1][1], reverse=True)
+        return [(statement, count, total) for statement, (count, total) in ranked[:limit]]
+
+class EndpointMetrics:
+    """Running totals for every endpoint, in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = defaultdict(lambda: {
+            'requests': 0,
+            'duration': 0.0,
+            'queries': 0,
+            'db_time': 0.0,
+            'template_time': 0.0,
+            'bytes': 0,
+            'buckets': [0] * len(LATENCY_BUCKETS)
+        })
+
+    def record(self, endpoint, stats, duration, size):
+        with self._lock:
+            totals = self._totals[endpoint]
+            totals['requests'] += 1
+            totals['duration'] += duration
+            totals['queries'] += len(stats.queries)
+            totals['db_time'] += stats.db_time
+            totals['template_time'] += stats.template_time
+            totals['bytes'] += size
+
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    totals['buckets'][i] += 1
+
+    def render(self):
+        """Returns all totals in Prometheus text exposition format."""
+
+        with self._lock:
+            snapshot = {endpoint: dict(totals, buckets=list(totals['buckets']))
+                        for endpoint, totals in self._totals.items()}
+
+        lines = []
+
+        def metric(name, kind, help_text, key):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for endpoint, totals in sorted(snapshot.items()):
+                lines.append(f'{name}{{endpoint="{endpoint}"}} {totals[key]}')
+
+        metric('scuba_requests_total', 'counter', "Requests handled.", 'requests')
+        metric('scuba_request_queries_total', 'counter', "SQL statements executed.", 'queries')
+        metric('scuba_request_db_seconds_total', 'counter', "Time spent executing SQL.", 'db_time')
+        metric('scuba_request_template_seconds_total', 'counter', "Time spent rendering templates.", 'template_time')
+        metric('scuba_response_bytes_total', 'counter', "Response body bytes sent.", 'bytes')
+
+        name = 'scuba_request_duration_seconds'
+        lines.append(f"# HELP {name} Request latency.")
+        lines.append(f"# TYPE {name} histogram")
+        for endpoint, totals in sorted(snapshot.items()):
+            for bound, count in zip(LATENCY_BUCKETS, totals['buckets']):
+                lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="+Inf"}} {totals["requests"]}')
+            lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {totals["duration"]}')
+            lines.append(f'{name}_count{{endpoint="{endpoint}"}} {totals["requests"]}')
+
+        return "\n".join(lines) + "\n"
+
+metrics = EndpointMetrics()
+
+def current_stats():
+    """Returns the RequestStats of the current request, or None."""
+
+    if not has_request_context():
+        return None
+    return g.get('request_stats')
+
+def init_app(app):
+    """Hook query, template and request timing into the app."""
+
+    app.config.setdefault('SLOW_REQUEST_QUERIES', 30)
+    app.config.setdefault('SLOW_REQUEST_MS', 500)
+    app.config.setdefault('METRICS_TOKEN', None)
+
+    _listen_to_engines()
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.register_blueprint(instrumentation)
+
+_listening = False
+
+def _listen_to_engines():
+    """Times every statement on every engine (binds included)."""
+
+    global _listening
+    if _listening:
+        return
+
+    event.listen(Engine, 'before_cursor_execute', _query_started)
+    event.listen(Engine, 'after_cursor_execute', _query_finished)
+    event.listen(Engine, 'handle_error', _query_failed)
+    _listening = True
+
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_start'].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.add_query(statement, time.perf_counter() - started)
+
+def _query_failed(context):
+    """Drops the start time of a statement that raised, so that the next
+    statement on the connection isn't timed from it."""
+
+    conn = context.connection
+    if conn is not None and conn.info.get('query_start'):
+        conn.info['query_start'].pop()
+
+def _template_started(sender, template, context, **extra):
+    stats = current_stats()
+    if stats is not None and stats._template_start is None:
+        stats._template_start = time.perf_counter()
+
+def _template_finished(sender, template, context, **extra):
+    stats = current_stats()
+    if stats is not None and stats._template_start is not None:
+        stats.template_time += time.perf_counter() - stats._template_start
+        stats._template_start = None
+
+def _start_request():
+    g.request_stats = RequestStats()
+
+def _finish_request(response):
+    stats = g.pop('request_stats', None)
+    if stats is None or request.endpoint == 'instrumentation.prometheus_metrics':
+        return response
+
+    duration = time.perf_counter() - stats.start
+    size = response.content_length
+    if size is None:
+        size = 0 if response.is_streamed else response.calculate_content_length() or 0
+    endpoint = request.endpoint or 'unmatched'
+
+    metrics.record(endpoint, stats, duration, size)
+
+    query_budget = current_app.config['SLOW_REQUEST_QUERIES']
+    time_budget = current_app.config['SLOW_REQUEST_MS'] / 1000
+
+    if len(stats.queries) > query_budget or duration > time_budget:
+        top = "\n".join(
+            f"  {count}x {total * 1000:.1f}ms  {' '.join(statement.split())[:300]}"
+            for statement, count, total in stats.top_statements()
+        )
+        current_app.logger.warning(
+            "Slow request %s %s (%s): %.1fms, %d queries, %.1fms db, %.1fms templates\n%s",
+            request.method, request.path, endpoint, duration * 1000, len(stats.queries),
+            stats.db_time * 1000, stats.template_time * 1000, top
+        )
+
+    return response
+
+@instrumentation.route('/metrics')
+def prometheus_metrics():
+    """Per-endpoint request metrics in Prometheus text format."""
+
+    token = current_app.config['METRICS_TOKEN']
+    if not token or not hmac.compare_digest(request.headers.get('Authorization', '').encode(),
+                                            f"Bearer {token}".encode()):
+        abort(404)
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
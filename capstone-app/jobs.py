@@ -0,0 +1,179 @@
+"""A small job queue kept in the database, for work that can wait.
+
+Write routes queue follow-up work, like refreshing the stats tables or
+rebuilding the divesite catalogue, and return; a separate worker process
+runs it:
+
+    flask --app app jobs work
+
+A job is a task name plus JSON arguments. Queueing a job is part of the
+route's transaction, so it exists exactly when the write it follows does.
+A job that is already waiting isn't queued again, so ten dives logged in
+a row refresh the diver's stats once.
+
+Failed jobs are retried with exponential backoff (JOBS_RETRY_DELAY
+seconds, doubling each time) up to JOBS_MAX_ATTEMPTS times, then kept
+with status 'failed' for `flask jobs status`. A job whose worker died is
+picked up again after JOBS_LOCK_TIMEOUT seconds, so tasks must be safe
+to run twice.
+
+On Postgres, any number of workers can run side by side (jobs are claimed
+with SKIP LOCKED). On SQLite, run one.
+"""
+
+import json
+import time
+import traceback
+from datetime import timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, utcnow, Job
+
+PENDING = 'pending'
+RUNNING = 'running'
+FAILED = 'failed'
+
+INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+jobs_cli = AppGroup('jobs', help="Run and inspect background jobs.")
+
+tasks = {}
+
+def task(func):
+    """Registers a function as a task that jobs can run, under its name."""
+
+    tasks[func.__name__] = func
+    return func
+
+def init_app(app):
+    """Set up the queue's settings and CLI."""
+
+    app.config.setdefault('JOBS_MAX_ATTEMPTS', 5)
+    app.config.setdefault('JOBS_RETRY_DELAY', 10)
+    app.config.setdefault('JOBS_LOCK_TIMEOUT', 10 * 60)
+    app.config.setdefault('JOBS_BATCH_SIZE', 50)
+    app.config.setdefault('JOBS_POLL_INTERVAL', 1)
+
+    app.cli.add_command(jobs_cli)
+
+def job_key(task_name, args):
+    return f"{task_name}:{json.dumps(list(args), separators=(',', ':'))}"
+
+def enqueue(task_name, *args, delay=0):
+    """Queues `task_name(*args)`, unless the same job is already waiting.
+
+    With a `delay` (in seconds) the job waits that long before running,
+    and everything queued for it meanwhile is covered by that one run.
+    The job is added to the current transaction; the caller commits.
+    """
+
+    if task_name not in tasks:
+        raise ValueError(f"Unknown task {task_name!r}")
+
+    now = utcnow()
+    insert = INSERTS[db.session.get_bind(mapper=Job).dialect.name]
+
+    db.session.execute(
+        insert(Job)
+        .values(task=task_name, key=job_key(task_name, args), args=json.dumps(list(args)),
+                status=PENDING, attempts=0, run_at=now + timedelta(seconds=delay), created_at=now)
+        .on_conflict_do_nothing(index_elements=[Job.key], index_where=Job.status == PENDING)
+    )
+
+def claim(limit):
+    """Marks up to `limit` jobs that are due as running and returns them."""
+
+    now = utcnow()
+    abandoned = now - timedelta(seconds=current_app.config['JOBS_LOCK_TIMEOUT'])
+
+    jobs = db.session.scalars(
+        select(Job)
+        .where(or_(
+            and_(Job.status == PENDING, Job.run_at <= now),
+            and_(Job.status == RUNNING, Job.locked_at < abandoned)
+        ))
+        .order_by(Job.run_at, Job.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ).all()
+
+    for job in jobs:
+        job.status = RUNNING
+        job.locked_at = now
+        job.attempts += 1
+
+    db.session.commit()
+    return jobs
+
+def run(job):
+    """Runs a claimed job. Returns True if it succeeded.
+
+    The task's changes and the job's removal are committed together.
+    """
+
+    try:
+        tasks[job.task](*json.loads(job.args))
+        db.session.delete(job)
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("Job %s failed", job.key)
+        _retry_later(job, traceback.format_exc())
+        return False
+
+def _retry_later(job, error):
+    job.last_error = error
+
+    if job.attempts >= current_app.config['JOBS_MAX_ATTEMPTS']:
+        job.status = FAILED
+    elif db.session.query(Job.id).filter_by(key=job.key, status=PENDING).first():
+        # Queued again since it was claimed; that job will do the work
+        db.session.delete(job)
+    else:
+        delay = current_app.config['JOBS_RETRY_DELAY'] * 2 ** (job.attempts - 1)
+        job.status = PENDING
+        job.run_at = utcnow() + timedelta(seconds=delay)
+
+    db.session.commit()
+
+def work_once(limit=None):
+    """Runs one batch of due jobs. Returns how many were run."""
+
+    jobs = claim(limit or current_app.config['JOBS_BATCH_SIZE'])
+    for job in jobs:
+        run(job)
+    return len(jobs)
+
+@jobs_cli.command('work')
+@click.option('--once', is_flag=True, help="Stop when no jobs are due, instead of waiting for more.")
+def work(once):
+    """Run jobs as they come in."""
+
+    interval = current_app.config['JOBS_POLL_INTERVAL']
+
+    while True:
+        if not work_once():
+            if once:
+                return
+            time.sleep(interval)
+
+@jobs_cli.command('status')
+def status():
+    """Show how many jobs are waiting, running and failed."""
+
+    counts = db.session.execute(select(Job.status, func.count()).group_by(Job.status)).all()
+    for job_status, count in sorted(counts):
+        click.echo(f"{job_status}: {count}")
+
+    for job in db.session.scalars(select(Job).where(Job.status == FAILED).order_by(Job.id)):
+        last_line = (job.last_error or '').strip().splitlines()[-1:] or ['']
+        click.echo(f"  {job.key} (after {job.attempts} attempts): {last_line[0]}")
@@ -0,0 +1,227 @@
+"""Leaderboards over every diver: worldwide, per country and per continent.
+
+Ranking every user on each page view doesn't scale, so places are kept in
+the leaderboard_ranks table, one row per board, scope and user, with an
+index on (board, scope, rank). The top of a board is a short index range
+scan, and a user's own place is a primary key lookup, however many divers
+there are.
+
+The totals being ranked (user_stats and user_region_stats) are refreshed
+per user as dives change (see stats.py). That adds the users to
+leaderboard_changes and queues a rank_leaderboards job, which waits
+LEADERBOARD_RANK_DELAY seconds first, so a stream of changes is ranked in
+one pass.
+
+The job only moves the changed users. A place is 1 + the number of users
+with a greater value (ties share it), so when a user's value goes from
+old to new, only the users with values between the two move, by one
+place each. A board and scope where a user's value didn't change isn't
+touched. The cost is a few statements per changed place, plus updating
+the places between the old and new value. A newcomer pushes down everyone
+below them, and a user who leaves pulls everyone below them up.
+`flask stats rebuild` still ranks everything from scratch with RANK().
+
+Moves are relative to the places stored, so two rankings running at once
+would shift the same places twice. Every ranking takes RANK_LOCK first:
+a Postgres advisory lock held until the transaction ends. SQLite allows
+one writer at a time, so there it starts with a write instead.
+"""
+
+from flask import current_app
+from sqlalchemy import and_, delete, func, literal, select, union_all
+from sqlalchemy.orm import contains_eager
+
+from jobs import INSERTS, enqueue, task
+from models import db, LeaderboardChange, LeaderboardRank, User, UserRegionStats, UserStats
+
+WORLD = 'world'
+
+# name: (title, units, format); boards ranked per country and continent too
+BOARDS = {
+    'num_dives': ("Most Dives", "dives", "{:,.0f}"),
+    'max_depth': ("Deepest Dive", "ft", "{:,.2f}"),
+    'max_bottom_time': ("Longest Dive", "min", "{:,.1f}"),
+    'num_countries': ("Most Countries", "countries", "{:,.0f}"),
+}
+REGIONAL_BOARDS = ('num_dives', 'max_depth', 'max_bottom_time')
+# pg_advisory_xact_lock key serialising rankings
+RANK_LOCK = 0x72616e6b
+
+def init_app(app):
+    app.config.setdefault('LEADERBOARD_RANK_DELAY', 30)
+
+def scope_for(country=None, continent=None):
+    """The scope of a leaderboard limited to a country or continent, or worldwide."""
+
+    if country:
+        return f"country:{country}"
+    if continent:
+        return f"continent:{continent}"
+    return WORLD
+
+def rerank_soon(*user_ids):
+    """Queues re-ranking these users' places. The caller commits."""
+
+    if not user_ids:
+        return
+
+    insert = INSERTS[db.session.get_bind(mapper=LeaderboardChange).dialect.name]
+    db.session.execute(
+        insert(LeaderboardChange)
+        .values([{'user_id': user_id} for user_id in sorted(set(user_ids))])
+        .on_conflict_do_nothing(index_elements=[LeaderboardChange.user_id])
+    )
+    enqueue('rank_leaderboards', delay=current_app.config['LEADERBOARD_RANK_DELAY'])
+
+def top(board, scope=WORLD, limit=10):
+    """The first `limit` places of a board, as LeaderboardRank rows with their users.
+
+    Deleted users give up their places at the next ranking; until then
+    they're left out here.
+    """
+
+    return db.session.scalars(
+        select(LeaderboardRank)
+        .join(LeaderboardRank.user)
+        .options(contains_eager(LeaderboardRank.user))
+        .where(LeaderboardRank.board == board, LeaderboardRank.scope == scope, User.deleted_at.is_(None))
+        .order_by(LeaderboardRank.rank, LeaderboardRank.user_id)
+        .limit(limit)
+    ).all()
+
+def place(board, user_id, scope=WORLD):
+    """A user's LeaderboardRank on a board, or None if they aren't on it."""
+
+    return db.session.get(LeaderboardRank, (board, scope, user_id))
+
+@task
+def rank_leaderboards():
+    """Moves the users waiting in leaderboard_changes to their current places."""
+
+    # Taken off the list first: a change made while this runs queues them again
+    user_ids = db.session.scalars(
+        delete(LeaderboardChange).returning(LeaderboardChange.user_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    rank_users(user_ids)
+
+def rank_users(user_ids):
+    """Moves these users to their current places on every board and scope,
+    shifting the places of the users they pass or fall behind. The caller
+    commits."""
+
+    lock_ranks()
+    for user_id in sorted(set(user_ids)):
+        current = current_values(user_id)
+        ranked = {
+            (row.board, row.scope): row.value
+            for row in db.session.execute(
+                select(LeaderboardRank.board, LeaderboardRank.scope, LeaderboardRank.value)
+                .where(LeaderboardRank.user_id == user_id)
+            )
+        }
+
+        for board, scope in sorted(current.keys() | ranked.keys()):
+            old, new = ranked.get((board, scope)), current.get((board, scope))
+            if old != new:
+                _move(board, scope, user_id, old, new)
+
+def current_values(user_id):
+    """{(board, scope): value} of every place a user should have. Deleted
+    users have none."""
+
+    values = {}
+    live = and_(User.id == user_id, User.deleted_at.is_(None))
+
+    stats = db.session.scalar(select(UserStats).join(User, User.id == UserStats.user_id).where(live))
+    if stats is not None:
+        for board in BOARDS:
+            if (getattr(stats, board) or 0) > 0:
+                values[(board, WORLD)] = getattr(stats, board)
+
+    regions = db.session.scalars(
+        select(UserRegionStats).join(User, User.id == UserRegionStats.user_id).where(live)
+    )
+    for region in regions:
+        for board in REGIONAL_BOARDS:
+            if (getattr(region, board) or 0) > 0:
+                values[(board, region.scope)] = getattr(region, board)
+
+    return values
+
+def lock_ranks():
+    """Waits for any other ranking to commit, and keeps them waiting until
+    this transaction ends."""
+
+    if db.session.get_bind(mapper=LeaderboardRank).dialect.name == 'postgresql':
+        db.session.execute(select(func.pg_advisory_xact_lock(RANK_LOCK)))
+    else:
+        # An update matching no rows still takes SQLite's write lock
+        ranks = LeaderboardRank.__table__
+        db.session.execute(ranks.update().where(literal(False)).values(rank=ranks.c.rank))
+
+def _move(board, scope, user_id, old, new):
+    """Moves a user's place from value `old` to `new` (None: not on the board)."""
+
+    ranks = LeaderboardRank.__table__
+    others = and_(ranks.c.board == board, ranks.c.scope == scope, ranks.c.user_id != user_id)
+
+    if old is None:
+        shifted, step = ranks.c.value < new, 1
+    elif new is None:
+        shifted, step = ranks.c.value < old, -1
+    elif new > old:
+        shifted, step = and_(ranks.c.value >= old, ranks.c.value < new), 1
+    else:
+        shifted, step = and_(ranks.c.value >= new, ranks.c.value < old), -1
+
+    db.session.execute(ranks.update().where(others, shifted).values(rank=ranks.c.rank + step))
+
+    this = and_(ranks.c.board == board, ranks.c.scope == scope, ranks.c.user_id == user_id)
+    if new is None:
+        db.session.execute(ranks.delete().where(this))
+        return
+
+    rank = 1 + db.session.scalar(select(func.count()).select_from(ranks).where(others, ranks.c.value > new))
+    if old is None:
+        db.session.execute(ranks.insert().values(board=board, scope=scope, user_id=user_id, value=new, rank=rank))
+    else:
+        db.session.execute(ranks.update().where(this).values(value=new, rank=rank))
+
+def rank_all():
+    """Ranks every board from scratch, with RANK() over the stats tables.
+    The caller commits."""
+
+    lock_ranks()
+    db.session.execute(LeaderboardRank.__table__.delete())
+    db.session.execute(LeaderboardChange.__table__.delete())
+
+    for board in BOARDS:
+        world_value = getattr(UserStats, board)
+        sources = [
+            select(literal(WORLD).label('scope'), UserStats.user_id, world_value.label('value'))
+            .join(User, User.id == UserStats.user_id)
+            .where(world_value > 0, User.deleted_at.is_(None))
+        ]
+
+        if board in REGIONAL_BOARDS:
+            region_value = getattr(UserRegionStats, board)
+            sources.append(
+                select(UserRegionStats.scope, UserRegionStats.user_id, region_value.label('value'))
+                .join(User, User.id == UserRegionStats.user_id)
+                .where(region_value > 0, User.deleted_at.is_(None))
+            )
+
+        values = union_all(*sources).subquery()
+        ranked = select(
+            literal(board),
+            values.c.scope,
+            values.c.user_id,
+            values.c.value,
+            func.rank().over(partition_by=values.c.scope, order_by=values.c.value.desc())
+        )
+
+        db.session.execute(
+            LeaderboardRank.__table__.insert()
+            .from_select(['board', 'scope', 'user_id', 'value', 'rank'], ranked)
+        )
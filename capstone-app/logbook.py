@@ -0,0 +1,201 @@
+"""Logbook export: a user's whole dive history as CSV, JSON or UDDF.
+
+A logbook can run to thousands of dives, so it is never loaded or
+rendered in one go. The dives are read with yield_per, which fetches
+LOGBOOK_BATCH_SIZE rows at a time (through a server-side cursor on
+Postgres), and each row is formatted as it arrives. The output is sent
+in pieces of about LOGBOOK_CHUNK_BYTES as the response is written, so
+memory stays flat however long the history. The download does hold a
+database connection until it finishes.
+
+UDDF (https://www.streit.cc/extern/uddf_v321/en/index.html) is the
+format dive log software imports. It wants depths in metres and times in
+seconds, and includes the dive computer profile where there is one.
+"""
+
+import csv
+import io
+import json
+from xml.sax.saxutils import escape
+
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+from heatmap import DIVE_TYPES
+from models import db, Dive, DiveProfile, Divesite, Divetype, User
+from profiles import DEPTH_SCALE, FEET_PER_METER, TEMPERATURE_SCALE, unpack
+
+FORMATS = {
+    'csv': 'text/csv',
+    'json': 'application/json',
+    'uddf': 'application/xml',
+}
+
+COLUMNS = ['dive_no', 'date', 'divesite', 'country', 'lat', 'lng', 'max_depth_ft',
+           'bottom_time_min', 'rating', 'buddy', 'dive_types', 'comments']
+
+def init_app(app):
+    app.config.setdefault('LOGBOOK_BATCH_SIZE', 500)
+    app.config.setdefault('LOGBOOK_CHUNK_BYTES', 64 * 1024)
+
+def logbook_response(user, fmt):
+    """A streamed download of `user`'s logbook in `fmt` (a key of FORMATS)."""
+
+    pieces = {'csv': csv_pieces, 'json': json_pieces, 'uddf': uddf_pieces}[fmt](user)
+
+    response = Response(stream_with_context(chunked(pieces)), mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{user.username}-logbook.{fmt}"'
+    return response
+
+def chunked(pieces):
+    """Joins small strings into chunks of about LOGBOOK_CHUNK_BYTES."""
+
+    limit = current_app.config['LOGBOOK_CHUNK_BYTES']
+    buffer, size = [], 0
+
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= limit:
+            yield "".join(buffer)
+            buffer, size = [], 0
+
+    if buffer:
+        yield "".join(buffer)
+
+def _rows(statement):
+    """Runs `statement`, fetching LOGBOOK_BATCH_SIZE rows at a time."""
+
+    batch_size = current_app.config['LOGBOOK_BATCH_SIZE']
+    return db.session.execute(statement.execution_options(yield_per=batch_size))
+
+def dive_rows(user_id, profiles=False):
+    """The statement selecting every dive of a user, oldest first, with its
+    divesite, buddy and dive types (and profile blobs if `profiles`)."""
+
+    buddy = aliased(User)
+    statement = (
+        select(
+            Dive.id, Dive.dive_no, Dive.date, Dive.max_depth, Dive.bottom_time, Dive.rating, Dive.comments,
+            Divesite.id.label('divesite_id'), Divesite.name.label('divesite'), Divesite.country,
+            Divesite.lat, Divesite.lng, buddy.username.label('buddy'),
+            *(getattr(Divetype, name) for name in DIVE_TYPES)
+        )
+        .join(Divesite, Divesite.id == Dive.divesite_id)
+        .outerjoin(buddy, buddy.id == Dive.buddy_id)
+        .outerjoin(Divetype, Divetype.dive_id == Dive.id)
+        .where(Dive.user_id == user_id)
+        .order_by(Dive.date, Dive.dive_no, Dive.id)
+    )
+
+    if profiles:
+        statement = statement.add_columns(
+            DiveProfile.interval, DiveProfile.depths, DiveProfile.temperatures
+        ).outerjoin(DiveProfile, DiveProfile.dive_id == Dive.id)
+
+    return statement
+
+def dive_types(row):
+    return [name for name in DIVE_TYPES if getattr(row, name)]
+
+def dive_record(row):
+    """A dive row as a dict of COLUMNS."""
+
+    return {
+        'dive_no': row.dive_no,
+        'date': row.date.isoformat(),
+        'divesite': row.divesite,
+        'country': row.country,
+        'lat': row.lat,
+        'lng': row.lng,
+        'max_depth_ft': row.max_depth,
+        'bottom_time_min': row.bottom_time,
+        'rating': row.rating,
+        'buddy': row.buddy,
+        'dive_types': dive_types(row),
+        'comments': row.comments,
+    }
+
+def csv_pieces(user):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+
+    for row in _rows(dive_rows(user.id)):
+        record = dive_record(row)
+        record['dive_types'] = ";".join(record['dive_types'])
+        writer.writerow(record[column] for column in COLUMNS)
+
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    yield buffer.getvalue()
+
+def json_pieces(user):
+    yield '{"username": %s, "dives": [' % json.dumps(user.username)
+
+    separator = "\n"
+    for row in _rows(dive_rows(user.id)):
+        yield separator + json.dumps(dive_record(row))
+        separator = ",\n"
+
+    yield "\n]}\n"
+
+def uddf_pieces(user):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<uddf version="3.2.1">\n'
+           '<generator><name>Social Scuba</name><type>logbook</type></generator>\n'
+           f'<diver><owner id="owner"><personal><firstname>{escape(user.first_name or "")}</firstname>'
+           f'<lastname>{escape(user.last_name or "")}</lastname></personal></owner></diver>\n'
+           '<divesite>\n')
+
+    sites = (
+        select(Divesite.id, Divesite.name, Divesite.location, Divesite.country, Divesite.lat, Divesite.lng)
+        .where(Divesite.id.in_(select(Dive.divesite_id).where(Dive.user_id == user.id)))
+        .order_by(Divesite.id)
+    )
+    for site in _rows(sites):
+        yield (f'<site id="site{site.id}"><name>{escape(site.name)}</name><geography>'
+               f'<location>{escape(site.location or site.country or "")}</location>'
+               + (f'<latitude>{site.lat}</latitude><longitude>{site.lng}</longitude>' if site.lat is not None else '')
+               + '</geography></site>\n')
+
+    yield '</divesite>\n<profiledata><repetitiongroup id="logbook">\n'
+
+    for row in _rows(dive_rows(user.id, profiles=True)):
+        yield uddf_dive(row)
+
+    yield '</repetitiongroup></profiledata>\n</uddf>\n'
+
+def uddf_dive(row):
+    """One <dive>, in metres and seconds."""
+
+    parts = [
+        f'<dive id="dive{row.id}"><informationbeforedive>'
+        f'<link ref="site{row.divesite_id}"/>'
+        f'<datetime>{row.date.isoformat()}T00:00:00</datetime>'
+        f'<divenumber>{row.dive_no}</divenumber>'
+        '</informationbeforedive>'
+    ]
+
+    if row.depths is not None:
+        depths = unpack(row.depths, DEPTH_SCALE)
+        temperatures = None if row.temperatures is None else unpack(row.temperatures, TEMPERATURE_SCALE) + 273.15
+        parts.append('<samples>')
+        for i, depth in enumerate(depths):
+            temperature = '' if temperatures is None else f'<temperature>{temperatures[i]:.2f}</temperature>'
+            parts.append(f'<waypoint><depth>{depth:.2f}</depth><divetime>{i * row.interval:g}</divetime>{temperature}</waypoint>')
+        parts.append('</samples>')
+
+    parts.append(
+        '<informationafterdive>'
+        f'<greatestdepth>{row.max_depth / FEET_PER_METER:.2f}</greatestdepth>'
+        f'<diveduration>{row.bottom_time * 60:g}</diveduration>'
+        f'<rating><ratingvalue>{row.rating}</ratingvalue></rating>'
+        + (f'<notes><para>{escape(row.comments)}</para></notes>' if row.comments else '')
+        + '</informationafterdive></dive>\n'
+    )
+
+    return "".join(parts)
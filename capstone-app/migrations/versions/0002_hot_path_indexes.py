@@ -0,0 +1,68 @@
+"""indexes for the feed, stats, buddy lookups and map bounds
+
+- dives (user_id, date): the home feed and profile pages filter by diver
+  and sort by date; the per-user stats (max depth, bottom time, counts)
+  use the user_id prefix.
+- dives (divesite_id, rating): average rating of a divesite without
+  touching the table.
+- dives (buddy_id): dives a user was a buddy on, and deleting users.
+- buddies (buddy_user_id, main_user_id): who a user has added as a buddy.
+  The primary key already covers lookups by main_user_id.
+- divesites (lat, lng): the map's bounding box query.
+- divesites (api_id): matching seeded divesites to the API's ids.
+
+On Postgres the indexes are built with CREATE INDEX CONCURRENTLY outside
+the migration's transaction, so the tables stay writable while they
+build. If a concurrent build is interrupted it leaves an INVALID index
+behind; drop it and run the upgrade again.
+
+Revision ID: 0002_hot_path_indexes
+Revises: 0001_baseline
+Create Date: 2026-10-19 00:41:12.118034
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_hot_path_indexes'
+down_revision = '0001_baseline'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_dives_user_id_date', 'dives', ['user_id', 'date']),
+    ('ix_dives_divesite_id_rating', 'dives', ['divesite_id', 'rating']),
+    ('ix_dives_buddy_id', 'dives', ['buddy_id']),
+    ('ix_buddies_buddy_user_id', 'buddies', ['buddy_user_id', 'main_user_id']),
+    ('ix_divesites_lat_lng', 'divesites', ['lat', 'lng']),
+    ('ix_divesites_api_id', 'divesites', ['api_id']),
+]
+
+
+def online():
+    """True when indexes can be built without locking out writes."""
+
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def upgrade():
+    if online():
+        with op.get_context().autocommit_block():
+            for name, table, columns in INDEXES:
+                op.create_index(name, table, columns, if_not_exists=True,
+                                postgresql_concurrently=True)
+    else:
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, if_not_exists=True)
+
+
+def downgrade():
+    if online():
+        with op.get_context().autocommit_block():
+            for name, table, _ in reversed(INDEXES):
+                op.drop_index(name, table_name=table, if_exists=True,
+                              postgresql_concurrently=True)
+    else:
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True)
@@ -0,0 +1,89 @@
+"""job queue and stats tables
+
+- jobs: background work queued by write routes (see jobs.py). The partial
+  unique index on key keeps one waiting job per task and arguments.
+- user_stats, divesite_stats: per user and per divesite totals, refreshed
+  by jobs (see stats.py). Filled in from the existing dives here.
+
+Revision ID: 0003_jobs_and_stats
+Revises: 0002_hot_path_indexes
+Create Date: 2026-10-19 02:10:45.503127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_jobs_and_stats'
+down_revision = '0002_hot_path_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('task', sa.Text(), nullable=False),
+    sa.Column('key', sa.Text(), nullable=False),
+    sa.Column('args', sa.Text(), nullable=False),
+    sa.Column('status', sa.Text(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('run_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_jobs_pending_key', 'jobs', ['key'], unique=True,
+                    postgresql_where=sa.text("status = 'pending'"),
+                    sqlite_where=sa.text("status = 'pending'"))
+    op.create_index('ix_jobs_status_run_at', 'jobs', ['status', 'run_at'])
+
+    op.create_table('user_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('num_dives', sa.Integer(), nullable=False),
+    sa.Column('max_depth', sa.Float(), nullable=True),
+    sa.Column('max_bottom_time', sa.Float(), nullable=True),
+    sa.Column('num_countries', sa.Integer(), nullable=False),
+    sa.Column('num_continents', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_table('divesite_stats',
+    sa.Column('divesite_id', sa.Integer(), nullable=False),
+    sa.Column('num_dives', sa.Integer(), nullable=False),
+    sa.Column('avg_rating', sa.Float(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['divesite_id'], ['divesites.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('divesite_id')
+    )
+
+    op.execute("""
+        INSERT INTO user_stats (user_id, num_dives, max_depth, max_bottom_time,
+                                num_countries, num_continents, updated_at)
+        SELECT users.id, count(dives.id), max(dives.max_depth), max(dives.bottom_time),
+               count(DISTINCT divesites.country), count(DISTINCT divesites.continent),
+               CURRENT_TIMESTAMP
+        FROM users
+        LEFT OUTER JOIN dives ON dives.user_id = users.id
+        LEFT OUTER JOIN divesites ON divesites.id = dives.divesite_id
+        GROUP BY users.id
+    """)
+    op.execute("""
+        INSERT INTO divesite_stats (divesite_id, num_dives, avg_rating, updated_at)
+        SELECT divesite_id, count(id), avg(rating), CURRENT_TIMESTAMP
+        FROM dives
+        GROUP BY divesite_id
+    """)
+
+
+def downgrade():
+    op.drop_table('divesite_stats')
+    op.drop_table('user_stats')
+    op.drop_index('ix_jobs_status_run_at', table_name='jobs')
+    op.drop_index('ix_jobs_pending_key', table_name='jobs',
+                  postgresql_where=sa.text("status = 'pending'"),
+                  sqlite_where=sa.text("status = 'pending'"))
+    op.drop_table('jobs')
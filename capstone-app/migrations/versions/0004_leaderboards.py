@@ -0,0 +1,89 @@
+"""leaderboards: per region stats and ranked places
+
+- user_region_stats: each user's totals per country and continent,
+  refreshed with user_stats (see stats.py).
+- leaderboard_ranks: every user's place on every board, re-ranked by a
+  background job (see leaderboards.py). The (board, scope, rank) index
+  serves the top of a board; the primary key serves a user's own place.
+
+Both are filled in from the existing data here.
+
+Revision ID: 0004_leaderboards
+Revises: 0003_jobs_and_stats
+Create Date: 2026-10-19 03:02:17.640882
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_leaderboards'
+down_revision = '0003_jobs_and_stats'
+branch_labels = None
+depends_on = None
+
+WORLD_BOARDS = ['num_dives', 'max_depth', 'max_bottom_time', 'num_countries']
+REGIONAL_BOARDS = ['num_dives', 'max_depth', 'max_bottom_time']
+
+
+def upgrade():
+    op.create_table('user_region_stats',
+    sa.Column('scope', sa.Text(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('num_dives', sa.Integer(), nullable=False),
+    sa.Column('max_depth', sa.Float(), nullable=True),
+    sa.Column('max_bottom_time', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('scope', 'user_id')
+    )
+    op.create_index('ix_user_region_stats_user_id', 'user_region_stats', ['user_id'])
+
+    op.create_table('leaderboard_ranks',
+    sa.Column('board', sa.Text(), nullable=False),
+    sa.Column('scope', sa.Text(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('value', sa.Float(), nullable=False),
+    sa.Column('rank', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('board', 'scope', 'user_id')
+    )
+    op.create_index('ix_leaderboard_ranks_board_scope_rank', 'leaderboard_ranks',
+                    ['board', 'scope', 'rank', 'user_id'])
+
+    for column, prefix in (('country', 'country:'), ('continent', 'continent:')):
+        op.execute(f"""
+            INSERT INTO user_region_stats (scope, user_id, num_dives, max_depth, max_bottom_time)
+            SELECT '{prefix}' || divesites.{column}, dives.user_id, count(dives.id),
+                   max(dives.max_depth), max(dives.bottom_time)
+            FROM dives
+            JOIN divesites ON divesites.id = dives.divesite_id
+            WHERE divesites.{column} IS NOT NULL
+            GROUP BY divesites.{column}, dives.user_id
+        """)
+
+    for board in WORLD_BOARDS:
+        regional = ""
+        if board in REGIONAL_BOARDS:
+            regional = f"""
+                UNION ALL
+                SELECT scope, user_id, {board} FROM user_region_stats WHERE {board} > 0
+            """
+
+        op.execute(f"""
+            INSERT INTO leaderboard_ranks (board, scope, user_id, value, rank)
+            SELECT '{board}', scope, user_id, value,
+                   rank() OVER (PARTITION BY scope ORDER BY value DESC)
+            FROM (
+                SELECT 'world' AS scope, user_id, {board} AS value
+                FROM user_stats WHERE {board} > 0
+                {regional}
+            ) AS board_values
+        """)
+
+
+def downgrade():
+    op.drop_index('ix_leaderboard_ranks_board_scope_rank', table_name='leaderboard_ranks')
+    op.drop_table('leaderboard_ranks')
+    op.drop_index('ix_user_region_stats_user_id', table_name='user_region_stats')
+    op.drop_table('user_region_stats')
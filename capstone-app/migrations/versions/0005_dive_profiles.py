@@ -0,0 +1,36 @@
+"""dive profiles: dive computer samples packed into blobs
+
+- dive_profiles: at most one per dive. Depths and temperatures are stored
+  as zlib-compressed int16 differences (see profiles.py), not one row per
+  sample.
+
+Revision ID: 0005_dive_profiles
+Revises: 0004_leaderboards
+Create Date: 2026-10-19 04:11:52.318406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_dive_profiles'
+down_revision = '0004_leaderboards'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('dive_profiles',
+    sa.Column('dive_id', sa.Integer(), nullable=False),
+    sa.Column('interval', sa.Float(), nullable=False),
+    sa.Column('num_samples', sa.Integer(), nullable=False),
+    sa.Column('depths', sa.LargeBinary(), nullable=False),
+    sa.Column('temperatures', sa.LargeBinary(), nullable=True),
+    sa.ForeignKeyConstraint(['dive_id'], ['dives.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('dive_id')
+    )
+
+
+def downgrade():
+    op.drop_table('dive_profiles')
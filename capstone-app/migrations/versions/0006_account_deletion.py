@@ -0,0 +1,27 @@
+"""account deletion: users.deleted_at
+
+Deleted accounts are marked and then purged by a background job (see
+accounts.py), which relies on the existing ON DELETE CASCADE foreign keys.
+
+Revision ID: 0006_account_deletion
+Revises: 0005_dive_profiles
+Create Date: 2026-10-19 05:26:40.914227
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_account_deletion'
+down_revision = '0005_dive_profiles'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('users', 'deleted_at')
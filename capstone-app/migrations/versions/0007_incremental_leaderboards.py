@@ -0,0 +1,58 @@
+"""incremental leaderboards: leaderboard_changes and a value index
+
+Users whose stats change are queued in leaderboard_changes, and the
+ranking job moves just their places (see leaderboards.py). The new index
+finds the places between a user's old and new value. On Postgres it is
+built with CREATE INDEX CONCURRENTLY, as in 0002, so leaderboard_ranks
+stays writable meanwhile.
+
+Revision ID: 0007_incremental_leaderboards
+Revises: 0006_account_deletion
+Create Date: 2026-10-19 09:12:03.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_incremental_leaderboards'
+down_revision = '0006_account_deletion'
+branch_labels = None
+depends_on = None
+
+
+INDEX = ('ix_leaderboard_ranks_board_scope_value', 'leaderboard_ranks', ['board', 'scope', 'value'])
+
+
+def online():
+    """True when indexes can be built without locking out writes."""
+
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def upgrade():
+    op.create_table('leaderboard_changes',
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+    name, table, columns = INDEX
+    if online():
+        with op.get_context().autocommit_block():
+            op.create_index(name, table, columns, if_not_exists=True,
+                            postgresql_concurrently=True)
+    else:
+        op.create_index(name, table, columns, if_not_exists=True)
+
+
+def downgrade():
+    name, table, _ = INDEX
+    if online():
+        with op.get_context().autocommit_block():
+            op.drop_index(name, table_name=table, if_exists=True,
+                          postgresql_concurrently=True)
+    else:
+        op.drop_index(name, table_name=table, if_exists=True)
+
+    op.drop_table('leaderboard_changes')
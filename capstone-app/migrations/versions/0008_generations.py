@@ -0,0 +1,32 @@
+"""generations: change counters for the catalogue and heatmap
+
+Routes that write divesites or dives bump a counter here, and the
+catalogue snapshot and heatmap rasters compare counters instead of
+counting the tables (see generations.py).
+
+Revision ID: 0008_generations
+Revises: 0007_incremental_leaderboards
+Create Date: 2026-10-19 14:37:52.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008_generations'
+down_revision = '0007_incremental_leaderboards'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('generations',
+    sa.Column('name', sa.Text(), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('generations')
@@ -1,23 +1,65 @@
+import os
+import weakref
+from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
-from datetime import date, time
-from sqlalchemy import func
-from flask_bcrypt import Bcrypt
+from datetime import date, datetime, time, timezone
+from sqlalchemy import and_, func
+from sqlalchemy.orm import joinedload
 
-from secret import GOOGLE_API_KEY
+from hashing import PasswordHasher
+from replicas import RoutingSession, init_app as init_replicas
+from static_maps import static_map_url
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+hasher = PasswordHasher()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+migrate = Migrate()
 
 def connect_db(app):
-    """Connect to database."""
+    """Connect to database.
+
+    Engines connect lazily, on the first query. flask db upgrade (from
+    Flask-Migrate) creates and updates the tables. Pool sizes and the
+    optional read replica are set up by replicas.init_app.
+    """
+
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', os.environ.get('DATABASE_URL', 'postgresql:///social-scuba-app'))
+    app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+    init_replicas(app)
 
     db.app = app
     db.init_app(app)
+    migrate.init_app(app, db, directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
+    _reset_pools_after_fork(app)
+
+def _reset_pools_after_fork(app):
+    """Give every forked worker its own connection pools.
+
+    A server that loads the app before forking would otherwise share any
+    connections the parent opened with all of its children. The child
+    forgets them without closing them, since they still belong to the
+    parent.
+    """
+
+    app_ref = weakref.ref(app)
+
+    def reset():
+        app = app_ref()
+        if app is None:
+            return
+
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+    os.register_at_fork(after_in_child=reset)
 
 class Buddy(db.Model):
     """Connection of a user to another user as buddies"""
 
     __tablename__ = "buddies"
+    __table_args__ = (
+        db.Index('ix_buddies_buddy_user_id', 'buddy_user_id', 'main_user_id'),
+    )
 
     main_user_id=db.Column(
         db.Integer,
@@ -35,6 +77,11 @@ class Dive(db.Model):
     """A single dive logged by a user"""
 
     __tablename__ = "dives"
+    __table_args__ = (
+        db.Index('ix_dives_user_id_date', 'user_id', 'date'),
+        db.Index('ix_dives_divesite_id_rating', 'divesite_id', 'rating'),
+        db.Index('ix_dives_buddy_id', 'buddy_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -72,6 +119,7 @@ class Dive(db.Model):
     buddy = db.relationship("User", foreign_keys=[buddy_id])
     divesite=db.relationship("Divesite", foreign_keys=[divesite_id], back_populates="dives")
     divetypes = db.relationship("Divetype", back_populates="dive", uselist=False)
+    profile = db.relationship("DiveProfile", back_populates="dive", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
 
     def get_divetypes(self):
         """Returns a list of all divetypes associated with a dive."""
@@ -123,6 +171,29 @@ class Divetype(db.Model):
 
     dive = db.relationship("Dive", foreign_keys=[dive_id], back_populates='divetypes')
 
+class DiveProfile(db.Model):
+    """Depth and temperature samples of a dive from a dive computer, packed
+    into blobs by profiles.py"""
+
+    __tablename__ = "dive_profiles"
+
+    dive_id = db.Column(
+        db.Integer,
+        db.ForeignKey('dives.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+
+    # Seconds between samples
+    interval = db.Column(db.Float, nullable=False)
+
+    num_samples = db.Column(db.Integer, nullable=False)
+
+    depths = db.Column(db.LargeBinary, nullable=False)
+
+    temperatures = db.Column(db.LargeBinary)
+
+    dive = db.relationship("Dive", back_populates="profile")
+
 class User(db.Model):
     """User in the system."""
 
@@ -144,153 +215,144 @@ class User(db.Model):
 
     bio = db.Column(db.Text)
 
+    # Set when the account is deleted; accounts.purge_user removes the rest later
+    deleted_at = db.Column(db.DateTime)
+
+    # Deleted users drop out of buddy lists while they wait to be purged
     buddies_to = db.relationship(
         "User",
         secondary="buddies",
         primaryjoin=(Buddy.main_user_id == id),
-        secondaryjoin=(Buddy.buddy_user_id == id)
+        secondaryjoin=db.and_(Buddy.buddy_user_id == id, deleted_at.is_(None))
     )
 
     buddies = db.relationship(
         "User",
         secondary="buddies",
         primaryjoin=(Buddy.buddy_user_id == id),
-        secondaryjoin=(Buddy.main_user_id == id)
+        secondaryjoin=db.and_(Buddy.main_user_id == id, deleted_at.is_(None))
     )
-    dives = db.relationship("Dive", foreign_keys=[Dive.user_id], back_populates="diver")
+    # Deleting a user or divesite leaves their dives to ON DELETE CASCADE
+    dives = db.relationship("Dive", foreign_keys=[Dive.user_id], back_populates="diver", passive_deletes='all')
+    stats = db.relationship("UserStats", uselist=False, viewonly=True)
 
     def __repr__(self) -> str:
         return f"User {self.username}, aka {self.first_name} {self.last_name}"
 
+    _leaderboard_circle = None
+
+    # The figures below come from user_stats, which a background job keeps
+    # up to date (see stats.py), so they can trail a new dive briefly.
+
     def get_unique_continent_count(self):
         """Returns the number of continents user has dove in"""
-        continent_count =  (
-            db.session.query(func.count(func.distinct(Divesite.continent)))
-            .join(Dive)
-            .filter(Dive.user_id == self.id, Divesite.continent != None)
-            .scalar()
-        )
-        
-        if continent_count:
-            return str(continent_count)
-        
-        return "0"
+
+        return str(self.stats.num_continents if self.stats else 0)
 
     def get_unique_country_count(self):
         """Returns the number of countries user has dove in"""
-        country_count =  (
-            db.session.query(func.count(func.distinct(Divesite.country)))
-            .join(Dive)
-            .filter(Dive.user_id == self.id, Divesite.country != None)
-            .scalar()
-        )
 
-        if country_count:
-            return str(country_count)
-        
-        return str(max(int(self.get_unique_continent_count()), 0))
+        if self.stats and self.stats.num_countries:
+            return str(self.stats.num_countries)
+
+        return self.get_unique_continent_count()
     
     def get_max_depth(self):
         """Gets the max depth the user has dove from all their dives"""
-        max_depth =  (
-            db.session.query(func.max(Dive.max_depth))
-            .filter(Dive.user_id == self.id)
-            .scalar()
-        ) 
 
-        if max_depth:
-            return "{:.2f}".format(max_depth)
+        if self.stats and self.stats.max_depth:
+            return "{:.2f}".format(self.stats.max_depth)
         
         return "0"
     
     def get_max_bottom_time(self):
         """Gets the max bottom_time the user has dove from all their dives"""
-        max_bottom_time = (
-            db.session.query(func.max(Dive.bottom_time))
-            .filter(Dive.user_id == self.id)
-            .scalar()
-        )
 
-        if max_bottom_time:
-            return "{:.1f}".format(max_bottom_time)
+        if self.stats and self.stats.max_bottom_time:
+            return "{:.1f}".format(self.stats.max_bottom_time)
         
         return "0"
+
+    def leaderboard_circle(self):
+        """This user and their buddies, with their stats, in one query.
+
+        Kept on the instance, since the three leaderboards each need them.
+        """
+
+        if self._leaderboard_circle is None:
+            from buddy_graph import buddy_ids
+
+            self._leaderboard_circle = (
+                User.query
+                .options(joinedload(User.stats))
+                .filter(User.id.in_({self.id} | buddy_ids(self.id)), User.deleted_at.is_(None))
+                # This user first, so they come first among ties
+                .order_by(User.id != self.id, User.id)
+                .all()
+            )
+
+        return self._leaderboard_circle
+
+    def _leaderboard(self, score, units):
+        unsorted = [[score(user), user, units] for user in self.leaderboard_circle()]
+        return sorted(unsorted, key=lambda x: float(x[0]), reverse=True)[:5]
     
     def leaderboard_max_bottom_time(self):
         """Returns data about this user and buddies, in order of who dived longest"""
-        
-        unsorted = []
-        unsorted.append([self.get_max_bottom_time(), self, "min"])
 
-        for user in self.buddies:
-            unsorted.append([user.get_max_bottom_time(), user, "min"])
-        
-        sorted_data = sorted(unsorted, key=lambda x: float(x[0]), reverse=True)
-
-        if len(sorted_data) > 5:
-            sorted_data = sorted_data[0:5]
-
-        return sorted_data
+        return self._leaderboard(User.get_max_bottom_time, "min")
     
     def leaderboard_max_depth(self):
         """Returns data about this user and buddies, in order of who dived lowest"""
-        
-        unsorted = []
-        unsorted.append([self.get_max_depth(), self, "ft"])
-
-        for user in self.buddies:
-            unsorted.append([user.get_max_depth(), user, "ft"])
-        
-        sorted_data = sorted(unsorted, key=lambda x: float(x[0]), reverse=True)
 
-        if len(sorted_data) > 5:
-            sorted_data = sorted_data[0:5]
-
-        return sorted_data
+        return self._leaderboard(User.get_max_depth, "ft")
 
     def leaderboard_num_dives(self):
-        """Returns a list of usernames and number of dives that user and buddies have
-        
-        Assuming users have less than 20 buddies, we can leave it as is. Otherwise I would've used a heap
-        """
-        
-        unsorted = []
-        unsorted.append([self.get_num_dives(), self, "dives"])
+        """Returns a list of usernames and number of dives that user and buddies have"""
 
-        for user in self.buddies:
-            unsorted.append([user.get_num_dives(), user, "dives"])
-        
-        sorted_data = sorted(unsorted, key=lambda x: float(x[0]), reverse=True)
-
-        if len(sorted_data) > 5:
-            sorted_data = sorted_data[0:5]
-
-        return sorted_data
+        return self._leaderboard(User.get_num_dives, "dives")
 
     def get_num_dives(self):
         """Get the amount of dives the user has completed"""
-        num_dives = (
-            db.session.query(func.count(Dive.dive_no))
-            .filter(Dive.user_id==self.id)
-            .scalar()
-        )
 
-        if num_dives:
-            return str(num_dives)
-        
-        return "0"
+        return str(self.stats.num_dives if self.stats else 0)
 
     def is_buddies(self, other_user):
         """Is this user buddies with `other_user`?"""
 
-        found_user_list = [user for user in self.buddies if user == other_user]
-        return len(found_user_list) == 1
+        from buddy_graph import buddy_ids
+        return other_user.id in buddy_ids(self.id)
     
     def is_buddies_to(self, other_user):
         """Has other_user added this user as a buddy?"""
 
-        found_user_list = [user for user in self.buddies_to if user == other_user]
-        return len(found_user_list) == 1
+        from buddy_graph import buddy_ids
+        return self.id in buddy_ids(other_user.id)
+
+    def count_buddies(self):
+        """How many users this user has added as buddies"""
+
+        return db.session.query(func.count()).filter(Buddy.buddy_user_id == self.id).scalar()
+
+    def count_buddies_to(self):
+        """How many users have added this user as a buddy"""
+
+        return db.session.query(func.count()).filter(Buddy.main_user_id == self.id).scalar()
+
+    def check_password(self, password):
+        """Does `password` match this user's password?
+
+        If the stored hash was made with a different cost factor than the
+        current one, it is quietly replaced with a fresh hash (caller commits).
+        """
+
+        if not hasher.check(self.password, password):
+            return False
+
+        if hasher.needs_rehash(self.password):
+            self.password = hasher.hash(password)
+
+        return True
 
     @classmethod
     def signup(cls, username, password, first_name, last_name):
@@ -302,7 +364,7 @@ class User(db.Model):
         if username == "":
             username=None
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -326,14 +388,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+        Unknown usernames still pay for one hash check, so they take as long
+        to reject as a wrong password.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.query.filter_by(username=username, deleted_at=None).first()
 
-        if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
-            if is_auth:
-                return user
+        if not user:
+            hasher.check(None, password)
+            return False
+
+        if user.check_password(password):
+            return user
 
         return False
 
@@ -341,6 +407,10 @@ class Divesite(db.Model):
     """An individual dive site"""
 
     __tablename__ = 'divesites'
+    __table_args__ = (
+        db.Index('ix_divesites_lat_lng', 'lat', 'lng'),
+        db.Index('ix_divesites_api_id', 'api_id'),
+    )
 
     id=db.Column(db.Integer, primary_key=True)
 
@@ -362,10 +432,17 @@ class Divesite(db.Model):
 
     continent = db.Column(db.Text)
 
-    dives = db.relationship("Dive", back_populates="divesite")
+    dives = db.relationship("Dive", back_populates="divesite", passive_deletes='all')
+    stats = db.relationship("DivesiteStats", uselist=False, viewonly=True)
 
     def __repr__(self) -> str:
         return f"Divesite {self.name}, in {self.region}"
+
+    @classmethod
+    def within(cls, ne_lat, ne_lng, sw_lat, sw_lng):
+        """SQL condition matching divesites inside these map bounds."""
+
+        return and_(cls.lat.between(sw_lat, ne_lat), cls.lng.between(sw_lng, ne_lng))
     
     def average_rating(self):
         """Gets the average rating of a divesite based on all recorded dives"""
@@ -381,9 +458,151 @@ class Divesite(db.Model):
         return "No Ratings"
     
     def static_map(self, zoom_level=11):
-        """Generates a static map for use in showing divesites"""
-        map_size = '600x400'
+        """Returns the URL of a static map for use in showing divesites"""
+
+        return static_map_url(self.id, zoom_level)
+
+def utcnow():
+    """The current UTC time, naive, as stored in DateTime columns."""
+
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class UserStats(db.Model):
+    """Totals over a user's dives, kept up to date by background jobs (see stats.py)"""
+
+    __tablename__ = 'user_stats'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+
+    num_dives = db.Column(db.Integer, nullable=False, default=0)
+
+    max_depth = db.Column(db.Float)
+
+    max_bottom_time = db.Column(db.Float)
+
+    num_countries = db.Column(db.Integer, nullable=False, default=0)
+
+    num_continents = db.Column(db.Integer, nullable=False, default=0)
+
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+class UserRegionStats(db.Model):
+    """A user's totals over their dives in one country or continent"""
+
+    __tablename__ = 'user_region_stats'
+
+    # 'country:<name>' or 'continent:<name>'
+    scope = db.Column(db.Text, primary_key=True)
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+        index=True
+    )
+
+    num_dives = db.Column(db.Integer, nullable=False, default=0)
+
+    max_depth = db.Column(db.Float)
+
+    max_bottom_time = db.Column(db.Float)
+
+class LeaderboardRank(db.Model):
+    """A user's place on one leaderboard, ranked by background jobs (see leaderboards.py)"""
+
+    __tablename__ = 'leaderboard_ranks'
+    __table_args__ = (
+        db.Index('ix_leaderboard_ranks_board_scope_rank', 'board', 'scope', 'rank', 'user_id'),
+        # Finds the places between a user's old and new value when they move
+        db.Index('ix_leaderboard_ranks_board_scope_value', 'board', 'scope', 'value'),
+    )
+
+    board = db.Column(db.Text, primary_key=True)
+
+    # 'world', 'country:<name>' or 'continent:<name>'
+    scope = db.Column(db.Text, primary_key=True)
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+
+    value = db.Column(db.Float, nullable=False)
+
+    rank = db.Column(db.Integer, nullable=False)
+
+    user = db.relationship("User")
+
+class LeaderboardChange(db.Model):
+    """A user whose places are waiting to be re-ranked (see leaderboards.py)"""
+
+    __tablename__ = 'leaderboard_changes'
+
+    # No foreign key: a deleted user still has places to give up
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+class Generation(db.Model):
+    """A counter bumped whenever a kind of data changes (see generations.py)"""
+
+    __tablename__ = 'generations'
+
+    name = db.Column(db.Text, primary_key=True)
+
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class DivesiteStats(db.Model):
+    """Totals over the dives at a divesite, kept up to date by background jobs"""
+
+    __tablename__ = 'divesite_stats'
+
+    divesite_id = db.Column(
+        db.Integer,
+        db.ForeignKey('divesites.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+
+    num_dives = db.Column(db.Integer, nullable=False, default=0)
+
+    avg_rating = db.Column(db.Float)
+
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+class Job(db.Model):
+    """A piece of background work, waiting for or being run by `flask jobs work` (see jobs.py)"""
+
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # At most one waiting job per task and arguments
+        db.Index('ix_jobs_pending_key', 'key', unique=True,
+                 postgresql_where=db.text("status = 'pending'"),
+                 sqlite_where=db.text("status = 'pending'")),
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
 
-        static_map_url = f'https://maps.googleapis.com/maps/api/staticmap?center={self.lat},{self.lng}&zoom={zoom_level}&size={map_size}&markers={self.lat},{self.lng}&key={GOOGLE_API_KEY}'
+    task = db.Column(db.Text, nullable=False)
 
-        return static_map_url
\ No newline at end of file
+    key = db.Column(db.Text, nullable=False)
+
+    args = db.Column(db.Text, nullable=False, default='[]')
+
+    status = db.Column(db.Text, nullable=False, default='pending')
+
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+
+    run_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    locked_at = db.Column(db.DateTime)
+
+    last_error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    def __repr__(self) -> str:
+        return f"Job {self.id} {self.key}, {self.status}"
@@ -0,0 +1,303 @@
+"""On-demand sampling profiler for single requests.
+
+A request is profiled when it carries an X-Profile header equal to
+PROFILER_TOKEN, or at random for a PROFILER_SAMPLE_RATE fraction of
+requests (0 by default). Both are off unless configured. While a profiled
+request is handled, a background thread takes the request thread's Python
+stack every PROFILER_INTERVAL_MS milliseconds. Python only switches
+threads every few milliseconds (sys.getswitchinterval()), so intervals
+much shorter than that don't give more detail.
+
+Samples taken while a SQL statement is running get the statement as an
+extra "SQL: ..." frame on top of the stack. That shows which line of
+Python, or of a template, ran the query. Each statement's exact start and
+end are recorded too.
+
+Each profile is written to PROFILER_DIR as two files, named after the time
+and endpoint. The id is sent back in an X-Profile-Id header.
+
+- <id>.collapsed: one "frame;frame;frame count" line per distinct stack,
+  for flamegraph.pl, inferno or speedscope.
+- <id>.speedscope.json: for https://www.speedscope.app. It holds the
+  sampled Python stacks and, as a second profile, a timeline of the SQL
+  statements with their timings.
+
+Only the newest PROFILER_KEEP profiles are kept. Other requests pay for
+one config lookup, plus one g lookup per SQL statement.
+"""
+
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from uuid import uuid4
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+HEADER = 'X-Profile'
+# Stops runaway profiles, like a long download, at about a minute of samples
+MAX_SAMPLES = 10_000
+
+def init_app(app):
+    """Profile requests that ask for it, or a sample of them."""
+
+    app.config.setdefault('PROFILER_TOKEN', None)
+    app.config.setdefault('PROFILER_SAMPLE_RATE', 0.0)
+    app.config.setdefault('PROFILER_INTERVAL_MS', 5)
+    app.config.setdefault('PROFILER_DIR', os.path.join(app.instance_path, 'profiles'))
+    app.config.setdefault('PROFILER_KEEP', 200)
+
+    _listen_to_engines()
+    app.before_request(_start_request)
+    app.after_request(_add_profile_id)
+    app.teardown_request(_finish_request)
+
+class Profile:
+    """The samples and SQL statements of one request."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.end = None
+        # [(stack of (name, file, line), root first, seconds)]
+        self.samples = []
+        # [(statement, started, finished)], in seconds from the start
+        self.queries = []
+        self.statement = None
+        self._statement_start = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start_sampling(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.end = time.perf_counter()
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stopped.wait(self.interval) and len(self.samples) < MAX_SAMPLES:
+            now = time.perf_counter()
+            self.sample(now - last)
+            last = now
+
+    def sample(self, weight):
+        """Records the request thread's current stack as `weight` seconds."""
+
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        if not stack:
+            return
+
+        stack.reverse()
+        # Read once: the request thread may finish the statement meanwhile
+        statement = self.statement
+        if statement is not None:
+            stack.append((f"SQL: {statement}", None, None))
+
+        self.samples.append((tuple(stack), weight))
+
+    def statement_started(self, statement):
+        self.statement = sql_label(statement)
+        self._statement_start = time.perf_counter() - self.start
+
+    def statement_finished(self):
+        if self.statement is not None:
+            self.queries.append((self.statement, self._statement_start, time.perf_counter() - self.start))
+        self.statement = None
+
+    def collapsed(self):
+        """The samples in collapsed stack format, one line per distinct stack."""
+
+        counts = Counter(stack for stack, _ in self.samples)
+        return "".join(
+            ";".join(frame_label(frame) for frame in stack) + f" {count}\n"
+            for stack, count in sorted(counts.items())
+        )
+
+    def speedscope(self, name):
+        """The samples and statements in speedscope's file format, in
+        milliseconds."""
+
+        frames, index = [], {}
+
+        def frame_index(frame):
+            if frame not in index:
+                index[frame] = len(frames)
+                label, filename, line = frame
+                frames.append({'name': label} if filename is None else
+                              {'name': label, 'file': filename, 'line': line})
+            return index[frame]
+
+        duration = ((self.end or time.perf_counter()) - self.start) * 1000
+        samples = [[frame_index(frame) for frame in stack] for stack, _ in self.samples]
+        events = []
+        for statement, started, finished in self.queries:
+            frame = frame_index((f"SQL: {statement}", None, None))
+            events.append({'type': 'O', 'frame': frame, 'at': started * 1000})
+            events.append({'type': 'C', 'frame': frame, 'at': finished * 1000})
+
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'social-scuba profiler',
+            'activeProfileIndex': 0,
+            'shared': {'frames': frames},
+            'profiles': [
+                {
+                    'type': 'sampled',
+                    'name': f"{name} (Python)",
+                    'unit': 'milliseconds',
+                    'startValue': 0,
+                    'endValue': duration,
+                    'samples': samples,
+                    'weights': [weight * 1000 for _, weight in self.samples],
+                },
+                {
+                    'type': 'evented',
+                    'name': f"{name} (SQL, {len(self.queries)} statements)",
+                    'unit': 'milliseconds',
+                    'startValue': 0,
+                    'endValue': duration,
+                    'events': events,
+                },
+            ],
+        }
+
+def sql_label(statement):
+    """A statement on one line, short enough for a frame name. Semicolons
+    would split the frame in collapsed stacks."""
+
+    return " ".join(statement.split())[:200].replace(";", ",")
+
+def frame_label(frame):
+    name, filename, line = frame
+    if filename is None:
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+def current_profile():
+    """The Profile of the current request, or None."""
+
+    if not has_request_context():
+        return None
+    return g.get('profile')
+
+def wants_profile():
+    """Whether this request should be profiled."""
+
+    config = current_app.config
+    token = config['PROFILER_TOKEN']
+    header = request.headers.get(HEADER)
+
+    if token and header is not None and hmac.compare_digest(header.encode(), token.encode()):
+        return True
+
+    rate = config['PROFILER_SAMPLE_RATE']
+    return rate > 0 and random.random() < rate
+
+_listening = False
+
+def _listen_to_engines():
+    global _listening
+    if _listening:
+        return
+
+    event.listen(Engine, 'before_cursor_execute', _query_started)
+    event.listen(Engine, 'after_cursor_execute', _query_finished)
+    event.listen(Engine, 'handle_error', _query_failed)
+    _listening = True
+
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile()
+    if profile is not None:
+        profile.statement_started(statement)
+
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile()
+    if profile is not None:
+        profile.statement_finished()
+
+def _query_failed(context):
+    _query_finished(None, None, None, None, None, None)
+
+def _start_request():
+    if not wants_profile():
+        return
+
+    profile = Profile(threading.get_ident(), current_app.config['PROFILER_INTERVAL_MS'] / 1000)
+    g.profile = profile
+    g.profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{request.endpoint or 'unmatched'}-{uuid4().hex[:8]}"
+    profile.start_sampling()
+
+def _add_profile_id(response):
+    profile_id = g.get('profile_id')
+    if profile_id is not None:
+        response.headers['X-Profile-Id'] = profile_id
+    return response
+
+def _finish_request(exc):
+    """Stops sampling and writes the profile. Runs at teardown, so after
+    the after_request hooks and, for streamed responses, once the stream
+    is done."""
+
+    profile = g.pop('profile', None)
+    if profile is None:
+        return
+
+    profile.stop()
+    profile_id = g.pop('profile_id')
+    # The path only: query strings can carry tokens or personal data
+    name = f"{request.method} {request.path} ({request.endpoint or 'unmatched'})"
+
+    try:
+        save(profile, profile_id, name)
+    except OSError:
+        current_app.logger.exception("Couldn't save profile %s", profile_id)
+        return
+
+    current_app.logger.info(
+        "Profiled %s: %d samples, %d queries in %.1fms, saved as %s",
+        name, len(profile.samples), len(profile.queries),
+        sum(finished - started for _, started, finished in profile.queries) * 1000, profile_id
+    )
+
+def save(profile, profile_id, name):
+    """Writes both files of a profile and drops the oldest beyond PROFILER_KEEP."""
+
+    directory = current_app.config['PROFILER_DIR']
+    os.makedirs(directory, exist_ok=True)
+
+    with open(os.path.join(directory, f"{profile_id}.collapsed"), 'w') as file:
+        file.write(profile.collapsed())
+    with open(os.path.join(directory, f"{profile_id}.speedscope.json"), 'w') as file:
+        json.dump(profile.speedscope(name), file)
+
+    _prune(directory, current_app.config['PROFILER_KEEP'])
+
+def _prune(directory, keep):
+    collapsed = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith('.collapsed')),
+        key=lambda entry: entry.stat().st_mtime
+    )
+    for entry in collapsed[:max(len(collapsed) - keep, 0)]:
+        profile_id = entry.name[:-len('.collapsed')]
+        for suffix in ('.collapsed', '.speedscope.json'):
+            try:
+                os.remove(os.path.join(directory, profile_id + suffix))
+            except FileNotFoundError:
+                pass
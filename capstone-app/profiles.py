@@ -0,0 +1,156 @@
+"""Dive computer profiles: the depth (and temperature) samples of a dive.
+
+A profile is uploaded as CSV, one sample per line: seconds into the dive,
+depth in metres and, optionally, water temperature in degrees Celsius. The
+samples are resampled to a regular interval and stored in dive_profiles as
+two blobs, not one row per sample: depths in centimetres and temperatures
+in tenths of a degree, each as int16 differences from the previous sample,
+zlib-compressed. Consecutive samples differ little, so an hour at one
+sample a second takes a few kilobytes.
+
+The dive's max depth and bottom time are worked out from the profile, and
+dives/show.html charts it from a downsampled copy that keeps each stretch's
+shallowest and deepest points, so spikes survive.
+"""
+
+import io
+import zlib
+
+import numpy as np
+
+from models import DiveProfile
+
+DEPTH_SCALE = 100
+TEMPERATURE_SCALE = 10
+MAX_DEPTH = 350
+MAX_SAMPLES = 24 * 60 * 60
+# Shallower than this counts as being at the surface, for the bottom time
+SURFACE_DEPTH = 1.0
+FEET_PER_METER = 3.28084
+
+def pack(values, scale):
+    """Packs floats as zlib-compressed int16 differences of `values * scale`."""
+
+    scaled = np.round(np.asarray(values, dtype=np.float64) * scale).astype(np.int64)
+    deltas = np.diff(scaled, prepend=0)
+
+    if deltas.size and np.abs(deltas).max() > np.iinfo(np.int16).max:
+        raise ValueError("Samples change too quickly between readings")
+
+    return zlib.compress(deltas.astype('<i2').tobytes())
+
+def unpack(blob, scale):
+    """The float32 values packed by pack()."""
+
+    deltas = np.frombuffer(zlib.decompress(blob), dtype='<i2')
+    return (np.cumsum(deltas, dtype=np.int64) / scale).astype(np.float32)
+
+def read_samples(text):
+    """Parses an uploaded CSV into (seconds, depths, temperatures or None).
+
+    A header line is skipped. Raises ValueError, with a message for the
+    user, if the file isn't a usable profile.
+    """
+
+    lines = [line for line in text.splitlines() if line.strip() and not line.startswith('#')]
+    if lines and not _is_number(lines[0].split(',')[0]):
+        lines = lines[1:]
+
+    if len(lines) < 2:
+        raise ValueError("A profile needs at least two samples of time and depth")
+
+    try:
+        samples = np.loadtxt(io.StringIO("\n".join(lines)), delimiter=',', ndmin=2)
+    except ValueError:
+        raise ValueError("Profiles must be CSV with seconds, depth (m) and optionally temperature (C)")
+
+    if samples.shape[0] < 2 or samples.shape[1] < 2:
+        raise ValueError("A profile needs at least two samples of time and depth")
+    if samples.shape[0] > MAX_SAMPLES:
+        raise ValueError(f"Profiles can have at most {MAX_SAMPLES} samples")
+
+    seconds, depths = samples[:, 0], samples[:, 1]
+    if np.any(np.diff(seconds) <= 0):
+        raise ValueError("Sample times must increase")
+    if _resampling(seconds)[1] > MAX_SAMPLES:
+        raise ValueError(f"Profiles can have at most {MAX_SAMPLES} samples at their usual interval")
+    if np.any(depths < 0) or np.any(depths > MAX_DEPTH):
+        raise ValueError(f"Depths must be between 0 and {MAX_DEPTH} metres")
+
+    temperatures = samples[:, 2] if samples.shape[1] > 2 else None
+    return seconds, depths, temperatures
+
+def make_profile(seconds, depths, temperatures=None):
+    """A DiveProfile of these samples, resampled to their usual interval."""
+
+    interval, count = _resampling(seconds)
+    grid = seconds[0] + np.arange(count) * interval
+
+    return DiveProfile(
+        interval=interval,
+        num_samples=count,
+        depths=pack(np.interp(grid, seconds, depths), DEPTH_SCALE),
+        temperatures=None if temperatures is None else pack(np.interp(grid, seconds, temperatures), TEMPERATURE_SCALE)
+    )
+
+def summary(profile):
+    """(max depth in feet, bottom time in minutes) of a profile.
+
+    The bottom time runs from the first sample below the surface to the last.
+    """
+
+    depths = unpack(profile.depths, DEPTH_SCALE)
+    under = np.flatnonzero(depths >= SURFACE_DEPTH)
+    bottom_time = 0.0 if under.size == 0 else (under[-1] - under[0] + 1) * profile.interval / 60
+
+    return float(depths.max()) * FEET_PER_METER, float(bottom_time)
+
+def downsample(values, buckets):
+    """Indexes of about 2 * `buckets` samples keeping the shape of `values`:
+    the lowest and highest sample of each of `buckets` equal stretches,
+    plus the first and last."""
+
+    count = len(values)
+    if count <= 2 * buckets:
+        return np.arange(count)
+
+    size = -(-count // buckets)
+    stretches = np.pad(values, (0, size * buckets - count), mode='edge').reshape(buckets, size)
+    starts = np.arange(buckets) * size
+
+    indexes = np.concatenate((starts + stretches.argmin(axis=1), starts + stretches.argmax(axis=1), [0, count - 1]))
+    return np.unique(np.minimum(indexes, count - 1))
+
+def chart(profile, width=600, height=200, buckets=150):
+    """What dives/show.html needs to draw a profile as an SVG polyline, depth downwards."""
+
+    depths = unpack(profile.depths, DEPTH_SCALE)
+    indexes = downsample(depths, buckets)
+    deepest = max(float(depths.max()), SURFACE_DEPTH)
+    duration = max((profile.num_samples - 1) * profile.interval, profile.interval)
+
+    xs = indexes * profile.interval / duration * width
+    ys = depths[indexes] / deepest * height
+    temperatures = None if profile.temperatures is None else unpack(profile.temperatures, TEMPERATURE_SCALE)
+
+    return {
+        'width': width,
+        'height': height,
+        'points': " ".join(f"{x:.1f},{y:.1f}" for x, y in zip(xs, ys)),
+        'max_depth': deepest,
+        'minutes': duration / 60,
+        'temperature': None if temperatures is None else (float(temperatures.min()), float(temperatures.max())),
+    }
+
+def _resampling(seconds):
+    """(interval, number of samples) of `seconds` resampled to their usual interval."""
+
+    interval = float(np.median(np.diff(seconds)))
+    return interval, int((seconds[-1] - seconds[0]) // interval) + 1
+
+def _is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,107 @@
+"""Connection pool settings and read replica routing.
+
+Setting DATABASE_REPLICA_URL adds a 'replica' bind. Views marked
+@read_only run their SELECTs against it; everything else, and any write
+a read-only view makes, goes to the primary (DATABASE_URL).
+
+Replicas lag behind the primary. After a visitor writes anything, their
+requests read from the primary for REPLICA_STICKY_SECONDS, so they see
+their own changes straight away. Other visitors may see them a little
+later, and fragments cached in that window can be stale until their
+FRAGMENT_CACHE_TIMEOUT.
+
+Pool sizes apply to each engine in each worker process, so the database
+needs (DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW) x workers connections.
+"""
+
+import os
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+REPLICA = 'replica'
+STICKY_SESSION_KEY = 'read_primary_until'
+
+def read_only(view):
+    """Mark a view as safe to answer from the replica."""
+
+    view.read_only = True
+    return view
+
+class RoutingSession(Session):
+    """A session that sends a read-only request's SELECTs to the replica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if getattr(clause, 'is_dml', False):
+            _written()
+
+        elif (bind is None and not self._flushing and getattr(clause, 'is_select', False)
+                and _reading_from_replica()):
+            replica = self._db.engines.get(REPLICA)
+            if replica is not None:
+                return replica
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _flushed(session, flush_context):
+    _written()
+
+def pool_options(config, url):
+    """Engine options for `url`. SQLite keeps SQLAlchemy's own pooling."""
+
+    if url.startswith('sqlite'):
+        return {}
+
+    return {
+        'pool_size': config['DATABASE_POOL_SIZE'],
+        'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+        'pool_timeout': config['DATABASE_POOL_TIMEOUT'],
+        'pool_recycle': config['DATABASE_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+def init_app(app):
+    """Set up pools and the replica bind. Call before db.init_app(app)."""
+
+    app.config.setdefault('DATABASE_POOL_SIZE', int(os.environ.get('DATABASE_POOL_SIZE', 5)))
+    app.config.setdefault('DATABASE_MAX_OVERFLOW', int(os.environ.get('DATABASE_MAX_OVERFLOW', 10)))
+    app.config.setdefault('DATABASE_POOL_TIMEOUT', int(os.environ.get('DATABASE_POOL_TIMEOUT', 30)))
+    app.config.setdefault('DATABASE_POOL_RECYCLE', int(os.environ.get('DATABASE_POOL_RECYCLE', 1800)))
+    app.config.setdefault('DATABASE_REPLICA_URL', os.environ.get('DATABASE_REPLICA_URL'))
+    app.config.setdefault('REPLICA_STICKY_SECONDS', int(os.environ.get('REPLICA_STICKY_SECONDS', 10)))
+
+    app.config.setdefault(
+        'SQLALCHEMY_ENGINE_OPTIONS',
+        pool_options(app.config, app.config['SQLALCHEMY_DATABASE_URI'])
+    )
+
+    replica_url = app.config['DATABASE_REPLICA_URL']
+    if replica_url:
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        binds.setdefault(REPLICA, dict(pool_options(app.config, replica_url), url=replica_url))
+
+    app.before_request(_choose_database)
+    app.after_request(_stick_to_primary)
+
+def _reading_from_replica():
+    return has_request_context() and g.get('read_replica', False)
+
+def _written():
+    if has_request_context():
+        g.read_replica = False
+        g.database_written = True
+
+def _choose_database():
+    view = current_app.view_functions.get(request.endpoint)
+    g.read_replica = (
+        getattr(view, 'read_only', False)
+        and session.get(STICKY_SESSION_KEY, 0) < time.time()
+    )
+
+def _stick_to_primary(response):
+    if g.get('database_written'):
+        session[STICKY_SESSION_KEY] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+    return response
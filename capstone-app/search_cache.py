@@ -0,0 +1,100 @@
+"""Caching of /search results.
+
+The same searches come up again and again (a blank search, "reef",
+"maldives"), and each page of results used to run the ILIKE scan plus a
+COUNT. The cache keeps, per category and normalised query, the total
+count and the ids on each page. A repeat search or a page flip then only
+loads the listed rows by primary key.
+
+Entries are keyed by a generation counter per category. Routes that change
+what a search can find (adding or deleting a divesite, signing up,
+renaming, deleting an account) call search_cache.bump(category), which
+orphans every cached result of that category at once. The listed rows'
+own details, like their stats, are loaded fresh every time.
+
+Like the fragment cache, the default backend lives in each worker, so
+with several workers use SEARCH_CACHE_BACKEND=redis://... for bumps to
+reach them all. Otherwise a worker can show stale results for up to
+SEARCH_CACHE_TIMEOUT seconds.
+"""
+
+from flask_sqlalchemy.pagination import QueryPagination
+
+from cache import make_backend
+
+USERS = 'users'
+DIVESITES = 'divesites'
+
+class SearchCache:
+    """Holds the search result backend and the per-category generations."""
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.timeout = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_CACHE_BACKEND', None)
+        app.config.setdefault('SEARCH_CACHE_SIZE', 4096)
+        app.config.setdefault('SEARCH_CACHE_TIMEOUT', 60 * 5)
+
+        self.backend = make_backend(app.config['SEARCH_CACHE_BACKEND'], app.config['SEARCH_CACHE_SIZE'])
+        self.timeout = app.config['SEARCH_CACHE_TIMEOUT']
+        app.extensions['search_cache'] = self
+
+    def bump(self, *categories):
+        """Invalidates every cached result of these categories."""
+
+        for category in categories:
+            self.backend.incr(f"generation:{category}")
+
+    def key(self, category, query):
+        return f"search:{category}:{self.backend.get_counter(f'generation:{category}')}:{query}"
+
+    def paginate(self, category, query, statement, model, page, per_page):
+        """Paginates `statement` (a Model.query) like Query.paginate, through
+        the cache. `query` is the normalised search text."""
+
+        return CachedPagination(
+            page=page, per_page=per_page, error_out=False,
+            query=statement, model=model, key=self.key(category, query), cache=self
+        )
+
+search_cache = SearchCache()
+
+def normalise(query):
+    """Search text as it's matched and cached: trimmed, lower case and with
+    single spaces. ILIKE ignores case anyway."""
+
+    return " ".join((query or "").split()).lower()
+
+class CachedPagination(QueryPagination):
+    """A QueryPagination that takes the page's ids and the total count from
+    the search cache when it has them."""
+
+    def _query_items(self):
+        cache, key, model = self._query_args['cache'], self._query_args['key'], self._query_args['model']
+        ids = cache.backend.get(f"{key}:page:{self.page}:{self.per_page}")
+
+        if ids is None:
+            items = super()._query_items()
+            cache.backend.set(f"{key}:page:{self.page}:{self.per_page}", [item.id for item in items], cache.timeout)
+            return items
+
+        if not ids:
+            return []
+
+        rows = {item.id: item for item in self._query_args['query'].order_by(None).filter(model.id.in_(ids))}
+        return [rows[item_id] for item_id in ids if item_id in rows]
+
+    def _query_count(self):
+        cache, key = self._query_args['cache'], self._query_args['key']
+        total = cache.backend.get(f"{key}:count")
+
+        if total is None:
+            total = super()._query_count()
+            cache.backend.set(f"{key}:count", total, cache.timeout)
+
+        return total
@@ -1,9 +1,11 @@
 import os
 import json
-import pycountry
+from flask import Flask
+from flask_migrate import upgrade
 from sqlalchemy import insert
-from app import db, app
-from models import Divesite
+from countries import lowercase_country_names
+import generations
+from models import db, connect_db, Divesite
 
 def read_json_file(file_path):
     """Opens a JSON file of form {data: [{...}, ...]}"""
@@ -12,36 +14,19 @@ def read_json_file(file_path):
         data = json.load(file)
     return data['data']
 
-def get_all_divesites_data(folder_path):
-    """Store all cached API data into database"""
+def get_all_divesites_data(app, folder_path):
+    """Store all cached API data into database.
+
+    Brings the schema up to date first. Divesites already in the database
+    (by api_id) are skipped, so this can be re-run without losing users
+    or dives.
+    """
 
     with app.app_context():
-        db.drop_all()
-        db.create_all()
-
-    completed = set()
-    countries = {str.lower(country.name) for country in pycountry.countries}
-    countries_to_add = [
-        'usa',
-        'bolivia',
-        'bonaire',
-        'bosnia',
-        'cocos islands',
-        'cook island',
-        'falkland islands',
-        'iran',
-        'korea',
-        'micronesia',
-        'moldova',
-        'palestine',
-        'saint martin',
-        'sint maarten',
-        'taiwan',
-        'tanzania',
-        'vietnam'
-    ]
-    for country in countries_to_add:
-        countries.add(country)
+        upgrade()
+        completed = set(db.session.scalars(db.select(Divesite.api_id).where(Divesite.api_id != None)))
+
+    countries = lowercase_country_names()
     continents = set(["north america", "europe", "south america", "africa", "asia", "oceania"])
 
     # Iterate through all files in the folder
@@ -58,13 +43,13 @@ def get_all_divesites_data(folder_path):
 
             for site in divesites_data:
 
-                # if this record has been seen already, skip it
-                if site['id'] in completed:
+                # if this record has been seen already (or is already stored), skip it
+                if str(site['id']) in completed:
                     continue
-                completed.add(site['id'])
+                completed.add(str(site['id']))
 
                 # convert id to api_id, we'll give our own ids in this database
-                site['api_id'] = site['id']
+                site['api_id'] = str(site['id'])
                 del site['id']
 
                 # convert lat/lng from strings to float
@@ -103,11 +88,21 @@ def get_all_divesites_data(folder_path):
                         insert(Divesite),
                         data_to_add
                     )
+                    generations.bump(generations.DIVESITES)
                     db.session.commit()
     return
 
-# Specify the path to the by_country_or_region folder
-folder_path = os.path.join(os.getcwd(), 'api-queries/by_country_or_region')
+def make_db_app():
+    """A bare app with only the database set up, so seeding doesn't load the
+    web app's extensions."""
+
+    app = Flask(__name__)
+    connect_db(app)
+    return app
+
+if __name__ == "__main__":
+    # Specify the path to the by_country_or_region folder
+    folder_path = os.path.join(os.getcwd(), 'api-queries/by_country_or_region')
 
-# Get all divesites data from JSON files in the folder
-all_divesites_data = get_all_divesites_data(folder_path)
\ No newline at end of file
+    # Get all divesites data from JSON files in the folder
+    get_all_divesites_data(make_db_app(), folder_path)
\ No newline at end of file
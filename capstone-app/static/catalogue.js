@@ -0,0 +1,22 @@
+// The divesite catalogue snapshot (see catalogue.py), downloaded at most
+// once per page. The snapshot itself is cached by the browser until the
+// divesites change.
+let cataloguePromise;
+
+// Resolves to [{id, name, lat, lng, country, continent}, ...], or null if
+// the catalogue couldn't be loaded (callers then ask the server instead).
+function loadCatalogue() {
+    if (!cataloguePromise) {
+        cataloguePromise = fetch('/catalogue/manifest.json')
+            .then(response => response.json())
+            .then(manifest => fetch(manifest.divesites))
+            .then(response => response.json())
+            .then(snapshot => snapshot.rows.map(row => {
+                const site = {};
+                snapshot.fields.forEach((field, i) => { site[field] = row[i]; });
+                return site;
+            }))
+            .catch(() => null);
+    }
+    return cataloguePromise;
+}
@@ -1,7 +1,11 @@
 let map;
-let infoWindows = [];
-let currentMarkers = [];
+let infoWindow; // One InfoWindow, created the first time a marker is clicked
+let markers = new Map(); // divesite id -> marker, for every divesite currently shown
+let loadedBounds; // Bounds the markers were loaded for
+let latestRequest = 0; // Number of the most recent request, to ignore stale replies
 let markerCluster; // Declare markerCluster variable
+let heatmap; // HeatmapLayer of where dives happen, created when first switched on
+let latestHeatmapRequest = 0;
 let debounceTimer; // Declare a timer variable
 
 function initMap() {
@@ -10,6 +14,11 @@ function initMap() {
         zoom: 8
     });
 
+    markerCluster = new MarkerClusterer(map, [], {
+        imagePath: 'https://developers.google.com/maps/documentation/javascript/examples/markerclusterer/m',
+        maxZoom: 10  // Adjust as needed
+    });
+
     // Wait for the tiles to load before executing further code
     google.maps.event.addListenerOnce(map, 'tilesloaded', function () {
         // Load initial divesites
@@ -22,79 +31,163 @@ function initMap() {
             debounceTimer = setTimeout(() => {
                 // Load divesites within the updated bounds
                 loadDivesites();
+                loadHeatmap();
             }, 300); // Adjust the delay as needed (e.g., 500 milliseconds)
         });
     });
+
+    document.getElementById('show-heatmap').addEventListener('change', loadHeatmap);
+}
+
+function boundsParams(bounds, prefix) {
+    const ne = bounds.getNorthEast();
+    const sw = bounds.getSouthWest();
+    return `${prefix}ne_lat=${ne.lat()}&${prefix}ne_lng=${ne.lng()}&${prefix}sw_lat=${sw.lat()}&${prefix}sw_lng=${sw.lng()}`;
 }
 
 function loadDivesites() {
     // Get current map bounds
     const bounds = map.getBounds();
-    const ne = bounds.getNorthEast();
-    const sw = bounds.getSouthWest();
+    const requestNumber = ++latestRequest;
+
+    // Filter the downloaded catalogue if we have it, otherwise ask the server
+    loadCatalogue().then(sites => {
+        if (!sites) {
+            fetchDivesites(bounds, requestNumber);
+        } else if (requestNumber === latestRequest) {
+            showOnly(sites
+                .filter(site => site.lat !== null && site.lng !== null && bounds.contains({ lat: site.lat, lng: site.lng }))
+                .map(site => ({ id: site.id, name: site.name, latitude: site.lat, longitude: site.lng })));
+        }
+    });
+}
 
-    // Remove old markers from the map
-    removeMarkers();
+function fetchDivesites(bounds, requestNumber) {
+    // Ask only for what changed since the markers we already have
+    let url = `${document.getElementById('map').dataset.divesitesUrl}?${boundsParams(bounds, '')}`;
+    if (loadedBounds) {
+        url += `&${boundsParams(loadedBounds, 'prev_')}`;
+    }
 
-    // Call Flask route to get dive site data within the bounds
-    fetch(`/get_dive_sites?ne_lat=${ne.lat()}&ne_lng=${ne.lng()}&sw_lat=${sw.lat()}&sw_lng=${sw.lng()}`)
+    fetch(url)
         .then(response => response.json())
         .then(data => {
+            // A newer request was made while this one was in flight. Its
+            // changes are relative to the same loadedBounds, so skip this one.
+            if (requestNumber !== latestRequest) {
+                return;
+            }
 
-            // Iterate through dive sites and add markers
-            data.forEach(site => {
-                const marker = new google.maps.Marker({
-                    position: { lat: site.latitude, lng: site.longitude },
-                    title: site.name
-                });
-
-                // Create InfoWindow content
-                const contentString = `
-                    <div>
-                        <h4>${site.name}</h4>
-                        <p><a href="/divesites/${site.id}">Choose this divesite</a></p>
-                    </div>
-                `;
-
-                // Create InfoWindow
-                const infoWindow = new google.maps.InfoWindow({
-                    content: contentString
-                });
+            if (Array.isArray(data)) {
+                showOnly(data);
+            } else {
+                removeMarkers(data.removed);
+                addMarkers(data.added);
+            }
 
-                // Add click event listener to marker to open the InfoWindow
-                marker.addListener('click', () => {
-                    // Close all existing InfoWindows
-                    infoWindows.forEach(infoWindow => {
-                        infoWindow.close();
-                    });
-                    // Open the clicked marker's InfoWindow
-                    infoWindow.open(map, marker);
-                });
+            loadedBounds = bounds;
+        });
+}
 
-                // Store the InfoWindow in the array
-                infoWindows.push(infoWindow);
+// Show markers for exactly these sites, keeping the ones already shown
+function showOnly(sites) {
+    const ids = new Set(sites.map(site => site.id));
+    removeMarkers([...markers.keys()].filter(id => !ids.has(id)));
+    addMarkers(sites);
+}
 
-                // Add the marker to the array of markers
-                currentMarkers.push(marker);
-            });
+function addMarkers(sites) {
+    const added = [];
 
-            // Remove the existing clusterer
-            if (markerCluster) {
-                markerCluster.clearMarkers();
-            }
+    sites.forEach(site => {
+        if (markers.has(site.id)) {
+            return;
+        }
 
-            // Create a new clusterer with the current markers
-            markerCluster = new MarkerClusterer(map, currentMarkers, {
-                imagePath: 'https://developers.google.com/maps/documentation/javascript/examples/markerclusterer/m',
-                maxZoom: 10  // Adjust as needed
-            });
+        const marker = new google.maps.Marker({
+            position: { lat: site.latitude, lng: site.longitude },
+            title: site.name
         });
+
+        // Add click event listener to marker to open the InfoWindow
+        marker.addListener('click', () => showInfoWindow(site, marker));
+
+        markers.set(site.id, marker);
+        added.push(marker);
+    });
+
+    markerCluster.addMarkers(added);
 }
 
-// Function to remove old markers from the map
-function removeMarkers() {
-    currentMarkers.forEach(marker => {
-        marker.setMap(null);
+function removeMarkers(ids) {
+    const removed = [];
+
+    ids.forEach(id => {
+        const marker = markers.get(id);
+        if (marker) {
+            markers.delete(id);
+            removed.push(marker);
+        }
     });
-    currentMarkers = [];
+
+    markerCluster.removeMarkers(removed);
+}
+
+function showInfoWindow(site, marker) {
+    if (!infoWindow) {
+        infoWindow = new google.maps.InfoWindow();
+    }
+
+    // Create InfoWindow content
+    const content = document.createElement('div');
+    const name = document.createElement('h4');
+    name.textContent = site.name;
+    const link = document.createElement('a');
+    link.href = `/divesites/${site.id}`;
+    link.textContent = 'Choose this divesite';
+    const paragraph = document.createElement('p');
+    paragraph.appendChild(link);
+    content.append(name, paragraph);
+
+    infoWindow.setContent(content);
+    infoWindow.open(map, marker);
+}
+
+function loadHeatmap() {
+    const requestNumber = ++latestHeatmapRequest;
+
+    if (!document.getElementById('show-heatmap').checked) {
+        if (heatmap) {
+            heatmap.setMap(null);
+        }
+        return;
+    }
+
+    const url = `${document.getElementById('map').dataset.heatmapUrl}?zoom=${map.getZoom()}&${boundsParams(map.getBounds(), '')}`;
+
+    fetch(url)
+        .then(response => response.json())
+        .then(data => {
+            if (requestNumber !== latestHeatmapRequest) {
+                return;
+            }
+
+            // Cells come as flat [row, col, count, ...] triples; draw each at its centre
+            const points = [];
+            for (let i = 0; i < data.cells.length; i += 3) {
+                points.push({
+                    location: new google.maps.LatLng(
+                        data.origin[0] + (data.cells[i] + 0.5) * data.cell,
+                        data.origin[1] + (data.cells[i + 1] + 0.5) * data.cell
+                    ),
+                    weight: data.cells[i + 2]
+                });
+            }
+
+            if (!heatmap) {
+                heatmap = new google.maps.visualization.HeatmapLayer({ radius: 30 });
+            }
+            heatmap.setData(points);
+            heatmap.setMap(map);
+        });
 }
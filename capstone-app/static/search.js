@@ -0,0 +1,43 @@
+// Suggests divesite names from the catalogue as you type in the search box.
+const MAX_SUGGESTIONS = 10;
+
+document.addEventListener('DOMContentLoaded', () => {
+    const input = document.getElementById('search');
+    const category = document.getElementById('search-category');
+    if (!input || !category) {
+        return;
+    }
+
+    const suggestions = document.createElement('datalist');
+    suggestions.id = 'search-suggestions';
+    input.after(suggestions);
+    input.setAttribute('list', suggestions.id);
+
+    input.addEventListener('input', () => {
+        const query = input.value.trim().toLowerCase();
+        if (category.value !== 'divesites' || query.length < 2) {
+            suggestions.replaceChildren();
+            return;
+        }
+
+        loadCatalogue().then(sites => {
+            if (!sites || input.value.trim().toLowerCase() !== query) {
+                return;
+            }
+
+            const options = [];
+            for (const site of sites) {
+                if (site.name.toLowerCase().includes(query)) {
+                    const option = document.createElement('option');
+                    option.value = site.name;
+                    options.push(option);
+
+                    if (options.length === MAX_SUGGESTIONS) {
+                        break;
+                    }
+                }
+            }
+            suggestions.replaceChildren(...options);
+        });
+    });
+});
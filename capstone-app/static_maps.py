@@ -0,0 +1,102 @@
+"""Serves Google Static Maps images through a local disk cache.
+
+Templates link to /static-maps/<divesite_id>/<zoom>.png instead of Google
+directly, so the API key stays on the server and each image is only
+fetched from Google once.
+"""
+
+import os
+
+import requests
+from flask import Blueprint, abort, current_app, request, send_file, url_for
+
+from disk_cache import DiskCache
+
+static_maps = Blueprint('static_maps', __name__)
+
+MAP_SIZES = {'600x400', '800x400'}
+DEFAULT_MAP_SIZE = '600x400'
+ONE_YEAR = 60 * 60 * 24 * 365
+
+def init_app(app):
+    """Set up the static map cache and register the route."""
+
+    app.config.setdefault('STATIC_MAPS_UPSTREAM', 'https://maps.googleapis.com/maps/api/staticmap')
+    app.config.setdefault('STATIC_MAPS_API_KEY', None)
+    app.config.setdefault('STATIC_MAPS_CACHE_DIR', os.path.join(app.instance_path, 'static-maps'))
+    app.config.setdefault('STATIC_MAPS_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+    app.config.setdefault('STATIC_MAPS_TIMEOUT', 10)
+
+    app.extensions['static_maps'] = DiskCache(
+        app.config['STATIC_MAPS_CACHE_DIR'],
+        app.config['STATIC_MAPS_CACHE_MAX_BYTES'],
+        suffix='.png'
+    )
+    app.register_blueprint(static_maps)
+
+def static_map_url(divesite_id, zoom=11, size=DEFAULT_MAP_SIZE):
+    """Returns the local URL of a divesite's static map."""
+
+    if size == DEFAULT_MAP_SIZE:
+        return url_for('static_maps.static_map', divesite_id=divesite_id, zoom=zoom)
+
+    return url_for('static_maps.static_map', divesite_id=divesite_id, zoom=zoom, size=size)
+
+def fetch_static_map(lat, lng, zoom, size):
+    """Gets a static map image from the upstream server.
+
+    Returns the PNG bytes, or None if the upstream didn't send an image.
+    """
+
+    params = {
+        'center': f'{lat},{lng}',
+        'zoom': zoom,
+        'size': size,
+        'markers': f'{lat},{lng}',
+        'key': current_app.config['STATIC_MAPS_API_KEY']
+    }
+
+    try:
+        response = requests.get(
+            current_app.config['STATIC_MAPS_UPSTREAM'],
+            params=params,
+            timeout=current_app.config['STATIC_MAPS_TIMEOUT']
+        )
+    except requests.RequestException:
+        current_app.logger.warning("Static map fetch failed for %s,%s", lat, lng, exc_info=True)
+        return None
+
+    if response.status_code != 200 or not response.headers.get('Content-Type', '').startswith('image/'):
+        current_app.logger.warning("Static map upstream answered %s for %s,%s", response.status_code, lat, lng)
+        return None
+
+    return response.content
+
+@static_maps.route('/static-maps/<int:divesite_id>/<int:zoom>.png')
+def static_map(divesite_id, zoom):
+    """Returns the static map image for a divesite, fetching it on first use."""
+
+    from models import Divesite
+
+    size = request.args.get('size', DEFAULT_MAP_SIZE)
+
+    if not 0 <= zoom <= 21 or size not in MAP_SIZES:
+        abort(404)
+
+    divesite = Divesite.query.get_or_404(divesite_id)
+
+    # key on the coordinates, so a site that moves gets a new image
+    cache = current_app.extensions['static_maps']
+    key = f'{divesite.lat},{divesite.lng}/{zoom}/{size}'
+    path = cache.get(key)
+
+    if path is None:
+        image = fetch_static_map(divesite.lat, divesite.lng, zoom, size)
+        if image is None:
+            abort(502)
+        path = cache.put(key, image)
+
+    response = send_file(path, mimetype='image/png', max_age=ONE_YEAR)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
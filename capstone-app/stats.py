@@ -0,0 +1,128 @@
+"""Precomputed totals for users and divesites.
+
+Listings show each user's dive count, depth and bottom time and each
+divesite's dive count and rating, and the leaderboards rank users by
+them worldwide and per country and continent. Working those out per row
+at read time costs a few queries per card, so they are kept in the
+user_stats, user_region_stats and divesite_stats tables instead. Routes
+that change dives queue a refresh (see jobs.py) and the worker recomputes
+just the affected rows, so the tables trail the dives by however long the
+queue takes. Refreshing users also queues re-ranking the leaderboards, and
+expires the cached fragments that show their totals.
+
+`flask stats rebuild` recomputes every row, e.g. after seeding.
+"""
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, literal, select, union_all
+
+from fragment_cache import invalidate_user_fragments
+from jobs import task
+from leaderboards import rank_all, rerank_soon
+from models import db, Dive, Divesite, DivesiteStats, User, UserRegionStats, UserStats
+
+stats_cli = AppGroup('stats', help="Rebuild the user and divesite stats tables.")
+
+def init_app(app):
+    app.cli.add_command(stats_cli)
+
+def _user_totals():
+    """Every user's totals, zeros included, as a SELECT matching user_stats."""
+
+    return (
+        select(
+            User.id.label('user_id'),
+            func.count(Dive.id),
+            func.max(Dive.max_depth),
+            func.max(Dive.bottom_time),
+            func.count(func.distinct(Divesite.country)),
+            func.count(func.distinct(Divesite.continent)),
+            func.current_timestamp()
+        )
+        .select_from(User)
+        .outerjoin(Dive, Dive.user_id == User.id)
+        .outerjoin(Divesite, Divesite.id == Dive.divesite_id)
+        .group_by(User.id)
+    )
+
+def _user_region_totals():
+    """Every user's totals per country and per continent they've dived in,
+    as a SELECT matching user_region_stats."""
+
+    def per(column, prefix):
+        return (
+            select(
+                (literal(prefix) + column).label('scope'),
+                Dive.user_id.label('user_id'),
+                func.count(Dive.id).label('num_dives'),
+                func.max(Dive.max_depth).label('max_depth'),
+                func.max(Dive.bottom_time).label('max_bottom_time')
+            )
+            .join(Divesite, Divesite.id == Dive.divesite_id)
+            .where(column.is_not(None))
+            .group_by(column, Dive.user_id)
+        )
+
+    totals = union_all(per(Divesite.country, 'country:'), per(Divesite.continent, 'continent:')).subquery()
+    return select(*totals.c)
+
+def _divesite_totals():
+    """Totals of every divesite with dives, as a SELECT matching divesite_stats."""
+
+    return (
+        select(Dive.divesite_id, func.count(Dive.id), func.avg(Dive.rating), func.current_timestamp())
+        .group_by(Dive.divesite_id)
+    )
+
+USER_COLUMNS = ['user_id', 'num_dives', 'max_depth', 'max_bottom_time', 'num_countries',
+                'num_continents', 'updated_at']
+REGION_COLUMNS = ['scope', 'user_id', 'num_dives', 'max_depth', 'max_bottom_time']
+DIVESITE_COLUMNS = ['divesite_id', 'num_dives', 'avg_rating', 'updated_at']
+
+def _replace(model, columns, totals, key=None, ids=None):
+    """Replaces the rows of `model` (those with these ids, or all) with `totals`."""
+
+    delete = model.__table__.delete()
+    if ids is not None:
+        delete = delete.where(key.in_(ids))
+        totals = totals.where(totals.selected_columns[key.name].in_(ids))
+
+    db.session.execute(delete)
+    db.session.execute(model.__table__.insert().from_select(columns, totals))
+
+@task
+def refresh_user_stats(*user_ids):
+    """Recomputes the stats of these users. Deleted users lose their rows."""
+
+    _replace(UserStats, USER_COLUMNS, _user_totals(), UserStats.user_id, set(user_ids))
+    _replace(UserRegionStats, REGION_COLUMNS, _user_region_totals(), UserRegionStats.user_id, set(user_ids))
+    rerank_soon(*user_ids)
+
+    # Committed first: a page rendered in between would cache the old totals
+    # under the new versions
+    db.session.commit()
+    invalidate_user_fragments(*user_ids)
+
+@task
+def refresh_divesite_stats(*divesite_ids):
+    """Recomputes the stats of these divesites. Divesites without dives have no row."""
+
+    _replace(DivesiteStats, DIVESITE_COLUMNS, _divesite_totals(), DivesiteStats.divesite_id, set(divesite_ids))
+
+def rebuild_all():
+    """Recomputes every row of the stats tables and re-ranks the
+    leaderboards. The caller commits."""
+
+    _replace(UserStats, USER_COLUMNS, _user_totals())
+    _replace(UserRegionStats, REGION_COLUMNS, _user_region_totals())
+    _replace(DivesiteStats, DIVESITE_COLUMNS, _divesite_totals())
+    rank_all()
+
+@stats_cli.command('rebuild')
+def rebuild():
+    """Recompute the stats of every user and divesite now."""
+
+    rebuild_all()
+    db.session.commit()
+    click.echo("Stats rebuilt.")
@@ -0,0 +1,171 @@
+"""Test fixtures: an app on in-memory SQLite, a small seeded dataset, and
+the query_budget fixture for asserting how many SQL statements and rows a
+block of code may use."""
+
+import os
+import sys
+import types
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+
+try:
+    import secret
+except ImportError:
+    # secret.py is not checked in, so tests bring their own
+    secret = types.ModuleType('secret')
+    secret.SECRET_KEY = 'test-secret'
+    secret.GOOGLE_API_KEY = 'test-google-key'
+    sys.modules['secret'] = secret
+
+from app import create_app
+from models import db, Buddy, Dive, Divesite, Divetype, User
+from stats import rebuild_all as rebuild_stats
+
+PASSWORD = 'password'
+
+@event.listens_for(Engine, 'connect')
+def _enforce_foreign_keys(dbapi_connection, connection_record):
+    """SQLite ignores foreign keys unless asked; Postgres always enforces
+    them, ON DELETE CASCADE included."""
+
+    if type(dbapi_connection).__module__.startswith('sqlite3'):
+        dbapi_connection.execute('PRAGMA foreign_keys = ON')
+
+class QueryCounter:
+    """Counts SQL statements run and ORM rows loaded while active."""
+
+    def __init__(self):
+        self.statements = []
+        self.rows = 0
+
+    def _on_execute(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def _on_load(self, target, context):
+        self.rows += 1
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self._on_execute)
+        event.listen(db.Model, 'load', self._on_load, propagate=True)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, 'before_cursor_execute', self._on_execute)
+        event.remove(db.Model, 'load', self._on_load)
+
+    @property
+    def queries(self):
+        return len(self.statements)
+
+@pytest.fixture
+def query_budget():
+    """Assert that a block stays within a query (and row) budget.
+
+        with query_budget(max_queries=5, max_rows=20):
+            client.get('/')
+    """
+
+    @contextmanager
+    def budget(max_queries, max_rows=None):
+        with QueryCounter() as counter:
+            yield counter
+
+        listing = "\n".join(f"  {' '.join(s.split())[:200]}" for s in counter.statements)
+        assert counter.queries <= max_queries, (
+            f"{counter.queries} queries, budget is {max_queries}:\n{listing}"
+        )
+        if max_rows is not None:
+            assert counter.rows <= max_rows, f"{counter.rows} rows loaded, budget is {max_rows}"
+
+    return budget
+
+def seed_dataset():
+    """Four divers with buddies, a dozen and a half divesites and some dives,
+    plus 'zed' (user 5), who has no dives or buddies. Alice added divesites
+    1 (which has dives) and 7 (which doesn't).
+
+    Big enough that a per-row query in a template shows up as a budget
+    overrun, small enough to rebuild for every test.
+    """
+
+    hashed = User.signup('alice', PASSWORD, 'Alice', 'Diver').password
+    users = [User.query.filter_by(username='alice').one()]
+    for name in ('bob', 'carol', 'dave', 'zed'):
+        user = User(username=name, password=hashed, first_name=name.title(), last_name='Diver',
+                    image_url=User.image_url.default.arg, header_image_url=User.header_image_url.default.arg,
+                    bio="No bio yet!")
+        db.session.add(user)
+        users.append(user)
+    db.session.flush()
+
+    alice = users[0]
+    alice.buddies.extend(users[1:4])
+    users[1].buddies.append(alice)
+    users = users[:4]
+
+    sites = []
+    for i in range(18):
+        site = Divesite(name=f"Reef {i}", lat=10 + i * 0.1, lng=20 + i * 0.1, ocean="Indian",
+                        country="Maldives", continent="Asia", location="Maldives, Asia",
+                        api_id=str(alice.id) if i in (0, 6) else f"api-{i}")
+        db.session.add(site)
+        sites.append(site)
+    db.session.flush()
+
+    for n in range(24):
+        user = users[n % len(users)]
+        dive = Dive(user_id=user.id, dive_no=n // len(users) + 1, divesite_id=sites[n % 6].id,
+                    date=date(2024, 1, 1) + timedelta(days=n), rating=n % 10 + 1, bottom_time=30 + n,
+                    max_depth=40 + n, comments="Nice dive", buddy_id=users[(n + 1) % len(users)].id)
+        db.session.add(dive)
+        db.session.flush()
+        db.session.add(Divetype(dive_id=dive.id, drysuit=False, night=n % 2 == 0, cave=False,
+                                wreck=n % 3 == 0, drift=False, ice=False, deep=True, technical=False,
+                                altitude=False, muck=False))
+
+    rebuild_stats()
+    db.session.commit()
+
+flask_app = create_app({'TESTING': True, 'WTF_CSRF_ENABLED': False})
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        # Only the default bind: test_replicas' app registers a 'replica'
+        # bind on the shared db, which this app has no engine for
+        db.drop_all(bind_key=None)
+        db.create_all(bind_key=None)
+        seed_dataset()
+
+    flask_app.extensions['fragment_cache'].backend.clear()
+    flask_app.extensions['search_cache'].backend.clear()
+
+    yield flask_app
+
+    with flask_app.app_context():
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def log_in(client, user_id):
+    with client.session_transaction() as session:
+        session['curr_user'] = user_id
+    return client
+
+@pytest.fixture
+def logged_in_client(app):
+    """Client logged in as alice (user 1), who has three buddies."""
+
+    return log_in(app.test_client(), 1)
@@ -0,0 +1,50 @@
+"""Deleting an account: hidden at once, purged in the background."""
+
+import jobs
+from conftest import log_in
+from models import db, Buddy, Dive, Divetype, User, UserStats
+
+def test_deleted_accounts_are_hidden_at_once(app):
+    client = log_in(app.test_client(), 1)
+    client.post('/users/delete')
+
+    assert client.get('/users/2').status_code == 302
+
+    bob = log_in(app.test_client(), 2)
+    assert bob.get('/users/1').status_code == 404
+    assert 'alice' not in bob.get('/search?category=users&q=a').get_data(as_text=True)
+    assert 'Invalid credentials' in app.test_client().post(
+        '/login', data={'username': 'alice', 'password': 'password'}
+    ).get_data(as_text=True)
+
+    with app.app_context():
+        # nothing is purged until the worker runs
+        assert db.session.get(User, 1).deleted_at is not None
+        assert Dive.query.filter_by(user_id=1).count() == 6
+
+def test_purge_deletes_in_batches(app):
+    app.config['ACCOUNT_PURGE_BATCH_SIZE'] = 5
+    log_in(app.test_client(), 1).post('/users/delete')
+
+    with app.app_context():
+        purges = 0
+        while jobs.work_once():
+            purges += 1
+
+        assert db.session.get(User, 1) is None
+        # alice's 6 dives, the 6 dave logged with her, then the user row
+        assert purges >= 4
+        assert Dive.query.filter((Dive.user_id == 1) | (Dive.buddy_id == 1)).count() == 0
+        assert Dive.query.count() == 12
+        assert Divetype.query.count() == 12
+        assert Buddy.query.filter((Buddy.main_user_id == 1) | (Buddy.buddy_user_id == 1)).count() == 0
+        assert db.session.get(UserStats, 1) is None
+        assert db.session.get(UserStats, 4).num_dives == 0
+
+def test_deleting_a_divesite_with_dives(app):
+    client = log_in(app.test_client(), 1)
+    client.post('/divesites/1/delete')
+
+    with app.app_context():
+        assert Dive.query.filter_by(divesite_id=1).count() == 0
+        assert Divetype.query.count() == Dive.query.count() == 20
@@ -0,0 +1,65 @@
+"""Per-user dive analytics."""
+
+from datetime import date
+
+import numpy as np
+
+from analytics import binned, by_period, counted, user_analytics
+from conftest import log_in
+from test_heatmap import DIVE_FORM
+
+def test_by_period_fills_gaps():
+    dates = np.array(['2024-01-05', '2024-03-09', '2024-03-20'], dtype='datetime64[D]')
+
+    labels, counts, ratings = by_period(dates, np.array([8.0, 6.0, 9.0]), 'M')
+
+    assert labels == ['2024-01', '2024-02', '2024-03']
+    assert counts == [1, 0, 2]
+    assert ratings == [8.0, None, 7.5]
+
+def test_binned_and_counted():
+    assert binned(np.array([5.0, 12.0, 20.0]), 10) == [("0-10", 1), ("10-20", 2)]
+    assert counted(['Fiji', None, 'Egypt', 'Fiji', 'Bonaire', 'Egypt']) == [('Egypt', 2), ('Fiji', 2), ('Bonaire', 1)]
+    assert counted([None]) == []
+
+def test_alices_analytics(app):
+    with app.app_context():
+        analytics = user_analytics(1)
+
+    # alice logged dives 0, 4, ..., 20 of the seed data, from Jan 1 2024, all with bob
+    assert analytics['num_dives'] == 6
+    assert analytics['dives_per_month'] == [('2024-01', 6)]
+    assert analytics['depths'][-2:] == [("40-50", 3), ("50-60", 3)]
+    assert analytics['countries'] == [('Maldives', 6)]
+    assert analytics['buddies'] == [(2, 6)]
+    assert analytics['dive_types'] == [('night', 6), ('deep', 6), ('wreck', 2)]
+
+def test_page_is_cached_until_a_dive_changes(app, query_budget):
+    client = log_in(app.test_client(), 1)
+    page = client.get('/users/1/analytics').get_data(as_text=True)
+    assert 'bob' in page
+
+    with app.app_context(), query_budget(0):
+        user_analytics(1)
+
+    client.post('/divesites/2/new', data=dict(DIVE_FORM, date=date(2025, 2, 1).isoformat()))
+
+    with app.app_context():
+        analytics = user_analytics(1)
+    assert analytics['num_dives'] == 7
+    assert analytics['dives_per_year'] == [('2024', 6), ('2025', 1)]
+
+def test_no_dives(app):
+    client = log_in(app.test_client(), 5)
+
+    assert 'No dives logged yet.' in client.get('/users/5/analytics').get_data(as_text=True)
+
+def test_deleting_a_divesite_resets_its_divers_analytics(app):
+    with app.app_context():
+        assert user_analytics(3)['num_dives'] == 6
+
+    # alice added divesite 1, where she and carol (3) have two dives each
+    log_in(app.test_client(), 1).post('/divesites/1/delete')
+
+    with app.app_context():
+        assert user_analytics(3)['num_dives'] == 4
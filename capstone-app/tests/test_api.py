@@ -0,0 +1,80 @@
+"""The async JSON API, against a SQLite file seeded through the Flask app."""
+
+import asyncio
+
+import pytest
+from starlette.testclient import TestClient
+
+from api import Coalescer, async_database_url, create_api
+from app import create_app
+from conftest import seed_dataset
+from models import db
+
+@pytest.fixture
+def api_client(tmp_path):
+    url = f"sqlite:///{tmp_path / 'api.db'}"
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': url})
+
+    with app.app_context():
+        db.create_all()
+        seed_dataset()
+        db.session.remove()
+        db.engine.dispose()
+
+    with TestClient(create_api(url)) as client:
+        yield client
+
+def test_divesites_in_bounds(api_client):
+    response = api_client.get('/api/divesites?ne_lat=10.25&ne_lng=20.25&sw_lat=9&sw_lng=19')
+
+    assert response.status_code == 200
+    assert [site['name'] for site in response.json()] == ['Reef 0', 'Reef 1', 'Reef 2']
+    assert set(response.json()[0]) == {'id', 'name', 'latitude', 'longitude'}
+
+def test_divesites_needs_bounds(api_client):
+    assert api_client.get('/api/divesites?ne_lat=1').status_code == 400
+
+def test_search(api_client):
+    sites = api_client.get('/api/search/divesites?q=reef 1&limit=3').json()
+    users = api_client.get('/api/search/users?q=ali').json()
+
+    assert [site['name'] for site in sites] == ['Reef 1', 'Reef 10', 'Reef 11']
+    assert [user['username'] for user in users] == ['alice']
+    assert api_client.get('/api/search/users?q=').json() == []
+
+def test_search_wildcards_are_literal(api_client):
+    assert api_client.get('/api/search/divesites?q=%25').json() == []
+    assert api_client.get('/api/search/divesites?q=reef_1').json() == []
+    assert api_client.get('/api/search/users?q=_').json() == []
+    assert api_client.get('/api/search/users?q=%5C').json() == []
+
+def test_identical_concurrent_requests_run_once():
+    coalescer = Coalescer()
+    calls = []
+
+    async def query():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return ['result']
+
+    async def requests():
+        same = await asyncio.gather(*[coalescer.run('bounds', query) for _ in range(5)])
+        other = await coalescer.run('other bounds', query)
+        return same, other
+
+    same, other = asyncio.run(requests())
+
+    assert same == [['result']] * 5
+    assert other == ['result']
+    assert len(calls) == 2
+
+def test_async_database_url():
+    assert async_database_url('postgresql:///social-scuba-app').drivername == 'postgresql+asyncpg'
+    assert async_database_url('sqlite:///x.db').drivername == 'sqlite+aiosqlite'
+
+def test_divesites_changed_since_previous_bounds(api_client):
+    response = api_client.get('/api/divesites?ne_lat=10.45&ne_lng=20.45&sw_lat=10.15&sw_lng=20.15'
+                              '&prev_ne_lat=10.25&prev_ne_lng=20.25&prev_sw_lat=9&prev_sw_lng=19')
+
+    assert [site['name'] for site in response.json()['added']] == ['Reef 3', 'Reef 4']
+    assert response.json()['removed'] == [1, 2]
@@ -0,0 +1,59 @@
+"""Buddy links and suggestions, on the seeded dataset.
+
+Alice (1) has added bob, carol and dave; bob (2) has added alice. Alice
+and carol (3) have dived divesites 1, 3 and 5; bob and dave (4) have
+dived 2, 4 and 6. Zed (5) has no dives.
+"""
+
+from datetime import datetime
+
+from buddy_graph import add_buddies, buddy_ids, buddy_to_ids, remove_buddies, suggestions
+from conftest import log_in
+from models import db, User
+
+def test_add_and_remove_buddies(app):
+    with app.app_context():
+        assert add_buddies(2, [3, 4, 5, 1, 2, 999]) == 3
+        db.session.commit()
+        assert buddy_ids(2) == {1, 3, 4, 5}
+        assert 2 in buddy_to_ids(5)
+
+        assert remove_buddies(2, [3, 5, 999]) == 2
+        db.session.commit()
+        assert buddy_ids(2) == {1, 4}
+
+def test_suggestions(app):
+    with app.app_context():
+        suggested = [(user.username, mutual, shared) for user, mutual, shared in suggestions(2)]
+
+        # bob's buddy alice added carol and dave, and dave dived bob's divesites
+        assert suggested == [('dave', 1, 3), ('carol', 1, 0)]
+
+def test_suggestions_leave_out_buddies(app):
+    with app.app_context():
+        assert suggestions(1) == []
+
+def test_suggestions_by_divesite(app):
+    with app.app_context():
+        assert [(user.username, mutual, shared) for user, mutual, shared in suggestions(3)] == [('alice', 0, 3)]
+        assert suggestions(5) == []
+
+def test_deleted_users_are_left_out(app):
+    with app.app_context():
+        add_buddies(4, [2])
+        db.session.get(User, 4).deleted_at = datetime(2024, 3, 1)
+        db.session.commit()
+
+        assert [user.username for user, _, _ in suggestions(2)] == ['carol']
+        assert add_buddies(2, [4]) == 0
+        assert [user.username for user in db.session.get(User, 1).buddies] == ['bob', 'carol']
+        assert [user.username for user in db.session.get(User, 2).buddies_to] == ['alice']
+
+def test_dive_form_offers_no_deleted_buddies(app):
+    with app.app_context():
+        db.session.get(User, 4).deleted_at = datetime(2024, 3, 1)
+        db.session.commit()
+
+    page = log_in(app.test_client(), 1).get('/divesites/1/new').get_data(as_text=True)
+    assert '>carol</option>' in page
+    assert '>dave</option>' not in page
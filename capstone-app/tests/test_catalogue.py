@@ -0,0 +1,87 @@
+"""The divesite catalogue snapshot."""
+
+import gzip
+import json
+
+import pytest
+
+import generations
+from catalogue import build
+from conftest import log_in
+from models import db, Divesite
+
+@pytest.fixture
+def catalogue_app(app, tmp_path):
+    app.config['CATALOGUE_DIR'] = str(tmp_path)
+    return app
+
+def download(client):
+    manifest = client.get('/catalogue/manifest.json').get_json()
+    response = client.get(manifest['divesites'], headers={'Accept-Encoding': 'gzip'})
+    return manifest, response
+
+def test_snapshot_has_every_divesite(catalogue_app):
+    manifest, response = download(catalogue_app.test_client())
+    snapshot = json.loads(gzip.decompress(response.data))
+
+    assert manifest['count'] == 18
+    assert snapshot['fields'] == ['id', 'name', 'lat', 'lng', 'country', 'continent']
+    assert snapshot['rows'][0] == [1, 'Reef 0', 10, 20, 'Maldives', 'Asia']
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'immutable' in response.headers['Cache-Control']
+
+def test_snapshot_without_gzip(catalogue_app):
+    client = catalogue_app.test_client()
+    manifest = client.get('/catalogue/manifest.json').get_json()
+
+    assert len(client.get(manifest['divesites']).get_json()['rows']) == 18
+
+def test_new_snapshot_when_divesites_change(catalogue_app):
+    client = log_in(catalogue_app.test_client(), 1)
+    before, _ = download(client)
+
+    client.post('/divesites/new', data={'name': 'New Reef', 'lat': '1.5', 'lng': '2.5', 'ocean': 'Indian',
+                                        'country': 'Maldives', 'continent': 'Asia', 'location': 'Here'})
+    after, response = download(client)
+
+    assert after['divesites'] != before['divesites']
+    assert after['count'] == 19
+    assert json.loads(gzip.decompress(response.data))['rows'][-1][1] == 'New Reef'
+
+def test_new_snapshot_when_a_divesite_is_renamed(catalogue_app):
+    client = catalogue_app.test_client()
+    before, _ = download(client)
+
+    # Same count and highest id, so only the generation tells
+    with catalogue_app.app_context():
+        db.session.get(Divesite, 1).name = 'Renamed Reef'
+        generations.bump(generations.DIVESITES)
+        db.session.commit()
+    after, response = download(client)
+
+    assert after['divesites'] != before['divesites']
+    assert json.loads(gzip.decompress(response.data))['rows'][0][1] == 'Renamed Reef'
+
+def test_build_command_picks_up_bulk_loads(catalogue_app):
+    client = catalogue_app.test_client()
+    before, _ = download(client)
+
+    with catalogue_app.app_context():
+        db.session.get(Divesite, 1).name = 'Loaded Reef'
+        db.session.commit()
+        generation = generations.current(generations.DIVESITES)
+    result = catalogue_app.test_cli_runner().invoke(build)
+    after, response = download(client)
+
+    assert result.exit_code == 0
+    # so other hosts rebuild their snapshots too
+    with catalogue_app.app_context():
+        assert generations.current(generations.DIVESITES) > generation
+    assert after['divesites'] != before['divesites']
+    assert json.loads(gzip.decompress(response.data))['rows'][0][1] == 'Loaded Reef'
+
+def test_unknown_snapshot(catalogue_app):
+    client = catalogue_app.test_client()
+
+    assert client.get('/catalogue/divesites.0000.json').status_code == 404
+    assert client.get('/catalogue/secret.py').status_code == 404
@@ -0,0 +1,79 @@
+"""Response compression and precompressed static files."""
+
+import gzip
+import shutil
+
+import brotli
+import pytest
+
+from conftest import flask_app, log_in
+
+@pytest.fixture
+def static_app(app, tmp_path):
+    shutil.copytree(flask_app.static_folder, tmp_path / 'static', ignore=shutil.ignore_patterns('images'))
+    original = app.static_folder
+    app.static_folder = str(tmp_path / 'static')
+    yield app
+    app.static_folder = original
+
+def test_pages_are_compressed_as_the_browser_prefers(app):
+    client = log_in(app.test_client(), 1)
+    plain = client.get('/')
+
+    brotlied = client.get('/', headers={'Accept-Encoding': 'gzip, deflate, br'})
+    gzipped = client.get('/', headers={'Accept-Encoding': 'gzip;q=1.0, br;q=0.5'})
+
+    assert 'Content-Encoding' not in plain.headers
+    assert brotlied.headers['Content-Encoding'] == 'br'
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert brotli.decompress(brotlied.data) == gzip.decompress(gzipped.data) == plain.data
+    assert len(brotlied.data) * 3 < len(plain.data)
+    assert 'Accept-Encoding' in brotlied.vary
+
+def test_small_responses_are_left_alone(app):
+    response = app.test_client().get('/heatmap?zoom=3', headers={'Accept-Encoding': 'gzip'})
+
+    assert len(response.data) < app.config['COMPRESS_MIN_SIZE']
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.vary
+
+def test_etags_follow_the_compressed_body(app):
+    client = app.test_client()
+    url = '/get_dive_sites?ne_lat=12&ne_lng=22&sw_lat=9&sw_lng=19'
+    app.config['COMPRESS_MIN_SIZE'] = 100
+
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+    again = client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+    # the plain body has its own ETag
+    assert client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 200
+
+def test_streams_are_compressed_chunk_by_chunk(app):
+    client = log_in(app.test_client(), 1)
+    plain = client.get('/users/1/logbook.csv').data
+
+    app.config['LOGBOOK_CHUNK_BYTES'] = 100
+    response = client.get('/users/1/logbook.csv', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.is_streamed
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == plain
+
+def test_static_files_use_precompressed_siblings(static_app):
+    client = static_app.test_client()
+    plain = client.get('/static/map.js').data
+    assert 'Content-Encoding' not in client.get('/static/map.js', headers={'Accept-Encoding': 'br'}).headers
+
+    result = static_app.test_cli_runner().invoke(args=['static', 'compress'])
+    assert 'map.js.br' in result.output
+
+    response = client.get('/static/map.js', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert response.mimetype in ('text/javascript', 'application/javascript')
+    assert brotli.decompress(response.data) == plain
+
+    response = client.get('/static/stylesheets/style.css', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/css'
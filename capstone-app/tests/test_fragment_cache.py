@@ -0,0 +1,84 @@
+"""Cached template fragments and their invalidation."""
+
+import pytest
+from flask import render_template_string
+
+from cache import LRUBackend, RedisBackend
+from conftest import log_in
+from fragment_cache import fragment_cache
+from test_jobs import DIVE_FORM
+from test_leaderboards import run_jobs
+
+class FakeRedis:
+    """Just enough of redis.Redis for RedisBackend, standing in for a
+    shared cache."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode()
+        return int(self.data[key])
+
+TEMPLATE = "{% cache 'greeting', user_id %}<b>{{ render() }}</b>{% endcache %}"
+
+@pytest.fixture(params=['lru', 'redis'])
+def backend(app, request, monkeypatch):
+    backend = LRUBackend() if request.param == 'lru' else RedisBackend(client=FakeRedis())
+    monkeypatch.setattr(fragment_cache, 'backend', backend)
+    return backend
+
+def test_fragments_are_rendered_once_until_bumped(app, backend):
+    renders = []
+
+    def render():
+        renders.append(1)
+        return f"render {len(renders)}"
+
+    with app.test_request_context():
+        first = render_template_string(TEMPLATE, user_id=1, render=render)
+        again = render_template_string(TEMPLATE, user_id=1, render=render)
+        other_user = render_template_string(TEMPLATE, user_id=2, render=render)
+
+        fragment_cache.bump(1)
+        bumped = render_template_string(TEMPLATE, user_id=1, render=render)
+        still_cached = render_template_string(TEMPLATE, user_id=2, render=render)
+
+    assert first == again == "<b>render 1</b>"
+    assert other_user == still_cached == "<b>render 2</b>"
+    assert bumped == "<b>render 3</b>"
+    assert len(renders) == 3
+
+def test_bump_only_moves_the_listed_users(backend):
+    fragment_cache.bump(1, 1, None, 3)
+
+    assert fragment_cache.version(1) == 1
+    assert fragment_cache.version(2) == 0
+    assert fragment_cache.version(3) == 1
+    assert fragment_cache.key('card', [1, 2]) == "fragment:card:1.1,2.0"
+
+def test_adding_a_dive_expires_the_buddies_fragments(app):
+    # bob (2) has alice (1) as a buddy; carol (3) doesn't
+    bob = log_in(app.test_client(), 2)
+    before = bob.get('/').get_data(as_text=True)
+    carol_version = fragment_cache.version(3)
+
+    log_in(app.test_client(), 1).post('/divesites/2/new', data=DIVE_FORM)
+    # the counts come from user_stats, which the job refreshes
+    assert '7 dives' not in bob.get('/').get_data(as_text=True)
+    with app.app_context():
+        run_jobs()
+    after = bob.get('/').get_data(as_text=True)
+
+    assert '7 dives' not in before
+    assert '7 dives' in after
+    assert fragment_cache.version(3) == carol_version
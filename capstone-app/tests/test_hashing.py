@@ -0,0 +1,94 @@
+"""Password hashing on the bounded pool."""
+
+import threading
+
+import pytest
+from flask import Flask
+
+from conftest import PASSWORD
+import hashing
+from hashing import HashingBusy, PasswordHasher
+from models import db, hasher, User
+
+@pytest.fixture
+def busy_hasher(monkeypatch):
+    """The app's hasher with every slot taken."""
+
+    slots = threading.BoundedSemaphore(1)
+    slots.acquire()
+    monkeypatch.setattr(hasher, '_slots', slots)
+    monkeypatch.setattr(hasher, 'timeout', 0.01)
+    return hasher
+
+def test_hashes_beyond_the_queue_fail_fast():
+    app = Flask(__name__)
+    app.config.update(BCRYPT_LOG_ROUNDS=4, PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=0,
+                      PASSWORD_HASH_TIMEOUT=0.05)
+    pool_hasher = PasswordHasher(app)
+
+    started, release = threading.Event(), threading.Event()
+
+    def hold():
+        started.set()
+        release.wait()
+
+    holder = threading.Thread(target=pool_hasher._run, args=(hold,))
+    holder.start()
+    started.wait()
+
+    with pytest.raises(HashingBusy):
+        pool_hasher.hash(PASSWORD)
+
+    release.set()
+    holder.join()
+    assert pool_hasher.check(pool_hasher.hash(PASSWORD), PASSWORD)
+
+def test_busy_login_is_a_503(client, busy_hasher):
+    response = client.post('/login', data={'username': 'alice', 'password': PASSWORD})
+
+    assert response.status_code == 503
+    assert b"Too many people logging in" in response.data
+
+def test_unknown_users_cost_one_check(app, monkeypatch):
+    calls = []
+    run = hasher._run
+    monkeypatch.setattr(hasher, '_run', lambda fn, *args: calls.append(fn) or run(fn, *args))
+
+    with app.app_context():
+        assert User.authenticate('nobody', PASSWORD) is False
+
+    assert len(calls) == 1
+    assert hasher._dummy_hash.startswith(f"$2b${hasher.rounds:02d}$")
+
+def test_the_throwaway_hash_is_made_once_on_first_use(monkeypatch):
+    app = Flask(__name__)
+    app.config.update(BCRYPT_LOG_ROUNDS=4)
+    lazy_hasher = PasswordHasher(app)
+    assert lazy_hasher._dummy_hash is None
+
+    made = []
+    generate = hashing.bcrypt.generate_password_hash
+    monkeypatch.setattr(hashing.bcrypt, 'generate_password_hash',
+                        lambda *args: made.append(args) or generate(*args))
+
+    threads = [threading.Thread(target=lazy_hasher.check, args=(None, PASSWORD)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(made) == 1
+    assert lazy_hasher._dummy_hash.startswith("$2b$04$")
+
+def test_hashes_are_upgraded_when_the_cost_changes(app, client, monkeypatch):
+    monkeypatch.setattr(hasher, 'rounds', hasher.rounds + 1)
+
+    response = client.post('/login', data={'username': 'alice', 'password': PASSWORD})
+    assert response.status_code == 302
+
+    with app.app_context():
+        hashed = db.session.get(User, 1).password
+    assert hashed.startswith(f"$2b${hasher.rounds:02d}$")
+
+    client.get('/logout')
+    assert client.post('/login', data={'username': 'alice', 'password': PASSWORD}).status_code == 302
@@ -0,0 +1,80 @@
+"""The dive heatmap grid."""
+
+import numpy as np
+
+from conftest import log_in
+from heatmap import histogram, level_for_zoom, sparse_cells
+
+DIVE_FORM = {
+    'date': '2024-03-01',
+    'rating': '8',
+    'bottom_time': '45',
+    'max_depth': '20',
+    'depth_units': 'meters',
+    'buddy_id': '-1',
+    'dive_type': ['night'],
+    'comments': 'Heatmap dive',
+}
+
+def cells(response):
+    data = response.get_json()
+    return [tuple(data['cells'][i:i + 3]) for i in range(0, len(data['cells']), 3)]
+
+def test_histogram_bins_by_cell():
+    raster = histogram(np.array([10.0, 10.4, -89.9, 90.0]), np.array([20.0, 20.4, -180.0, 180.0]), 0)
+
+    assert raster.shape == (36, 72)
+    assert raster[20, 40] == 2
+    assert raster[0, 0] == 1
+    # the north pole and antimeridian land in the last cells
+    assert raster[35, 71] == 1
+    assert sparse_cells(raster, 0) == [0, 0, 1, 20, 40, 2, 35, 71, 1]
+    assert sparse_cells(raster, 0, bounds=(15, 25, 5, 15)) == [20, 40, 2]
+
+def test_levels_get_finer_with_zoom():
+    assert [level_for_zoom(zoom) for zoom in (0, 4, 5, 7, 8, 20)] == [0, 0, 1, 1, 2, 2]
+
+def test_every_dive_is_counted(client):
+    data = client.get('/heatmap?zoom=3').get_json()
+
+    assert data['cell'] == 5.0
+    assert data['origin'] == [-90, -180]
+    assert data['cells'] == [20, 40, 24]
+
+def test_finer_levels_split_cells(client):
+    # divesites 0-5 sit at 10.0-10.5, 20.0-20.5, four dives each
+    counts = dict(((row, col), n) for row, col, n in cells(client.get('/heatmap?zoom=12')))
+
+    assert counts == {(400, 800): 12, (401, 801): 8, (402, 802): 4}
+
+def test_filters(app):
+    client = log_in(app.test_client(), 2)
+
+    assert cells(client.get('/heatmap?type=wreck')) == [(20, 40, 8)]
+    assert cells(client.get('/heatmap?start=2024-01-20')) == [(20, 40, 5)]
+    # bob has only added alice
+    assert cells(client.get('/heatmap?buddies_of=2')) == [(20, 40, 6)]
+    assert cells(client.get('/heatmap?ne_lat=0&ne_lng=0&sw_lat=-10&sw_lng=-10')) == []
+    assert client.get('/heatmap?type=snorkel').status_code == 400
+
+def test_new_dives_are_added_to_the_rasters(app):
+    client = log_in(app.test_client(), 1)
+    assert cells(client.get('/heatmap')) == [(20, 40, 24)]
+
+    client.post('/divesites/2/new', data=DIVE_FORM)
+    assert cells(client.get('/heatmap')) == [(20, 40, 25)]
+
+    client.post('/dives/1/delete')
+    assert cells(client.get('/heatmap')) == [(20, 40, 24)]
+
+def test_replacing_a_dive_rebuilds_the_rasters(app):
+    client = log_in(app.test_client(), 4)
+    client.get('/heatmap?zoom=12')
+
+    # dave's last dive, at divesite 6, goes; SQLite hands its id to the
+    # new one, at divesite 18, so the count and highest id stay the same
+    client.post('/dives/24/delete')
+    client.post('/divesites/18/new', data=DIVE_FORM)
+    counts = dict(((row, col), n) for row, col, n in cells(client.get('/heatmap?zoom=12')))
+
+    assert counts == {(400, 800): 12, (401, 801): 8, (402, 802): 3, (406, 806): 1}
@@ -0,0 +1,57 @@
+"""Route-aware Cache-Control, ETags and static fingerprints."""
+
+import re
+
+from conftest import log_in
+from http_cache import fingerprint
+
+def test_static_urls_carry_a_content_fingerprint(app):
+    client = app.test_client()
+    page = client.get('/login').get_data(as_text=True)
+
+    version = fingerprint(app, 'search.js')
+    assert re.fullmatch(r'[0-9a-f]{12}', version)
+    assert f'/static/search.js?v={version}' in page
+
+    fingerprinted = client.get(f'/static/search.js?v={version}')
+    assert fingerprinted.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+
+def test_stale_or_missing_fingerprints_are_cached_briefly(app):
+    client = app.test_client()
+    max_age = app.config['STATIC_UNVERSIONED_MAX_AGE']
+
+    assert client.get('/static/search.js').headers['Cache-Control'] == f'public, max-age={max_age}'
+    assert client.get('/static/search.js?v=0123456789ab').headers['Cache-Control'] == f'public, max-age={max_age}'
+    assert client.get('/static/missing.js').headers['Cache-Control'] == 'no-cache'
+
+def test_public_revalidated_routes_answer_304(app):
+    client = app.test_client()
+    url = '/get_dive_sites?ne_lat=12&ne_lng=22&sw_lat=9&sw_lng=19'
+
+    response = client.get(url)
+    assert response.headers['Cache-Control'] == 'public, no-cache'
+    assert response.headers['ETag']
+
+    again = client.get(url, headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+    assert again.data == b''
+
+    other = client.get(url, headers={'If-None-Match': '"something-else"'})
+    assert other.status_code == 200
+
+def test_private_revalidated_routes_answer_304(app):
+    client = log_in(app.test_client(), 1)
+
+    response = client.get('/divesites/1')
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+    again = client.get('/divesites/1', headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+
+def test_other_pages_are_private_and_not_stored(app):
+    client = log_in(app.test_client(), 1)
+
+    for url in ('/', '/users/1', '/login'):
+        response = client.get(url)
+        assert response.headers['Cache-Control'] == 'private, no-store', url
+        assert 'ETag' not in response.headers, url
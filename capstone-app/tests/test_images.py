@@ -0,0 +1,123 @@
+"""The image resizing route: signed sources, remote fetches and variants."""
+
+import io
+import os
+import re
+import socket
+import threading
+from html import unescape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from disk_cache import DiskCache
+from images import _variant_name, resized_image
+
+def png(width=600, height=300):
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), (0, 90, 160)).save(out, 'PNG')
+    return out.getvalue()
+
+class StubImageHost(BaseHTTPRequestHandler):
+    hosts = []
+
+    def do_GET(self):
+        StubImageHost.hosts.append(self.headers['Host'])
+        body = png()
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def image_host():
+    StubImageHost.hosts = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubImageHost)
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def image_app(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.extensions, 'images', DiskCache(str(tmp_path), 1024 * 1024))
+    return app
+
+def signed(app, src, width):
+    with app.test_request_context():
+        return resized_image(src, width)
+
+def test_template_urls_are_signed_and_served(image_app):
+    client = image_app.test_client()
+    page = client.get('/login').get_data(as_text=True)
+    url = unescape(re.search(r'src="(/images/resize\?[^"]+)"', page).group(1))
+
+    response = client.get(url, headers={'Accept': 'image/webp,*/*'})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'image/webp'
+    assert 'Accept' in response.vary
+
+def test_unsigned_or_tampered_sources_are_refused(image_app):
+    client = image_app.test_client()
+    url = signed(image_app, '/static/images/404.png', 128)
+
+    assert client.get(url).status_code == 200
+    assert client.get(url.replace('&s=', '&s=x')).status_code == 404
+    assert client.get('/images/resize?src=/static/images/404.png&w=128').status_code == 404
+    assert client.get(url.replace('404.png', 'nav-bg.png')).status_code == 404
+
+def test_remote_images_connect_to_the_checked_address(image_app, image_host, monkeypatch):
+    image_app.config['IMAGE_PROXY_ALLOW_PRIVATE'] = True
+    lookups = []
+    real_getaddrinfo = socket.getaddrinfo
+
+    def getaddrinfo(host, *args, **kwargs):
+        if host == 'images.example':
+            lookups.append(host)
+            # a rebinding name: the second answer would be somewhere else
+            host = '127.0.0.1' if len(lookups) == 1 else '10.0.0.1'
+        return real_getaddrinfo(host, *args, **kwargs)
+
+    monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+    src = f'http://images.example:{image_host.server_port}/me.png?size=big'
+
+    try:
+        response = image_app.test_client().get(signed(image_app, src, 256))
+    finally:
+        image_app.config['IMAGE_PROXY_ALLOW_PRIVATE'] = False
+
+    assert response.status_code == 200
+    with Image.open(io.BytesIO(response.data)) as img:
+        assert img.width == 256
+    assert lookups == ['images.example']
+    assert StubImageHost.hosts == [f'images.example:{image_host.server_port}']
+
+def test_private_addresses_are_not_fetched(image_app, image_host):
+    src = f'http://127.0.0.1:{image_host.server_port}/me.png'
+
+    assert image_app.test_client().get(signed(image_app, src, 256)).status_code == 404
+    assert not StubImageHost.hosts
+
+def test_variants_are_named_after_the_whole_path(image_app):
+    folder = image_app.static_folder
+    with image_app.app_context():
+        one = _variant_name(os.path.join(folder, 'images', 'logo.png'), 128, 'webp')
+        other = _variant_name(os.path.join(folder, 'images', 'partners', 'logo.png'), 128, 'webp')
+
+    assert one != other
+    assert os.path.basename(one).startswith('logo-') and one.endswith('-128.webp')
+
+def test_background_images_are_signed(image_app):
+    client = image_app.test_client()
+
+    for page in ('/', '/login'):
+        urls = re.findall(r"url\('([^']+)'\)", client.get(page).get_data(as_text=True))
+        assert urls, page
+        for url in urls:
+            assert client.get(unescape(url)).status_code == 200, url
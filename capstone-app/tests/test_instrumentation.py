@@ -0,0 +1,79 @@
+"""Per-request query counting, the slow request log and /metrics."""
+
+import logging
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from conftest import QueryCounter, log_in
+from instrumentation import metrics
+from models import db
+
+TOKEN = 'scrape-me'
+
+@pytest.fixture
+def metrics_app(app):
+    original = {key: app.config[key] for key in ('METRICS_TOKEN', 'SLOW_REQUEST_QUERIES', 'SLOW_REQUEST_MS')}
+    yield app
+    app.config.update(original)
+
+def totals(endpoint):
+    with metrics._lock:
+        return dict(metrics._totals[endpoint])
+
+def test_requests_count_their_queries(metrics_app):
+    client = log_in(metrics_app.test_client(), 1)
+    before = totals('main.users_show')
+
+    with QueryCounter() as counter:
+        response = client.get('/users/1')
+    after = totals('main.users_show')
+
+    assert after['requests'] == before['requests'] + 1
+    assert after['queries'] - before['queries'] == counter.queries > 0
+    assert after['db_time'] > before['db_time']
+    assert after['template_time'] > before['template_time']
+    assert after['bytes'] - before['bytes'] == len(response.data)
+
+def test_slow_requests_are_logged_with_their_statements(metrics_app, caplog):
+    client = log_in(metrics_app.test_client(), 1)
+    metrics_app.config.update(SLOW_REQUEST_QUERIES=1000, SLOW_REQUEST_MS=60_000)
+
+    with caplog.at_level(logging.WARNING):
+        client.get('/users/1')
+    assert not [r for r in caplog.records if r.getMessage().startswith('Slow request')]
+
+    metrics_app.config['SLOW_REQUEST_QUERIES'] = 1
+    with caplog.at_level(logging.WARNING):
+        client.get('/users/1')
+
+    [record] = [r for r in caplog.records if r.getMessage().startswith('Slow request')]
+    message = record.getMessage()
+    assert 'GET /users/1 (main.users_show)' in message
+    assert 'SELECT' in message
+
+def test_metrics_need_a_configured_token(metrics_app):
+    client = metrics_app.test_client()
+    client.get('/login')
+
+    metrics_app.config['METRICS_TOKEN'] = None
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics', headers={'Authorization': 'Bearer '}).status_code == 404
+
+    metrics_app.config['METRICS_TOKEN'] = TOKEN
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics', headers={'Authorization': 'Bearer guess'}).status_code == 404
+
+    response = client.get('/metrics', headers={'Authorization': f'Bearer {TOKEN}'})
+    assert response.status_code == 200
+    assert 'scuba_requests_total{endpoint="main.login"}' in response.get_data(as_text=True)
+
+def test_failed_statements_dont_leave_a_start_time(metrics_app):
+    with metrics_app.app_context(), db.engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text('SELECT * FROM no_such_table'))
+
+        assert conn.info['query_start'] == []
+        conn.execute(text('SELECT 1'))
+        assert conn.info['query_start'] == []
@@ -0,0 +1,110 @@
+"""The background job queue and the stats it keeps up to date."""
+
+from datetime import timedelta
+
+import pytest
+
+import jobs
+from conftest import log_in
+from models import db, utcnow, Job, UserStats, DivesiteStats
+
+DIVE_FORM = {
+    'date': '2024-03-01',
+    'rating': '2',
+    'bottom_time': '90',
+    'max_depth': '100',
+    'depth_units': 'feet',
+    'buddy_id': '-1',
+    'dive_type': ['night'],
+    'comments': 'Queued dive',
+}
+
+@pytest.fixture
+def flaky_task():
+    calls = []
+
+    @jobs.task
+    def flaky(n):
+        calls.append(n)
+        raise RuntimeError("boom")
+
+    yield calls
+    del jobs.tasks['flaky']
+
+def test_waiting_jobs_are_not_queued_twice(app):
+    with app.app_context():
+        jobs.enqueue('refresh_user_stats', 1)
+        jobs.enqueue('refresh_user_stats', 1)
+        jobs.enqueue('refresh_user_stats', 2)
+        db.session.commit()
+
+        assert sorted(job.key for job in Job.query) == ['refresh_user_stats:[1]', 'refresh_user_stats:[2]']
+
+def test_unknown_task(app):
+    with app.app_context(), pytest.raises(ValueError):
+        jobs.enqueue('no_such_task')
+
+def test_stats_catch_up_when_the_worker_runs(app):
+    client = log_in(app.test_client(), 1)
+    client.post('/divesites/1/new', data=DIVE_FORM)
+
+    with app.app_context():
+        # the route only queued the work
+        assert db.session.get(UserStats, 1).num_dives == 6
+        assert Job.query.count() == 2
+
+        assert jobs.work_once() == 2
+        # the leaderboards are re-ranked a little later
+        assert [job.task for job in Job.query] == ['rank_leaderboards']
+        assert db.session.get(UserStats, 1).num_dives == 7
+        assert db.session.get(UserStats, 1).max_depth == 100
+        assert db.session.get(DivesiteStats, 1).num_dives == 5
+
+def test_refresh_replaces_only_the_given_rows(app):
+    with app.app_context():
+        db.session.query(DivesiteStats).delete()
+        jobs.enqueue('refresh_divesite_stats', 1, 7)
+        db.session.commit()
+        jobs.work_once()
+
+        # divesite 7 has no dives, so no row
+        stats = DivesiteStats.query.all()
+        assert [row.divesite_id for row in stats] == [1]
+        assert stats[0].num_dives == 4
+        assert stats[0].avg_rating == pytest.approx((1 + 7 + 3 + 9) / 4)
+
+def test_failed_jobs_are_retried_with_backoff(app, flaky_task, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOBS_MAX_ATTEMPTS', 2)
+
+    with app.app_context():
+        jobs.enqueue('flaky', 3)
+        db.session.commit()
+
+        assert jobs.work_once() == 1
+        job = Job.query.one()
+        assert job.status == jobs.PENDING
+        assert job.run_at > utcnow() + timedelta(seconds=5)
+        assert 'boom' in job.last_error
+
+        # not due yet
+        assert jobs.work_once() == 0
+
+        job.run_at = utcnow()
+        db.session.commit()
+        jobs.work_once()
+
+        assert Job.query.one().status == jobs.FAILED
+        assert flaky_task == [3, 3]
+
+def test_abandoned_jobs_are_picked_up_again(app):
+    with app.app_context():
+        jobs.enqueue('refresh_user_stats', 1)
+        db.session.commit()
+
+        job = jobs.claim(10)[0]
+        assert jobs.claim(10) == []
+
+        job.locked_at = utcnow() - timedelta(seconds=app.config['JOBS_LOCK_TIMEOUT'] + 1)
+        db.session.commit()
+        assert jobs.work_once() == 1
+        assert Job.query.filter_by(task='refresh_user_stats').count() == 0
@@ -0,0 +1,187 @@
+"""Global and regional leaderboards."""
+
+import threading
+import time
+
+import pytest
+from sqlalchemy import select, update
+
+import jobs
+import leaderboards
+from app import create_app
+from conftest import log_in, seed_dataset
+from leaderboards import WORLD, place, rank_all, rank_leaderboards, rank_users, scope_for, top
+from models import db, Divesite, LeaderboardChange, LeaderboardRank, UserStats
+
+DEEP_DIVE = {
+    'date': '2024-03-01',
+    'rating': '9',
+    'bottom_time': '20',
+    'max_depth': '150',
+    'depth_units': 'feet',
+    'buddy_id': '-1',
+    'dive_type': ['deep'],
+    'comments': 'Very deep',
+}
+
+def test_top_of_a_board(app):
+    with app.app_context():
+        deepest = top('max_depth', limit=3)
+
+        assert [(entry.rank, entry.user.username, entry.value) for entry in deepest] == [
+            (1, 'dave', 63), (2, 'carol', 62), (3, 'bob', 61)
+        ]
+
+def test_ties_share_a_place(app):
+    with app.app_context():
+        assert [entry.rank for entry in top('num_dives')] == [1, 1, 1, 1]
+
+def test_your_place(app):
+    with app.app_context():
+        assert place('max_depth', 1).rank == 4
+        assert place('max_depth', 1, scope_for(continent='Asia')).rank == 4
+        # zed has no dives
+        assert place('max_depth', 5) is None
+        assert place('max_depth', 1, scope_for(country='Fiji')) is None
+
+def test_ranks_follow_new_dives(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'LEADERBOARD_RANK_DELAY', 0)
+
+    with app.app_context():
+        fiji = Divesite(name="Fiji Reef", lat=-17, lng=178, country="Fiji", continent="Oceania")
+        db.session.add(fiji)
+        db.session.commit()
+        fiji_id = fiji.id
+
+    client = log_in(app.test_client(), 1)
+    client.post(f'/divesites/{fiji_id}/new', data=DEEP_DIVE)
+
+    with app.app_context():
+        while jobs.work_once():
+            pass
+
+        assert place('max_depth', 1).rank == 1
+        assert place('max_depth', 1).value == 150
+        assert [entry.user.username for entry in top('max_depth', scope_for(country='Fiji'))] == ['alice']
+        assert place('max_depth', 1, scope_for(continent='Asia')).rank == 4
+        assert place('num_countries', 1, WORLD).value == 2
+
+def test_leaderboards_page(app):
+    client = log_in(app.test_client(), 1)
+    page = client.get('/leaderboards?board=max_depth').get_data(as_text=True)
+
+    assert 'Deepest Dive' in page
+    assert 'Your rank is #4 with 60.00 ft' in page
+    assert page.index('dave') < page.index('carol')
+
+def all_places():
+    return sorted(db.session.execute(
+        select(LeaderboardRank.board, LeaderboardRank.scope, LeaderboardRank.user_id,
+               LeaderboardRank.value, LeaderboardRank.rank)
+    ).all())
+
+def run_jobs():
+    while jobs.work_once():
+        pass
+
+def test_moving_users_matches_ranking_from_scratch(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'LEADERBOARD_RANK_DELAY', 0)
+
+    with app.app_context():
+        fiji = Divesite(name="Fiji Reef", lat=-17, lng=178, country="Fiji", continent="Oceania")
+        db.session.add(fiji)
+        db.session.commit()
+        fiji_id = fiji.id
+
+    # a newcomer, ties broken and made, someone overtaken, a dive deleted
+    log_in(app.test_client(), 5).post(f'/divesites/{fiji_id}/new', data=DEEP_DIVE)
+    log_in(app.test_client(), 1).post(f'/divesites/{fiji_id}/new', data=dict(DEEP_DIVE, max_depth='62'))
+    log_in(app.test_client(), 2).post('/divesites/1/new', data=dict(DEEP_DIVE, max_depth='10'))
+    log_in(app.test_client(), 3).post('/dives/3/delete')
+
+    with app.app_context():
+        run_jobs()
+        assert LeaderboardChange.query.count() == 0
+        moved = all_places()
+
+        rank_all()
+        assert moved == all_places()
+
+def test_deleted_users_leave_no_gaps(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'LEADERBOARD_RANK_DELAY', 0)
+
+    # dave (4) is deepest
+    log_in(app.test_client(), 4).post('/users/delete')
+
+    with app.app_context():
+        # ranked before the purge gets to their dives
+        rank_leaderboards()
+        db.session.commit()
+        assert [(entry.rank, entry.user.username) for entry in top('max_depth')] == [
+            (1, 'carol'), (2, 'bob'), (3, 'alice')
+        ]
+        assert place('max_depth', 4) is None
+
+        run_jobs()
+
+        moved = all_places()
+        rank_all()
+        assert moved == all_places()
+
+@pytest.fixture
+def file_app(tmp_path):
+    """An app on an SQLite file, so two threads can hold transactions at once."""
+
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'ranks.db'}"})
+    with app.app_context():
+        db.create_all()
+        seed_dataset()
+
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+def test_overlapping_rankings_wait_for_each_other(file_app, monkeypatch):
+    with file_app.app_context():
+        # alice (1) and bob (2) both overtake everyone
+        db.session.execute(update(UserStats).where(UserStats.user_id == 1).values(max_depth=1000))
+        db.session.execute(update(UserStats).where(UserStats.user_id == 2).values(max_depth=999))
+        db.session.commit()
+
+    first_started = threading.Event()
+    events = []
+    real_current_values = leaderboards.current_values
+
+    def current_values(user_id):
+        events.append(f"read {user_id}")
+        if user_id == 1:
+            first_started.set()
+            # long enough for the second ranking to get going if it could
+            time.sleep(0.2)
+        return real_current_values(user_id)
+
+    monkeypatch.setattr(leaderboards, 'current_values', current_values)
+
+    def rank(user_id):
+        with file_app.app_context():
+            if user_id == 2:
+                first_started.wait(5)
+            rank_users([user_id])
+            db.session.commit()
+            events.append(f"committed {user_id}")
+
+    threads = [threading.Thread(target=rank, args=(user_id,)) for user_id in (1, 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert events == ['read 1', 'committed 1', 'read 2', 'committed 2']
+
+    with file_app.app_context():
+        assert [(entry.rank, entry.user_id) for entry in top('max_depth', limit=3)] == [(1, 1), (2, 2), (3, 4)]
+        moved = all_places()
+        rank_all()
+        assert moved == all_places()
@@ -0,0 +1,65 @@
+"""Streamed logbook exports."""
+
+import csv
+import io
+import json
+from xml.etree import ElementTree
+
+from conftest import log_in
+from models import db, Dive
+from test_profiles import DIVE_FORM, profile_csv, square_profile
+
+def test_csv_has_every_dive_oldest_first(app):
+    client = log_in(app.test_client(), 1)
+    response = client.get('/users/1/logbook.csv')
+
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    assert 'attachment; filename="alice-logbook.csv"' == response.headers['Content-Disposition']
+
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    with app.app_context():
+        assert len(rows) == Dive.query.filter_by(user_id=1).count()
+    assert [row['date'] for row in rows] == sorted(row['date'] for row in rows)
+
+def test_json_matches_csv(app):
+    client = log_in(app.test_client(), 1)
+
+    dives = json.loads(client.get('/users/1/logbook.json').get_data(as_text=True))['dives']
+    rows = list(csv.DictReader(io.StringIO(client.get('/users/1/logbook.csv').get_data(as_text=True))))
+
+    assert [dive['divesite'] for dive in dives] == [row['divesite'] for row in rows]
+    assert [";".join(dive['dive_types']) for dive in dives] == [row['dive_types'] for row in rows]
+
+def test_small_chunks_give_the_same_output(app):
+    client = log_in(app.test_client(), 1)
+    whole = client.get('/users/1/logbook.json').get_data()
+
+    app.config.update(LOGBOOK_BATCH_SIZE=2, LOGBOOK_CHUNK_BYTES=100)
+    response = client.get('/users/1/logbook.json')
+
+    assert len(list(response.response)) > 1
+    assert client.get('/users/1/logbook.json').get_data() == whole
+
+def test_uddf_includes_profiles(app):
+    client = log_in(app.test_client(), 1)
+    data = dict(DIVE_FORM, profile_upload=(profile_csv(*square_profile(minutes=2, depth=10)), 'dive.csv'))
+    client.post('/divesites/2/new', data=data, content_type='multipart/form-data')
+
+    uddf = ElementTree.fromstring(client.get('/users/1/logbook.uddf').get_data())
+    dives = uddf.findall('profiledata/repetitiongroup/dive')
+    sites = {site.get('id') for site in uddf.findall('divesite/site')}
+
+    with app.app_context():
+        assert len(dives) == Dive.query.filter_by(user_id=1).count()
+    assert {dive.find('informationbeforedive/link').get('ref') for dive in dives} <= sites
+    assert len(dives[-1].findall('samples/waypoint')) == 121
+    assert dives[-1].find('informationafterdive/greatestdepth').text == '10.00'
+
+def test_unknown_formats_and_visitors(app):
+    client = app.test_client()
+    assert client.get('/users/1/logbook.csv').status_code == 302
+
+    client = log_in(client, 1)
+    assert client.get('/users/1/logbook.xlsx').status_code == 404
+    assert client.get('/users/99/logbook.csv').status_code == 404
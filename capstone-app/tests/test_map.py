@@ -0,0 +1,13 @@
+"""The map's divesite lookups."""
+
+def test_divesites_in_bounds(client):
+    sites = client.get('/get_dive_sites?ne_lat=10.25&ne_lng=20.25&sw_lat=9&sw_lng=19').get_json()
+
+    assert sorted(site['name'] for site in sites) == ['Reef 0', 'Reef 1', 'Reef 2']
+
+def test_only_changes_since_previous_bounds(client):
+    change = client.get('/get_dive_sites?ne_lat=10.45&ne_lng=20.45&sw_lat=10.15&sw_lng=20.15'
+                        '&prev_ne_lat=10.25&prev_ne_lng=20.25&prev_sw_lat=9&prev_sw_lng=19').get_json()
+
+    assert sorted(site['name'] for site in change['added']) == ['Reef 3', 'Reef 4']
+    assert sorted(change['removed']) == [1, 2]
@@ -0,0 +1,92 @@
+"""The on-demand request profiler."""
+
+import json
+import threading
+import time
+
+import pytest
+
+from conftest import log_in
+from profiler import Profile
+
+TOKEN = 'profile-me'
+
+@pytest.fixture
+def profiled_app(app, tmp_path):
+    original = {key: value for key, value in app.config.items() if key.startswith('PROFILER_')}
+    app.config.update(PROFILER_TOKEN=TOKEN, PROFILER_DIR=str(tmp_path), PROFILER_INTERVAL_MS=1)
+    yield app
+    app.config.update(original)
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+def test_requests_with_the_token_are_profiled(profiled_app, tmp_path):
+    client = log_in(profiled_app.test_client(), 1)
+
+    response = client.get('/users/1?token=secret', headers={'X-Profile': TOKEN})
+    profile_id = response.headers['X-Profile-Id']
+
+    assert response.status_code == 200
+    assert 'main.users_show' in profile_id
+    assert (tmp_path / f"{profile_id}.collapsed").exists()
+
+    speedscope = json.loads((tmp_path / f"{profile_id}.speedscope.json").read_text())
+    python, sql = speedscope['profiles']
+    assert speedscope['name'] == 'GET /users/1 (main.users_show)'
+    assert 'secret' not in (tmp_path / f"{profile_id}.speedscope.json").read_text()
+    assert python['type'] == 'sampled' and len(python['samples']) == len(python['weights'])
+
+    frames = speedscope['shared']['frames']
+    statements = [frames[event['frame']]['name'] for event in sql['events'] if event['type'] == 'O']
+    assert statements and all(name.startswith('SQL: SELECT') for name in statements)
+    assert all(close['at'] >= start['at'] for start, close in zip(sql['events'][::2], sql['events'][1::2]))
+
+def test_requests_without_the_token_are_not(profiled_app, tmp_path):
+    client = profiled_app.test_client()
+
+    assert 'X-Profile-Id' not in client.get('/', headers={'X-Profile': 'guess'}).headers
+    assert 'X-Profile-Id' not in client.get('/').headers
+
+    profiled_app.config['PROFILER_TOKEN'] = None
+    assert 'X-Profile-Id' not in client.get('/', headers={'X-Profile': ''}).headers
+    assert not list(tmp_path.iterdir())
+
+def test_a_sample_of_requests_is_profiled(profiled_app, tmp_path):
+    profiled_app.config['PROFILER_SAMPLE_RATE'] = 1.0
+
+    response = profiled_app.test_client().get('/')
+
+    assert 'main.homepage' in response.headers['X-Profile-Id']
+
+def test_only_the_newest_profiles_are_kept(profiled_app, tmp_path):
+    profiled_app.config['PROFILER_KEEP'] = 2
+    client = profiled_app.test_client()
+
+    ids = []
+    for _ in range(3):
+        ids.append(client.get('/', headers={'X-Profile': TOKEN}).headers['X-Profile-Id'])
+        time.sleep(0.01)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        f"{profile_id}{suffix}" for profile_id in ids[1:] for suffix in ('.collapsed', '.speedscope.json')
+    )
+
+def test_samples_show_the_running_stack_and_statement():
+    profile = Profile(threading.get_ident(), 0.001)
+    profile.start_sampling()
+    busy(0.05)
+    profile.statement_started("SELECT users.id\n  FROM users; ")
+    busy(0.05)
+    profile.statement_finished()
+    profile.stop()
+
+    lines = profile.collapsed().splitlines()
+    in_sql = [line for line in lines if 'SQL: ' in line]
+
+    assert any('busy (test_profiler.py:' in line for line in lines)
+    assert in_sql and all(line.rsplit(' ', 1)[0].endswith('SQL: SELECT users.id FROM users,') for line in in_sql)
+    assert sum(int(line.rsplit(' ', 1)[1]) for line in lines) == len(profile.samples)
+    assert profile.queries[0][0] == 'SELECT users.id FROM users,'
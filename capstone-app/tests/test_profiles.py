@@ -0,0 +1,101 @@
+"""Dive computer profiles."""
+
+import io
+
+import numpy as np
+
+from conftest import log_in
+from models import db, Dive
+from profiles import DEPTH_SCALE, downsample, make_profile, pack, read_samples, summary, unpack
+
+DIVE_FORM = {
+    'date': '2024-03-01',
+    'rating': '8',
+    'depth_units': 'meters',
+    'buddy_id': '-1',
+    'comments': 'Computer dive',
+}
+
+def square_profile(minutes=60, depth=18.0):
+    """One sample a second: down over a minute, `depth` metres, up over a minute."""
+
+    seconds = np.arange(minutes * 60 + 1, dtype=float)
+    depths = np.minimum(np.minimum(seconds, seconds[-1] - seconds) / 60 * depth, depth)
+    temperatures = 24 - depths / 6
+    return seconds, depths, temperatures
+
+def profile_csv(seconds, depths, temperatures):
+    lines = ["time,depth,temperature"]
+    lines += [f"{s:.0f},{d:.2f},{t:.1f}" for s, d, t in zip(seconds, depths, temperatures)]
+    return io.BytesIO("\n".join(lines).encode())
+
+def test_pack_round_trips_to_the_centimetre():
+    depths = np.array([0, 0.5, 3.27, 18.004, 17.996, 0])
+
+    assert np.allclose(unpack(pack(depths, DEPTH_SCALE), DEPTH_SCALE), depths, atol=0.005)
+
+def test_an_hour_at_one_hertz_packs_small():
+    profile = make_profile(*square_profile())
+
+    assert profile.num_samples == 3601
+    assert profile.interval == 1.0
+    assert len(profile.depths) + len(profile.temperatures) < 4 * 1024
+
+def test_summary():
+    max_depth, bottom_time = summary(make_profile(*square_profile(minutes=40, depth=30)))
+
+    assert round(max_depth / 3.28084, 2) == 30
+    assert round(bottom_time) == 40
+
+def test_downsample_keeps_the_extremes():
+    depths = np.full(10000, 10.0)
+    depths[1234] = 40.0
+    depths[5678] = 2.0
+
+    indexes = downsample(depths, 100)
+
+    assert len(indexes) <= 202
+    assert {0, 1234, 5678, 9999} <= set(indexes.tolist())
+
+def test_bad_uploads_are_rejected():
+    too_long = "0,5\n0.001,5\n0.002,5\n3000000,5"
+    for text in ("", "0,5", "time,depth\n0,5\n0,6", "0,5\n10,-3", "0,five\n10,6", too_long):
+        try:
+            read_samples(text)
+        except ValueError:
+            continue
+        raise AssertionError(f"{text!r} was accepted")
+
+def test_uploading_a_profile(app):
+    client = log_in(app.test_client(), 1)
+    data = dict(DIVE_FORM, profile_upload=(profile_csv(*square_profile(minutes=45, depth=25)), 'dive.csv'))
+
+    response = client.post('/divesites/2/new', data=data, content_type='multipart/form-data')
+    assert response.status_code == 302
+
+    with app.app_context():
+        dive = db.session.execute(db.select(Dive).order_by(Dive.id.desc())).scalars().first()
+        assert round(dive.max_depth / 3.28084) == 25
+        assert round(dive.bottom_time) == 45
+        dive_id = dive.id
+
+    page = client.get(f'/dives/{dive_id}').get_data(as_text=True)
+    assert '<polyline' in page
+    assert '45 min, max 25.0 m' in page
+
+def test_depth_is_required_without_a_profile(app):
+    client = log_in(app.test_client(), 1)
+
+    response = client.post('/divesites/2/new', data=DIVE_FORM)
+    assert response.status_code == 200
+    assert 'Enter this or upload a dive computer profile.' in response.get_data(as_text=True)
+
+def test_unpackable_profiles_are_a_form_error(app):
+    client = log_in(app.test_client(), 1)
+
+    for text in ("0,0\n1,340\n2,0", "0,5,20\n1,5,4000"):
+        data = dict(DIVE_FORM, profile_upload=(io.BytesIO(text.encode()), 'dive.csv'))
+        response = client.post('/divesites/2/new', data=data, content_type='multipart/form-data')
+
+        assert response.status_code == 200
+        assert 'Samples change too quickly between readings' in response.get_data(as_text=True)
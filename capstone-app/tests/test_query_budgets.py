@@ -0,0 +1,149 @@
+"""Every route in app.py has a budget for SQL statements and rows loaded.
+
+Templates call model methods (average_rating, get_divetypes, the
+leaderboards) directly, so a lazy relationship or per-row query added to a
+template quietly multiplies the queries a page runs. These tests render
+each route against the seeded dataset and fail when a route goes over
+its budget.
+
+When a change legitimately needs more queries, raise the budget in the
+same commit and say why. When a change saves queries, lower it.
+
+A budget only holds if a route's query count doesn't depend on how much
+data there is, so test_queries_dont_grow_with_the_data renders every page
+again after adding more buddies, divesites and dives. The row budgets do
+grow with the data: they cover what the seeded pages show.
+"""
+
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import QueryCounter, flask_app, log_in
+from heatmap import DIVE_TYPES
+from models import db, Buddy, Dive, Divesite, Divetype, User
+from stats import rebuild_all as rebuild_stats
+
+DIVE_FORM = {
+    'date': '2024-03-01',
+    'rating': '8',
+    'bottom_time': '45',
+    'max_depth': '20',
+    'depth_units': 'meters',
+    'buddy_id': '-1',
+    'dive_type': ['night'],
+    'comments': 'Budget dive',
+}
+
+# (endpoint, method, url, form data, max queries, max rows loaded)
+ROUTE_BUDGETS = [
+    ('homepage', 'GET', '/', None, 8, 38),
+    ('signup', 'GET', '/signup', None, 1, 1),
+    ('signup', 'POST', '/signup', {'username': 'erin', 'password': 'password', 'first_name': 'E', 'last_name': 'D'}, 3, 1),
+    ('login', 'GET', '/login', None, 1, 1),
+    ('login', 'POST', '/login', {'username': 'alice', 'password': 'password'}, 3, 1),
+    ('logout', 'GET', '/logout', None, 1, 1),
+    ('get_divesites', 'GET', '/get_dive_sites?ne_lat=12&ne_lng=22&sw_lat=9&sw_lng=19', None, 2, 19),
+    ('get_divesites', 'GET', '/get_dive_sites?ne_lat=12&ne_lng=22&sw_lat=10.5&sw_lng=20.5&prev_ne_lat=11&prev_ne_lng=21&prev_sw_lat=9&prev_sw_lng=19', None, 3, 8),
+    ('search', 'GET', '/search?category=divesites&q=reef', None, 3, 19),
+    ('search', 'GET', '/search?category=divesites', None, 3, 19),
+    ('search', 'GET', '/search?category=users&q=a', None, 4, 6),
+    ('users_show', 'GET', '/users/1', None, 7, 23),
+    ('users_show', 'GET', '/users/2', None, 8, 23),
+    ('users_analytics', 'GET', '/users/1/analytics', None, 8, 8),
+    ('users_logbook', 'GET', '/users/1/logbook.csv', None, 2, 1),
+    ('users_logbook', 'GET', '/users/1/logbook.uddf', None, 3, 1),
+    ('delete_user', 'POST', '/users/delete', None, 7, 1),
+    ('show_buddies', 'GET', '/users/1/buddies', None, 8, 8),
+    ('show_buddies_to', 'GET', '/users/1/buddies-to', None, 7, 8),
+    ('add_buddy', 'POST', '/users/add-buddy/2', None, 4, 2),
+    ('remove_buddy', 'POST', '/users/remove-buddy/2', None, 3, 1),
+    ('profile', 'GET', '/users/profile', None, 1, 1),
+    ('profile', 'POST', '/users/profile', {'username': 'alice', 'password': 'password', 'bio': 'Hi', 'image_url': '', 'header_image_url': ''}, 4, 1),
+    ('view_map', 'GET', '/divesites/map', None, 1, 1),
+    ('add_divesite', 'GET', '/divesites/new', None, 1, 1),
+    ('add_divesite', 'POST', '/divesites/new', {'name': 'New Reef', 'lat': '1.5', 'lng': '2.5', 'ocean': 'Indian', 'country': 'Maldives', 'continent': 'Asia', 'location': 'Here'}, 5, 1),
+    ('show_divesite', 'GET', '/divesites/1', None, 4, 13),
+    ('delete_divesite', 'POST', '/divesites/1/delete', None, 9, 2),
+    ('add_dive', 'GET', '/divesites/1/new', None, 2, 4),
+    ('add_dive', 'POST', '/divesites/1/new', DIVE_FORM, 12, 4),
+    ('dives_show', 'GET', '/dives/1', None, 5, 5),
+    ('dives_edit', 'GET', '/dives/1/edit', None, 3, 5),
+    ('dives_edit', 'POST', '/dives/1/edit', dict(DIVE_FORM, dive_no='1'), 13, 6),
+    ('dives_delete', 'POST', '/dives/1/delete', None, 10, 3),
+    ('dive_heatmap', 'GET', '/heatmap?zoom=8', None, 3, 1),
+    ('dive_heatmap', 'GET', '/heatmap?zoom=3&type=night&start=2024-01-05', None, 2, 1),
+    ('leaderboards', 'GET', '/leaderboards', None, 2, 8),
+    ('leaderboards', 'GET', '/leaderboards?board=max_depth&continent=Asia', None, 2, 8),
+]
+
+@pytest.mark.parametrize(
+    'endpoint, method, url, data, max_queries, max_rows',
+    ROUTE_BUDGETS,
+    ids=[f"{method} {url}" for _, method, url, *_ in ROUTE_BUDGETS]
+)
+def test_route_query_budget(app, query_budget, endpoint, method, url, data, max_queries, max_rows):
+    client = log_in(app.test_client(), 1)
+
+    with query_budget(max_queries, max_rows):
+        response = client.open(url, method=method, data=data)
+        # Streamed responses run their queries as the body is read
+        response.get_data()
+
+    assert response.status_code < 400
+
+def test_every_route_has_a_budget():
+    app_endpoints = {
+        endpoint.removeprefix('main.') for endpoint, view in flask_app.view_functions.items()
+        if view.__module__ == 'app'
+    }
+    budgeted = {endpoint for endpoint, *_ in ROUTE_BUDGETS}
+
+    assert app_endpoints - budgeted == set()
+
+def grow_dataset():
+    """Gives alice (user 1) six more buddies, who all add her back, and
+    each of them a dozen dives with a buddy, over six new divesites."""
+
+    sites = [Divesite(name=f"Atoll {i}", lat=10.5 + i * 0.1, lng=20.5 + i * 0.1, ocean="Indian",
+                      country="Maldives", continent="Asia", location="Maldives, Asia", api_id=f"grow-{i}")
+             for i in range(6)]
+    hashed = db.session.get(User, 1).password
+    users = [User(username=f"diver{i}", password=hashed, first_name="More", last_name="Diver") for i in range(6)]
+    db.session.add_all(sites + users)
+    db.session.flush()
+
+    for user in users:
+        db.session.add_all([Buddy(buddy_user_id=1, main_user_id=user.id), Buddy(buddy_user_id=user.id, main_user_id=1)])
+        for n in range(12):
+            dive = Dive(user_id=user.id, dive_no=n + 1, divesite_id=sites[n % 6].id if n % 2 else 1,
+                        date=date(2024, 2, 1) + timedelta(days=n), rating=7, bottom_time=40, max_depth=50 + n,
+                        buddy_id=1)
+            db.session.add(dive)
+            db.session.flush()
+            db.session.add(Divetype(dive_id=dive.id, **{name: name in ('night', 'deep') for name in DIVE_TYPES}))
+
+    rebuild_stats()
+    db.session.commit()
+
+GET_ROUTES = [budget for budget in ROUTE_BUDGETS if budget[1] == 'GET']
+
+@pytest.mark.parametrize('url', [url for _, _, url, *_ in GET_ROUTES])
+def test_queries_dont_grow_with_the_data(app, url):
+    def count_queries():
+        # Warms the per-process caches (heatmap rasters, the catalogue),
+        # which are rebuilt after the data changes; then the page is
+        # rendered again with cold fragment caches, so they hide nothing
+        log_in(app.test_client(), 1).get(url).get_data()
+        app.extensions['fragment_cache'].backend.clear()
+        app.extensions['search_cache'].backend.clear()
+
+        with QueryCounter() as counter:
+            log_in(app.test_client(), 1).get(url).get_data()
+        return counter.queries
+
+    seeded = count_queries()
+    with app.app_context():
+        grow_dataset()
+
+    assert count_queries() == seeded
@@ -0,0 +1,78 @@
+"""Read replica routing, against two SQLite files standing in for the
+primary and a replica that hasn't caught up yet.
+
+The replica only has the users: read-only views answered from it find no
+divesites, while the primary has all of the seeded ones.
+"""
+
+import pytest
+from sqlalchemy import insert, select
+
+from app import create_app
+from conftest import log_in, seed_dataset
+from models import db, Divesite, User
+
+MAP_BOUNDS = '/get_dive_sites?ne_lat=12&ne_lng=22&sw_lat=0&sw_lng=0'
+
+@pytest.fixture
+def replica_app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'primary.db'}",
+        'DATABASE_REPLICA_URL': f"sqlite:///{tmp_path / 'replica.db'}",
+    })
+
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(db.engines['replica'])
+        seed_dataset()
+
+        users = [dict(row._mapping) for row in db.session.execute(select(User.__table__))]
+        with db.engines['replica'].begin() as conn:
+            conn.execute(insert(User.__table__), users)
+
+    app.extensions['fragment_cache'].backend.clear()
+
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+def test_read_only_views_use_the_replica(replica_app):
+    client = log_in(replica_app.test_client(), 1)
+
+    assert client.get(MAP_BOUNDS).get_json() == []
+
+def test_other_views_use_the_primary(replica_app):
+    client = log_in(replica_app.test_client(), 1)
+
+    assert client.get('/divesites/1/new').status_code == 200
+
+def test_writes_go_to_the_primary(replica_app):
+    client = log_in(replica_app.test_client(), 1)
+    client.post('/divesites/new', data={'name': 'New Reef', 'lat': '1.5', 'lng': '2.5', 'ocean': 'Indian',
+                                        'country': 'Maldives', 'continent': 'Asia', 'location': 'Here'})
+
+    with replica_app.app_context():
+        assert Divesite.query.filter_by(name='New Reef').count() == 1
+        with db.engines['replica'].connect() as conn:
+            assert conn.execute(select(Divesite.id)).all() == []
+
+def test_writer_reads_from_the_primary_afterwards(replica_app):
+    writer = log_in(replica_app.test_client(), 1)
+    writer.post('/users/add-buddy/5')
+
+    assert len(writer.get(MAP_BOUNDS).get_json()) == 18
+
+    reader = log_in(replica_app.test_client(), 2)
+    assert reader.get(MAP_BOUNDS).get_json() == []
+
+def test_stickiness_wears_off(replica_app):
+    replica_app.config['REPLICA_STICKY_SECONDS'] = -1
+    client = log_in(replica_app.test_client(), 1)
+    client.post('/users/add-buddy/5')
+
+    assert client.get(MAP_BOUNDS).get_json() == []
@@ -0,0 +1,49 @@
+"""Cached search results."""
+
+from conftest import QueryCounter, log_in
+
+NEW_DIVESITE = {'name': 'New Reef', 'lat': '1.5', 'lng': '2.5', 'ocean': 'Indian',
+                'country': 'Maldives', 'continent': 'Asia', 'location': 'Here'}
+
+def search(client, url):
+    with QueryCounter() as counter:
+        page = client.get(url).get_data(as_text=True)
+    return page, " ".join(counter.statements).lower()
+
+def test_repeat_searches_skip_the_scan_and_count(client):
+    first, statements = search(client, '/search?category=divesites&q=reef')
+    assert 'count(' in statements
+
+    again, statements = search(client, '/search?category=divesites&q=%20%20REEF%20')
+    assert again.count('Reef ') == first.count('Reef ')
+    assert 'count(' not in statements
+    assert 'divesites.id in' in statements
+
+def test_page_flips_reuse_the_count(client):
+    search(client, '/search?category=divesites')
+
+    second_page, statements = search(client, '/search?category=divesites&page=2')
+    assert 'count(' not in statements
+    assert 'Reef 17' in second_page
+
+def test_new_divesites_invalidate(app):
+    client = log_in(app.test_client(), 1)
+    search(client, '/search?category=divesites&q=new')
+
+    client.post('/divesites/new', data=NEW_DIVESITE)
+
+    page, statements = search(client, '/search?category=divesites&q=new')
+    assert 'New Reef' in page
+    assert 'count(' in statements
+
+def test_signups_and_renames_invalidate(app):
+    client = app.test_client()
+    assert 'erin' not in search(client, '/search?category=users&q=er')[0]
+
+    client.post('/signup', data={'username': 'erin', 'password': 'password', 'first_name': 'E', 'last_name': 'D'})
+    assert 'erin' in search(client, '/search?category=users&q=er')[0]
+
+    client.post('/users/profile', data={'username': 'ernie', 'password': 'password', 'bio': '',
+                                        'image_url': '', 'header_image_url': ''})
+    page = search(client, '/search?category=users&q=er')[0]
+    assert 'ernie' in page and 'erin' not in page
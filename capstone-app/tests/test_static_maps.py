@@ -0,0 +1,131 @@
+"""Static map proxying against a local stub upstream, and the disk cache."""
+
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from disk_cache import DiskCache
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'map' * 100
+
+class StubUpstream(BaseHTTPRequestHandler):
+    """Answers like the Static Maps API: a PNG, or whatever `reply` says."""
+
+    calls = []
+    reply = (200, 'image/png', PNG)
+
+    def do_GET(self):
+        StubUpstream.calls.append(parse_qs(urlsplit(self.path).query))
+        status, content_type, body = StubUpstream.reply
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def upstream():
+    StubUpstream.calls = []
+    StubUpstream.reply = (200, 'image/png', PNG)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubUpstream)
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def map_client(app, upstream, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'STATIC_MAPS_UPSTREAM', f'http://127.0.0.1:{upstream.server_port}/staticmap')
+    monkeypatch.setitem(app.extensions, 'static_maps', DiskCache(str(tmp_path), 1024 * 1024, suffix='.png'))
+    return app.test_client()
+
+def test_first_request_fetches_from_upstream(app, map_client):
+    response = map_client.get('/static-maps/1/11.png')
+
+    assert response.status_code == 200
+    assert response.data == PNG
+    [params] = StubUpstream.calls
+    assert params['center'] == ['10.0,20.0']
+    assert params['zoom'] == ['11']
+    assert params['size'] == ['600x400']
+    assert params['key'] == [app.config['STATIC_MAPS_API_KEY']]
+
+def test_cached_maps_skip_upstream(map_client):
+    map_client.get('/static-maps/1/11.png')
+    again = map_client.get('/static-maps/1/11.png')
+    other_size = map_client.get('/static-maps/1/11.png?size=800x400')
+
+    assert again.data == other_size.data == PNG
+    assert len(StubUpstream.calls) == 2
+    assert StubUpstream.calls[1]['size'] == ['800x400']
+
+def test_responses_are_cached_for_a_year(app, map_client):
+    response = map_client.get('/static-maps/1/11.png')
+
+    assert response.mimetype == 'image/png'
+    assert response.cache_control.public
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == 60 * 60 * 24 * 365
+    assert app.config['STATIC_MAPS_API_KEY'] not in str(response.headers)
+
+@pytest.mark.parametrize('reply', [
+    (500, 'text/plain', b'oops'),
+    (200, 'text/html', b'<p>quota exceeded</p>'),
+])
+def test_upstream_errors_are_a_502_and_not_cached(map_client, reply):
+    StubUpstream.reply = reply
+    assert map_client.get('/static-maps/1/11.png').status_code == 502
+
+    StubUpstream.reply = (200, 'image/png', PNG)
+    assert map_client.get('/static-maps/1/11.png').data == PNG
+    assert len(StubUpstream.calls) == 2
+
+def test_unreachable_upstream_is_a_502(map_client, upstream):
+    upstream.shutdown()
+    upstream.server_close()
+
+    assert map_client.get('/static-maps/1/11.png').status_code == 502
+
+def test_bad_zoom_size_or_site_is_a_404(map_client):
+    assert map_client.get('/static-maps/1/22.png').status_code == 404
+    assert map_client.get('/static-maps/1/11.png?size=4000x4000').status_code == 404
+    assert map_client.get('/static-maps/999/11.png').status_code == 404
+    assert not StubUpstream.calls
+
+def test_disk_cache_evicts_least_recently_read(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=250)
+    old = cache.put('old', b'a' * 100)
+    recent = cache.put('recent', b'b' * 100)
+    past = time.time() - 60
+    os.utime(old, (past, past))
+    os.utime(cache._key_path('old'), (past, past))
+
+    cache.put('new', b'c' * 100)
+
+    # the evicted blob's key file went with it
+    assert len(os.listdir(tmp_path / 'keys')) == 2
+    assert cache.get('old') is None
+    assert cache.get('recent') == recent
+    assert cache.get('new') is not None
+
+def test_disk_cache_drops_keys_of_evicted_blobs(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=250)
+    cache.put('first', b'a' * 100)
+    cache.put('same blob', b'a' * 100)
+    cache.put('second', b'b' * 100)
+    past = time.time() - 60
+    os.utime(cache.get('first'), (past, past))
+
+    cache.put('third', b'c' * 100)
+
+    # both keys of the evicted blob are gone, though 'same blob' was read recently
+    assert sorted(os.listdir(tmp_path / 'keys')) == sorted(
+        os.path.basename(cache._key_path(key)) for key in ('second', 'third')
+    )